@@ -0,0 +1,250 @@
+"""
+Admission control and backpressure in front of BookChatbot.process_message.
+
+At most ``limit`` requests run at once; up to ``max_queue`` more wait in a
+priority queue for at most ``queue_timeout`` seconds. Everything else is
+rejected straight away rather than piling up in Flask threads:
+
+- 429 when one user already has ``per_user`` requests running or queued
+  (requests without a user id are not limited per user),
+- 503 when the queue is full (or the wait timed out),
+
+both with a Retry-After estimate. Queries expected to be cheap (ones
+recently answered from the graph or the web-result cache) queue ahead of
+ones likely to need Tavily and extra LLM calls, and may displace them
+when the queue is full.
+
+The concurrency limit adapts to observed latency (AIMD): it shrinks by
+``decrease`` (at most once per ``target_latency`` seconds) when the
+smoothed request latency goes above ``target_latency``, and grows by
+about one per round of requests while they are fast and the limit is
+actually being used.
+"""
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from metrics import REGISTRY
+from query_analysis import analyze
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+
+
+class Rejected(Exception):
+    """The request was not admitted; ``status`` is 429 or 503."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "user_id", "event", "granted", "rejection")
+
+    def __init__(self, priority: int, seq: int, user_id: Optional[str]):
+        self.priority = priority
+        self.seq = seq
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+        self.rejection: Optional[Rejected] = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 16, min_concurrency: int = 2, max_queue: int = 64,
+                 per_user: int = 2, queue_timeout: float = 10.0, target_latency: float = 15.0,
+                 decrease: float = 0.8, hint_size: int = 4096):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.decrease = decrease
+
+        self.running = 0
+        self.latency_ewma = 0.0
+        self._last_decrease = 0.0
+        self.rejected = {429: 0, 503: 0}
+        self._queue: list = []
+        self._queued = 0
+        self._per_user: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # normText -> route of recent answers, to tell cheap queries apart
+        self._hints: "OrderedDict[str, str]" = OrderedDict()
+        self._hint_size = hint_size
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16")),
+            min_concurrency=int(os.getenv("ADMISSION_MIN_CONCURRENCY", "2")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+            per_user=int(os.getenv("ADMISSION_PER_USER", "2")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+            target_latency=float(os.getenv("ADMISSION_TARGET_LATENCY", "15")),
+        )
+
+    # — priority
+
+    def priority_for(self, norm_query: str, query: Optional[str] = None) -> int:
+        """
+        Priority of a question (``query`` as asked, when available, so place
+        names keep their capitals) from the route it took before, or else
+        from the agent the router will send it to.
+        """
+        with self._lock:
+            route = self._hints.get(norm_query)
+        if route in ("graph", "web"):
+            # Answered from the graph, or the web results are now cached
+            return HIGH
+        if route is None and analyze(query or norm_query).agent is None:
+            return NORMAL
+        return LOW
+
+    def remember(self, norm_query: str, route: str) -> None:
+        if route == "error":
+            return
+        with self._lock:
+            self._hints[norm_query] = route
+            self._hints.move_to_end(norm_query)
+            while len(self._hints) > self._hint_size:
+                self._hints.popitem(last=False)
+
+    # — admission
+
+    def _retry_after(self) -> int:
+        """Rough seconds until a slot frees up for someone at the back of the queue."""
+        per_slot = self.latency_ewma or self.target_latency
+        return max(1, math.ceil(per_slot * (self._queued + 1) / max(1.0, self.limit)))
+
+    def _reject(self, status: int, reason: str) -> Rejected:
+        self.rejected[status] += 1
+        REGISTRY.observe(f"admission.rejected_{status}", 0.0)
+        return Rejected(status, reason, self._retry_after())
+
+    def acquire(self, user_id: Optional[str], priority: int = NORMAL) -> float:
+        """
+        Wait for a slot; returns the seconds spent queued. Raises Rejected
+        if the request can't be admitted. Every successful acquire must be
+        paired with ``release``.
+        """
+        start = time.monotonic()
+        with self._lock:
+            if user_id is not None and self._per_user.get(user_id, 0) >= self.per_user:
+                raise self._reject(429, "Too many concurrent requests for this user")
+            if self.running < int(self.limit) and not self._queued:
+                self.running += 1
+                self._add_user(user_id)
+                return 0.0
+
+            if self._queued >= self.max_queue:
+                # Full: make room only by displacing the least important waiter
+                worst = max((w for w in self._queue if not w.event.is_set()), default=None)
+                if worst is None or worst.priority <= priority:
+                    raise self._reject(503, "Server is busy")
+                worst.rejection = self._reject(503, "Server is busy")
+                self._drop(worst)
+
+            waiter = _Waiter(priority, next(self._seq), user_id)
+            heapq.heappush(self._queue, waiter)
+            self._queued += 1
+            self._add_user(user_id)
+
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if not waiter.granted and waiter.rejection is None:
+                self._drop(waiter)
+                waiter.rejection = self._reject(503, "Timed out waiting for capacity")
+        if waiter.rejection is not None:
+            raise waiter.rejection
+
+        waited = time.monotonic() - start
+        REGISTRY.observe("admission.queue_wait", waited, cache=PRIORITY_NAMES[priority])
+        return waited
+
+    def _drop(self, waiter: _Waiter) -> None:
+        """Take a waiter out of the queue (lazily: it stays in the heap, marked done)."""
+        waiter.event.set()
+        self._queued -= 1
+        self._release_user(waiter.user_id)
+
+    def _add_user(self, user_id: Optional[str]) -> None:
+        if user_id is not None:
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+
+    def _release_user(self, user_id: Optional[str]) -> None:
+        if user_id is None:
+            return
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def release(self, user_id: Optional[str], latency: Optional[float] = None) -> None:
+        """Free the slot; ``latency`` (seconds of processing) feeds the adaptive limit."""
+        with self._lock:
+            self.running -= 1
+            self._release_user(user_id)
+            if latency is not None:
+                self._adapt(latency)
+            self._dispatch()
+
+    def _adapt(self, latency: float) -> None:
+        self.latency_ewma = latency if not self.latency_ewma else 0.9 * self.latency_ewma + 0.1 * latency
+        if self.latency_ewma > self.target_latency:
+            now = time.monotonic()
+            # Give the previous cut time to show up in the latencies
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.min_concurrency, self.limit * self.decrease)
+                self._last_decrease = now
+        elif self.running + 1 >= int(self.limit) or self._queued:
+            # Fast and saturated: probe for more capacity
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / max(1.0, self.limit))
+
+    def _dispatch(self) -> None:
+        while self._queue and self.running < int(self.limit):
+            waiter = heapq.heappop(self._queue)
+            if waiter.event.is_set():
+                continue
+            waiter.granted = True
+            self._queued -= 1
+            self.running += 1
+            # The per-user count carries over from queued to running
+            waiter.event.set()
+
+    @contextmanager
+    def admit(self, user_id: Optional[str], priority: int = NORMAL):
+        """``acquire``/``release`` around a block; yields the seconds spent queued."""
+        waited = self.acquire(user_id, priority)
+        start = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(user_id, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "running": self.running,
+                "queued": self._queued,
+                "latencyEwma": round(self.latency_ewma, 3),
+                "rejected": dict(self.rejected),
+            }
@@ -1,13 +1,26 @@
 import os
 import json
 import asyncio
+import logging
 import sys
+import threading
+import time
 from pathlib import Path
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, render_template_string
 from flask_cors import CORS
 from dotenv import load_dotenv
 from typing import Dict, Any, List
 from main import BookChatbot
+from graph_agent import GraphDatabaseService, normalize_text
+from web_refresh import REFRESH_SCHEDULER
+from admission import AdmissionController, Rejected, LOW
+from resilience import breaker_states
+from fast_path import POLISH_STORE, POLISH_TIMEOUT
+from model_policy import TIER_STATS
+from metrics import REGISTRY
+from profiling import profile_request, request_id_from, should_profile
+from log_config import configure_logging
+from examples import example_queries
 from pydantic import BaseModel
 
 # Add the current directory to the Python path
@@ -17,6 +30,9 @@ sys.path.append(str(current_dir))
 # Load environment variables
 load_dotenv()
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
@@ -24,16 +40,23 @@ CORS(app)
 # Initialize the chatbot
 chatbot = BookChatbot()
 
-# Example queries to show in the UI
-example_queries = [
-    "Recommend fantasy books similar to Lord of the Rings",
-    "What are good science fiction books about space exploration?",
-    "Tell me about top trading topics and book recommendations",
-    "Recommend books on cryptocurrency trading strategies",
-    "Suggest books about the history of Paris",
-    "What are good books set in Tokyo?",
-    "Recommend travel literature about Iceland"
-]
+def detect_graph_capabilities():
+    """Detect (and set up) Neo4j vector index support before the first query needs it."""
+    db = GraphDatabaseService()
+    try:
+        db.capabilities()
+    finally:
+        db.close()
+
+threading.Thread(target=detect_graph_capabilities, name="neo4j-capabilities", daemon=True).start()
+
+# Bounded concurrency and queueing in front of the chatbot (see admission.py)
+admission = AdmissionController.from_env()
+
+# Optionally pre-populate the caches for the example queries in the background
+if os.getenv("WARM_CACHE_ON_STARTUP", "").lower() in ("1", "true", "yes"):
+    from warm_cache import start_background_warmup
+    start_background_warmup(example_queries)
 
 # HTML template for the UI
 HTML_TEMPLATE = '''
@@ -314,7 +337,13 @@ def chat():
             return jsonify({'error': 'No query provided'}), 400
         
         # Process the message using our chatbot
-        result = asyncio.run(chatbot.process_message(query))
+        request_id = request_id_from(request.headers)
+        norm = normalize_text(query)
+        with admission.admit(data.get('userId'), admission.priority_for(norm, query)) as waited:
+            g.queue_wait = waited
+            with profile_request(request_id, should_profile(request.headers)) as profile:
+                result = asyncio.run(chatbot.process_message(query, user_id=data.get('userId')))
+        admission.remember(norm, result.get('type', 'error'))
         
         # Handle different response types
         response_type = result.get('type', 'text')
@@ -325,6 +354,8 @@ def chat():
             'type': response_type,
             'message': content,
         }
+        if result.get('polishId'):
+            response['polishId'] = result['polishId']
         
         # Add specific data based on response type
         if response_type == 'graph' and data:
@@ -340,14 +371,93 @@ def chat():
             # Format location books for display
             response['data'] = format_location_data(data)
         
-        return jsonify(response)
+        response = jsonify(response)
+        if profile is not None:
+            response.headers['X-Profile-Id'] = request_id
+        return response
         
+    except Rejected:
+        raise
     except Exception as e:
-        import traceback
-        print(f"Error processing request: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Error processing request")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Answer many queries in one request.
+
+    Expects {"queries": [...], "maxConcurrency": 4} and streams back one
+    JSON object per line (NDJSON) as each query completes; every line
+    carries the ``index`` of the query it answers. maxConcurrency is capped
+    at the per-user admission limit (ADMISSION_PER_USER).
+    """
+    data = request.json or {}
+    queries = data.get('queries', [])
+    max_concurrency = data.get('maxConcurrency', 4)
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'No queries provided'}), 400
+    if not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'Every query must be a non-empty string'}), 400
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return jsonify({'error': 'maxConcurrency must be a positive integer'}), 400
+
+    # The whole batch holds one low-priority slot until it has streamed out, so
+    # it may not run more queries at once than one user is allowed requests
+    max_concurrency = min(max_concurrency, admission.per_user)
+    user_id = data.get('userId')
+    g.queue_wait = admission.acquire(user_id, LOW)
+    started = time.monotonic()
+    released = threading.Lock()
+
+    def release():
+        # Runs from the generator and from call_on_close; only the first call counts
+        if released.acquire(blocking=False):
+            admission.release(user_id, time.monotonic() - started)
+
+    def generate():
+        loop = asyncio.new_event_loop()
+        results = chatbot.process_batch(queries, max_concurrency=max_concurrency, user_id=user_id)
+        try:
+            while True:
+                try:
+                    result = loop.run_until_complete(results.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield json.dumps(result, default=str) + "\n"
+        finally:
+            loop.run_until_complete(results.aclose())
+            loop.close()
+            release()
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    # Also release when the response is closed before the generator ever ran
+    response.call_on_close(release)
+    return response
+
+@app.route('/api/chat/polish/<polish_id>', methods=['GET'])
+def chat_polish(polish_id):
+    """
+    The LLM-written version of a fast-path (templated) graph answer.
+    Waits for it by default; with ?wait=0 returns {"status": "pending"}
+    straight away if it isn't ready yet.
+    """
+    wait = POLISH_TIMEOUT if request.args.get('wait', '1') != '0' else 0
+    try:
+        with admission.admit(request.args.get('userId'), LOW):
+            message = POLISH_STORE.get(polish_id, wait=wait)
+    except KeyError:
+        return jsonify({'error': 'Unknown or expired polishId'}), 404
+    except Rejected:
+        raise
+    except Exception as e:
+        logger.warning("Polishing %s failed: %s", polish_id, e)
+        return jsonify({'error': 'Polished answer unavailable'}), 503
+    if message is None:
+        return jsonify({'polishId': polish_id, 'status': 'pending'}), 202
+    return jsonify({'polishId': polish_id, 'status': 'ready', 'message': message})
+
 def format_graph_data(data: Dict[str, Any]) -> Dict[str, Any]:
     """Format graph data for display in the UI."""
     formatted_data = {
@@ -414,31 +524,92 @@ def format_location_data(data: Dict[str, Any]) -> Dict[str, Any]:
 def frontend_chat():
     data = request.json
     query = data.get('message', '')
-    user_id = data.get('userId', 'USER-1')
+    user_id = data.get('userId')
     
     if not query:
         return jsonify({'error': 'No query provided'}), 400
     
     # Process with the chatbot
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        response = loop.run_until_complete(chatbot.process_message(query))
-        
-        # Format response to match the structure expected by the frontend
-        # The current response format should already be compatible
-        
-    finally:
-        loop.close()
+    request_id = request_id_from(request.headers)
+    norm = normalize_text(query)
+    with admission.admit(user_id, admission.priority_for(norm, query)) as waited:
+        g.queue_wait = waited
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with profile_request(request_id, should_profile(request.headers)) as profile:
+                response = loop.run_until_complete(chatbot.process_message(query, user_id=user_id))
+            
+            # Format response to match the structure expected by the frontend
+            # The current response format should already be compatible
+            
+        finally:
+            loop.close()
+    admission.remember(norm, response.get('type', 'error'))
     
-    return jsonify(response)
+    response = jsonify(response)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = request_id
+    return response
+
+@app.errorhandler(Rejected)
+def rejected(e):
+    """Fast 429/503 when the chatbot is at capacity, with a hint of when to retry."""
+    response = jsonify({'error': e.reason})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/api/admission')
+def admission_stats():
+    """Current concurrency limit, queue depth and rejection counts."""
+    return jsonify(admission.stats())
+
+@app.route('/api/health')
+def health():
+    """Circuit breaker state for Neo4j, Tavily and OpenAI ("closed" is healthy)."""
+    states = breaker_states()
+    degraded = any(state != 'closed' for state in states.values())
+    return jsonify({'status': 'degraded' if degraded else 'ok', 'breakers': states})
+
+@app.route('/api/cache/refresh')
+def web_refresh_stats():
+    """Background refreshes of stale cached web results (see web_refresh.py)."""
+    return jsonify(REFRESH_SCHEDULER.stats())
+
+@app.route('/api/models')
+def model_stats():
+    """Per-tier call counts and quality signals (latency is under llm.<tier> in /metrics)."""
+    return jsonify(TIER_STATS.snapshot())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: p50/p95/p99 latency per pipeline stage."""
+    return Response(REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics')
+def metrics_json():
+    """The same per-stage latency summaries as JSON."""
+    return jsonify(REGISTRY.snapshot())
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
 
 # Add CORS headers to allow cross-origin requests from the React app
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'  # In production, restrict this to your frontend domain
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,X-Profile,X-Request-ID'
     response.headers['Access-Control-Allow-Methods'] = 'GET,PUT,POST,DELETE,OPTIONS'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Profile-Id,Server-Timing,Retry-After'
+    # Time spent inside the app, so clients (and benchmarks/loadgen.py) can
+    # separate it from time spent queued in front of it
+    if 'request_start' in g:
+        timing = f"app;dur={(time.perf_counter() - g.request_start) * 1000:.1f}"
+        if 'queue_wait' in g:
+            timing += f", queue;dur={g.queue_wait * 1000:.1f}"
+        response.headers['Server-Timing'] = timing
     return response
 
 if __name__ == '__main__':
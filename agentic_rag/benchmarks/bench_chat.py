@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of BookChatbot.process_message against the
+deterministic stand-ins in fakes.py (no network, no Neo4j, no API keys).
+
+For each query class it reports throughput, latency percentiles,
+allocations per request and the per-node/per-call breakdown recorded by
+metrics.py. Web questions are reported twice: web_miss, where every
+request is new and goes through Tavily, passage retrieval and synthesis,
+and web_hit, where the same questions are answered from the web-result
+cache. Results can be saved as a baseline and compared against on
+later commits:
+
+   python benchmarks/bench_chat.py --save-baseline
+   python benchmarks/bench_chat.py --compare        # exits 1 on regression
+
+Latencies of the stand-ins are set with e.g. --llm lognormal:800:0.3,
+--tavily fixed:300, --graph normal:5:1, --embedding zero.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+sys.path.append(BENCH_DIR)
+
+import fakes
+
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+# Representative queries for each routing class
+QUERY_MIX: Dict[str, List[str]] = {
+    "graph": [
+        "Recommend books similar to Dune",
+        "Recommend something like The Lord of the Rings",
+        "Who is the author J.K. Rowling",
+        "What genre categories are most popular",
+    ],
+    "web": [
+        "What are the latest book releases this year?",
+        "Which novels won the Booker prize recently?",
+        "Tell me about recent book-to-movie adaptations",
+    ],
+    "trading": [
+        "Recommend books on cryptocurrency trading",
+        "What are the top trading topics and books?",
+    ],
+    "location": [
+        "What are good books set in Tokyo?",
+        "Recommend travel literature about Iceland",
+    ],
+}
+
+# Classes answered from the web-result cache once asked; measured cold and warm
+CACHED_CLASSES = {"web"}
+
+
+def miss_queries(queries: List[str], requests: int, start: int = 0) -> List[str]:
+    """``requests`` distinct variants of ``queries``, so none is in the web-result cache."""
+    return [f"{queries[i % len(queries)]} (request {start + i})" for i in range(requests)]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_class(chatbot, queries: List[str], requests: int, concurrency: int):
+    """Run ``requests`` queries (cycling through ``queries``) with bounded concurrency."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    routes: Dict[str, int] = {}
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            # Spread requests over the fake readers, as loadgen does
+            result = await chatbot.process_message(queries[i % len(queries)], user_id=f"LOAD-{i % 50}")
+            latencies.append(time.perf_counter() - start)
+            routes[result["type"]] = routes.get(result["type"], 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, routes, time.perf_counter() - start
+
+
+def measure_allocations(chatbot, queries: List[str], requests: int) -> Dict[str, float]:
+    """Sequential pass under tracemalloc (kept separate so it doesn't skew latency)."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for i in range(requests):
+            asyncio.run(chatbot.process_message(queries[i % len(queries)]))
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    return {
+        "alloc_kb_per_req": sum(s.size_diff for s in stats if s.size_diff > 0) / 1024 / requests,
+        "blocks_per_req": sum(s.count_diff for s in stats if s.count_diff > 0) / requests,
+        "peak_kb": peak / 1024,
+    }
+
+
+def stage_breakdown() -> Dict[str, Dict[str, float]]:
+    """p50 (ms) per stage per route, from the metrics registry."""
+    import metrics
+    breakdown: Dict[str, Dict[str, float]] = {}
+    for s in metrics.REGISTRY.snapshot():
+        if s["route"] in ("none", "unknown"):
+            continue
+        key = s["stage"] if s["cache"] == "none" else f"{s['stage']}[{s['cache']}]"
+        breakdown.setdefault(s["route"], {})[key] = round(s["p50"] * 1000, 3)
+    return breakdown
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(chatbot, queries: List[str], alloc_queries: List[str], args) -> Dict[str, Any]:
+    import metrics
+    metrics.REGISTRY.reset()
+    latencies, routes, wall = asyncio.run(run_class(chatbot, queries, args.requests, args.concurrency))
+    return {
+        "throughput_rps": args.requests / wall,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "routes": routes,
+        "stages": stage_breakdown(),
+        **measure_allocations(chatbot, alloc_queries, args.alloc_requests),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    profile = fakes.BackendProfile(llm=args.llm, tavily=args.tavily, graph=args.graph,
+                                   embedding=args.embedding, seed=args.seed)
+    fakes.install(profile)
+
+    from main import BookChatbot
+
+    chatbot = BookChatbot()
+    results: Dict[str, Any] = {}
+    for name, queries in QUERY_MIX.items():
+        if args.only and name not in args.only:
+            continue
+        # Warm-up (fills the web-result cache the same way production would)
+        for q in queries:
+            asyncio.run(chatbot.process_message(q))
+        if name not in CACHED_CLASSES:
+            results[name] = measure(chatbot, queries, queries, args)
+            continue
+
+        # Every measured request is new, so none is answered from the cache
+        fakes.InMemoryGraph.web_cache.clear()
+        results[f"{name}_miss"] = measure(chatbot, miss_queries(queries, args.requests),
+                                          miss_queries(queries, args.alloc_requests, args.requests), args)
+        for q in queries:
+            asyncio.run(chatbot.process_message(q))
+        results[f"{name}_hit"] = measure(chatbot, queries, queries, args)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: getattr(args, k) for k in ("llm", "tavily", "graph", "embedding", "seed",
+                                                  "requests", "concurrency")},
+        "results": results,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"commit {report['commit']}  config {report['config']}\n")
+    print(f"{'class':<10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'KB/req':>9}{'blk/req':>9}  routes")
+    for name, r in report["results"].items():
+        print(f"{name:<10}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['alloc_kb_per_req']:>9.1f}{r['blocks_per_req']:>9.0f}  {r['routes']}")
+    for name, r in report["results"].items():
+        print(f"\n{name}: p50 ms per stage")
+        for route, stages in r["stages"].items():
+            for stage, ms in sorted(stages.items(), key=lambda kv: -kv[1]):
+                print(f"  [{route}] {stage:<40}{ms:>9.2f}")
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a description of every metric that regressed by more than ``tolerance``."""
+    regressions = []
+    for name, r in report["results"].items():
+        base = baseline["results"].get(name)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms", "alloc_kb_per_req"):
+            if base[metric] > 0 and r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {base[metric]:.1f} -> {r[metric]:.1f}")
+        if r["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}.throughput_rps: {base['throughput_rps']:.1f} -> {r['throughput_rps']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end chat benchmark.")
+    parser.add_argument("--requests", type=int, default=100, help="requests per query class")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--alloc-requests", type=int, default=10, help="requests traced for allocations")
+    parser.add_argument("--only", nargs="*", choices=list(QUERY_MIX), help="query classes to run")
+    parser.add_argument("--llm", default=fakes.BackendProfile.llm)
+    parser.add_argument("--tavily", default=fakes.BackendProfile.tavily)
+    parser.add_argument("--graph", default=fakes.BackendProfile.graph)
+    parser.add_argument("--embedding", default=fakes.BackendProfile.embedding)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default="default", help="baseline name under benchmarks/baselines/")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+    if args.compare:
+        if not os.path.exists(baseline_path):
+            sys.exit(f"No baseline at {baseline_path}; run with --save-baseline first")
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        print(f"\nCompared with baseline from commit {baseline['commit']}:")
+        for line in regressions or ["no regressions"]:
+            print(f"  {line}")
+        if regressions:
+            sys.exit(1)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Benchmark the compact embedding codecs against legacy float lists.
+
+Reports, per format:
+  - bytes per embedding on the wire (PackStream encoding of the property)
+  - encode/decode time for the whole corpus
+  - similarity accuracy vs. exact float64 cosine: max abs error,
+    top-1 agreement and agreement of the 0.90 find_similar_query decision
+
+With --neo4j it also writes a synthetic corpus to a scratch label and
+times fetching it in each format, the way find_similar_query does.
+
+Usage:
+   python benchmarks/bench_embedding_codec.py [--n 5000] [--dim 384] [--neo4j]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_codec import CODECS, encode_embedding, decode_rows
+
+THRESHOLD = 0.90
+BENCH_LABEL = "BenchEmbedding"
+
+
+def packstream_size(value) -> int:
+    """Approximate PackStream size of a property value."""
+    if value is None:
+        return 1
+    if isinstance(value, float):
+        return 9
+    if isinstance(value, (bytes, bytearray)):
+        n = len(value)
+        return n + (2 if n < 256 else 3 if n < 65536 else 5)
+    if isinstance(value, str):
+        n = len(value)
+        return n + (1 if n < 16 else 2)
+    if isinstance(value, list):
+        n = len(value)
+        return sum(packstream_size(v) for v in value) + (1 if n < 16 else 2 if n < 256 else 3)
+    raise TypeError(type(value))
+
+
+def make_corpus(n: int, dim: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    corpus = rng.normal(size=(n, dim))
+    # Queries are noisy copies of corpus rows, so some land above the threshold
+    picks = rng.integers(0, n, size=queries)
+    noise = rng.uniform(0.05, 0.6, size=(queries, 1))
+    probes = corpus[picks] + noise * rng.normal(size=(queries, dim))
+    return corpus, probes
+
+
+def exact_sims(corpus: np.ndarray, probes: np.ndarray) -> np.ndarray:
+    c = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    p = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+    return p @ c.T
+
+
+def bench_format(name, corpus, probes, reference):
+    t0 = time.perf_counter()
+    if name == "float64-list":
+        props = [{"embedding": v.tolist()} for v in corpus]
+        wire = sum(packstream_size(p["embedding"]) for p in props)
+        rows = [{"nodeId": i, **p} for i, p in enumerate(props)]
+    else:
+        props = [encode_embedding(v, name) for v in corpus]
+        wire = sum(packstream_size(p["embeddingBlob"]) + packstream_size(p["embeddingScale"])
+                   + packstream_size(p["embeddingCodec"]) for p in props)
+        rows = [{"nodeId": i, "blob": p["embeddingBlob"], "scale": p["embeddingScale"],
+                 "codec": p["embeddingCodec"]} for i, p in enumerate(props)]
+    encode_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    _, matrix = decode_rows(rows)
+    decode_s = time.perf_counter() - t0
+
+    p = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+    sims = p.astype(np.float32) @ matrix.T
+    return {
+        "format": name,
+        "bytes_per_vec": wire / len(corpus),
+        "encode_ms": encode_s * 1000,
+        "decode_ms": decode_s * 1000,
+        "max_abs_err": float(np.max(np.abs(sims - reference))),
+        "top1_agree": float(np.mean(np.argmax(sims, axis=1) == np.argmax(reference, axis=1))),
+        "threshold_agree": float(np.mean((sims.max(axis=1) >= THRESHOLD)
+                                         == (reference.max(axis=1) >= THRESHOLD))),
+    }
+
+
+def bench_neo4j(corpus):
+    """Time fetching the corpus from Neo4j in legacy and compact formats."""
+    from dotenv import load_dotenv
+    load_dotenv()
+    from graph_agent import GraphDatabaseService
+
+    db = GraphDatabaseService()
+    timings = {}
+    try:
+        rows = [{"embedding": v.tolist(), **encode_embedding(v, "int8")} for v in corpus]
+        db.execute_query(f"""
+        UNWIND $rows AS r
+        CREATE (n:{BENCH_LABEL})
+        SET n.embedding = r.embedding, n.embeddingBlob = r.embeddingBlob,
+            n.embeddingScale = r.embeddingScale, n.embeddingCodec = r.embeddingCodec
+        """, {"rows": rows})
+
+        projections = {
+            "float64-list": "elementId(n) AS nodeId, n.embedding AS embedding",
+            "int8": "elementId(n) AS nodeId, n.embeddingBlob AS blob, "
+                    "n.embeddingScale AS scale, n.embeddingCodec AS codec",
+        }
+        for name, projection in projections.items():
+            t0 = time.perf_counter()
+            records = db.execute_query(f"MATCH (n:{BENCH_LABEL}) RETURN {projection}")
+            decode_rows(records)
+            timings[name] = (time.perf_counter() - t0) * 1000
+    finally:
+        db.execute_query(f"MATCH (n:{BENCH_LABEL}) DETACH DELETE n")
+        db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compact embedding storage.")
+    parser.add_argument("--n", type=int, default=5000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="number of probe queries")
+    parser.add_argument("--neo4j", action="store_true", help="also time fetches from a live Neo4j")
+    args = parser.parse_args()
+
+    corpus, probes = make_corpus(args.n, args.dim, args.queries)
+    reference = exact_sims(corpus, probes)
+
+    results = [bench_format(name, corpus, probes, reference) for name in ("float64-list",) + CODECS]
+    baseline = results[0]["bytes_per_vec"]
+
+    print(f"{args.n} vectors x {args.dim} dims, {args.queries} probes\n")
+    print(f"{'format':<14}{'bytes/vec':>11}{'ratio':>8}{'encode ms':>11}{'decode ms':>11}"
+          f"{'max err':>10}{'top1':>8}{'>=0.90':>8}")
+    for r in results:
+        print(f"{r['format']:<14}{r['bytes_per_vec']:>11.0f}{baseline / r['bytes_per_vec']:>7.1f}x"
+              f"{r['encode_ms']:>11.1f}{r['decode_ms']:>11.1f}{r['max_abs_err']:>10.4f}"
+              f"{r['top1_agree']:>8.1%}{r['threshold_agree']:>8.1%}")
+
+    if args.neo4j:
+        print("\nNeo4j fetch + decode time:")
+        for name, ms in bench_neo4j(corpus).items():
+            print(f"  {name:<14}{ms:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Measure the cost of the metrics instrumentation.
+
+1) Per-span cost of ``timed()`` outside and inside a request.
+2) A synthetic request made of --spans CPU-bound stages totalling
+   --request-ms, run with and without instrumentation, to report the
+   end-to-end overhead as a percentage (target: < 1%).
+
+Usage:
+   python benchmarks/bench_metrics_overhead.py [--spans 15] [--request-ms 20]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from metrics import MetricsRegistry, start_request, set_route, timed
+
+
+def per_span_ns(n: int, in_request: bool) -> float:
+    if in_request:
+        request = start_request()
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        with timed("bench.span") as span:
+            span.cache = "hit"
+    elapsed = time.perf_counter_ns() - start
+    if in_request:
+        set_route("bench")
+        request.finish()
+        metrics._current_request.set(None)
+    return elapsed / n
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def synthetic_request(spans: int, stage_s: float, instrumented: bool) -> None:
+    if instrumented:
+        request = start_request()
+        with timed("request.total"):
+            for i in range(spans):
+                with timed(f"stage.{i % 5}"):
+                    busy(stage_s)
+        set_route("bench")
+        request.finish()
+        metrics._current_request.set(None)
+    else:
+        for _ in range(spans):
+            busy(stage_s)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure metrics instrumentation overhead.")
+    parser.add_argument("--spans", type=int, default=15, help="spans per request")
+    parser.add_argument("--request-ms", type=float, default=20.0, help="synthetic request duration")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    # Keep benchmark series out of the process-wide registry
+    metrics.REGISTRY = MetricsRegistry()
+
+    outside = per_span_ns(200_000, in_request=False)
+    inside = per_span_ns(200_000, in_request=True)
+    print(f"timed() outside a request: {outside:8.0f} ns/span")
+    print(f"timed() inside a request:  {inside:8.0f} ns/span (incl. flush)")
+
+    stage_s = args.request_ms / 1000.0 / args.spans
+    # Interleave rounds and keep the best of each, to suppress scheduler noise
+    timings = {False: float("inf"), True: float("inf")}
+    for _ in range(5):
+        for instrumented in (False, True):
+            start = time.perf_counter()
+            for _ in range(args.requests // 5):
+                synthetic_request(args.spans, stage_s, instrumented)
+            timings[instrumented] = min(timings[instrumented], time.perf_counter() - start)
+
+    analytic = inside * (args.spans + 1) / (args.request_ms * 1e6) * 100
+    measured = (timings[True] - timings[False]) / timings[False] * 100
+    print(f"\n{args.spans} spans per {args.request_ms:.0f} ms request:")
+    print(f"  analytic overhead: {analytic:.3f}%")
+    print(f"  measured overhead: {measured:.3f}% (noise-limited)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Compare find_similar_query's two similarity paths on the same data:
+the native Neo4j vector index (db.index.vector.queryNodes) and the
+Python fallback that pulls compact embeddings and scans them with numpy.
+
+A synthetic corpus is written to a scratch label (with both the compact
+blob and the float list the index needs), then each probe is answered by
+both paths. Reports per-query latency percentiles and how often the two
+agree on the top match and on the 0.90 threshold decision. Needs a Neo4j
+5.11+ server (NEO4J_URI etc.); the scratch nodes and index are dropped
+afterwards unless --keep is given.
+
+Usage:
+   python benchmarks/bench_vector_search.py [--n 10000] [--queries 200] [--dim 384]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+os.environ.pop("EMBEDDING_STORE_DIR", None)  # always measure the Neo4j scan, not the sidecar store
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+sys.path.append(BENCH_DIR)
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from bench_embedding_codec import make_corpus, THRESHOLD
+from bench_chat import percentile
+from embedding_codec import encode_embedding
+from graph_agent import GraphDatabaseService
+
+BENCH_LABEL = "BenchVectorQuery"
+BENCH_INDEX = "bench_vector_query_embedding"
+
+
+class BenchGraph(GraphDatabaseService):
+    """GraphDatabaseService pointed at the scratch label and index."""
+    EMBEDDING_LABELS = (BENCH_LABEL,)
+    VECTOR_INDEXES = {BENCH_LABEL: BENCH_INDEX}
+
+
+def load_corpus(db: BenchGraph, corpus: np.ndarray, batch_size: int = 1000) -> None:
+    db.execute_query(f"MATCH (n:{BENCH_LABEL}) CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS")
+    for start in range(0, len(corpus), batch_size):
+        rows = []
+        for v in corpus[start:start + batch_size]:
+            unit = (v / np.linalg.norm(v)).astype(np.float32)
+            rows.append({"embedding": unit.tolist(), **encode_embedding(unit, db.EMBEDDING_CODEC)})
+        db.execute_query(f"""
+        UNWIND $rows AS r
+          CREATE (n:{BENCH_LABEL})
+          SET n.embedding = r.embedding,
+              n.embeddingBlob = r.embeddingBlob,
+              n.embeddingScale = r.embeddingScale,
+              n.embeddingCodec = r.embeddingCodec
+        """, {"rows": rows})
+
+
+def wait_for_index(db: BenchGraph, timeout: float = 300) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        rows = db.execute_query("SHOW INDEXES YIELD name, state, populationPercent WHERE name = $name "
+                                "RETURN state, populationPercent", {"name": BENCH_INDEX})
+        if rows and rows[0]["state"] == "ONLINE":
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"Index {BENCH_INDEX} did not come online")
+
+
+def run_path(fn, probes: np.ndarray):
+    latencies, results = [], []
+    for p in probes:
+        start = time.perf_counter()
+        matches = fn(p.tolist())
+        latencies.append(time.perf_counter() - start)
+        results.append(matches[0] if matches else (None, -1.0))
+    return latencies, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Native vector index vs. Python similarity scan.")
+    parser.add_argument("--n", type=int, default=10000, help="stored embeddings")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=GraphDatabaseService.EMBEDDING_DIM)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch nodes and index")
+    args = parser.parse_args()
+
+    BenchGraph.EMBEDDING_DIM = args.dim
+    db = BenchGraph()
+    try:
+        if not db.vector_search_enabled():
+            sys.exit("This server has no native vector index support; only the Python path is available")
+
+        corpus, probes = make_corpus(args.n, args.dim, args.queries)
+        print(f"Loading {args.n} x {args.dim} embeddings into :{BENCH_LABEL} ...")
+        load_corpus(db, corpus)
+        wait_for_index(db)
+
+        # Warm both paths once
+        db._vector_matches(BENCH_LABEL, probes[0].tolist(), 1)
+        db._scan_matches(BENCH_LABEL, probes[0].tolist(), 1)
+
+        index_lat, index_res = run_path(lambda v: db._vector_matches(BENCH_LABEL, v, 1), probes)
+        scan_lat, scan_res = run_path(lambda v: db._scan_matches(BENCH_LABEL, v, 1), probes)
+
+        print(f"\n{'path':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, lat in (("vector index", index_lat), ("python scan", scan_lat)):
+            print(f"{name:<14}{percentile(lat, 0.5) * 1000:>10.2f}{percentile(lat, 0.95) * 1000:>10.2f}"
+                  f"{percentile(lat, 0.99) * 1000:>10.2f}")
+
+        same_top = sum(a[0] == b[0] for a, b in zip(index_res, scan_res)) / len(probes)
+        same_decision = sum((a[1] >= THRESHOLD) == (b[1] >= THRESHOLD)
+                            for a, b in zip(index_res, scan_res)) / len(probes)
+        print(f"\ntop-1 agreement {same_top:.1%}, {THRESHOLD} threshold agreement {same_decision:.1%}")
+    finally:
+        if not args.keep:
+            db.execute_query(f"DROP INDEX {BENCH_INDEX} IF EXISTS")
+            db.execute_query(f"MATCH (n:{BENCH_LABEL}) CALL {{ WITH n DETACH DELETE n }} IN TRANSACTIONS")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
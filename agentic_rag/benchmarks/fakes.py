@@ -0,0 +1,335 @@
+"""
+Deterministic stand-ins for the external services the chatbot calls,
+with configurable latency, so the pipeline can be benchmarked (and load
+tested) offline on any Linux box.
+
+  FakeChatModel  - replaces ChatOpenAI
+  FakeTavily     - replaces the Tavily search tool
+  InMemoryGraph  - replaces GraphDatabaseService's data access with an
+                   in-memory book graph and web-result cache
+  fake_encode    - replaces the SentenceTransformer forward pass
+
+``install(profile)`` patches all of them into the agent modules.
+"""
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LatencyModel:
+    """
+    A latency distribution, given as a spec string (milliseconds):
+      "zero", "fixed:5", "normal:50:10", "lognormal:800:0.3" (median, sigma)
+    """
+
+    def __init__(self, spec: str = "zero", seed: int = 0):
+        self.spec = spec
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self) -> float:
+        with self._lock:
+            if self.kind == "zero":
+                return 0.0
+            if self.kind == "fixed":
+                return self.params[0]
+            if self.kind == "normal":
+                return max(0.0, self._rng.gauss(self.params[0], self.params[1]))
+            if self.kind == "lognormal":
+                return self.params[0] * float(np.exp(self._rng.gauss(0.0, self.params[1])))
+        raise ValueError(f"Unknown latency spec '{self.spec}'")
+
+    def wait(self) -> None:
+        ms = self.sample_ms()
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+
+@dataclass
+class BackendProfile:
+    """Latency of each stand-in backend."""
+    llm: str = "lognormal:60:0.3"
+    tavily: str = "lognormal:40:0.3"
+    graph: str = "lognormal:3:0.2"
+    embedding: str = "fixed:1"
+    seed: int = 0
+    latencies: Dict[str, LatencyModel] = field(default_factory=dict, init=False)
+
+    def __post_init__(self):
+        for i, name in enumerate(("llm", "tavily", "graph", "embedding")):
+            self.latencies[name] = LatencyModel(getattr(self, name), seed=self.seed + i)
+
+
+PROFILE = BackendProfile()
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeChatModel:
+    """Accepts ChatOpenAI's constructor arguments; answers from the prompt."""
+
+    def __init__(self, **kwargs):
+        self.model_name = kwargs.get("model", "fake")
+
+    def invoke(self, messages) -> FakeMessage:
+        PROFILE.latencies["llm"].wait()
+        prompt = messages[-1].content if messages else ""
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return FakeMessage(f"[{self.model_name} {digest}] Here is what I found for your question. "
+                           + " ".join(prompt.split()[:40]))
+
+
+class FakeTavily:
+    def __init__(self, results_per_query: int = 5, content_chars: int = 2000):
+        self.results_per_query = results_per_query
+        self.content_chars = content_chars
+
+    def invoke(self, query: str) -> List[Dict[str, Any]]:
+        PROFILE.latencies["tavily"].wait()
+        seed = int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:8], 16)
+        words = query.split()
+        return [{
+            "title": f"{' '.join(words[-3:])} - source {i}",
+            "url": f"https://example.com/{seed:x}/{i}",
+            "content": (f"Article {i} about {query}. " * 100)[:self.content_chars],
+        } for i in range(self.results_per_query)]
+
+
+def fake_encode(texts: List[str], batch_size: int = 64) -> List[List[float]]:
+    """Deterministic 384-dim pseudo-embeddings seeded by the text."""
+    PROFILE.latencies["embedding"].wait()
+    vectors = []
+    for t in texts:
+        seed = int(hashlib.sha1(t.encode("utf-8")).hexdigest()[:8], 16)
+        vectors.append(np.random.default_rng(seed).normal(size=384).astype(np.float32).tolist())
+    return vectors
+
+
+GENRES = ["Fantasy", "Science Fiction", "Mystery", "Romance", "History", "Travel", "Finance", "Biography"]
+CITIES = [("Paris", 48.8566, 2.3522), ("Tokyo", 35.6762, 139.6503), ("Reykjavik", 64.1466, -21.9426),
+          ("New York", 40.7128, -74.0060), ("London", 51.5074, -0.1278), ("Kyoto", 35.0116, 135.7681)]
+
+
+def build_dataset(n_books: int = 2000, n_authors: int = 300, n_users: int = 50, seed: int = 0) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    authors = [{"name": f"Author {i}", "birthYear": 1900 + i % 100, "deathYear": "",
+                "bio": f"Author {i} writes about {GENRES[i % len(GENRES)].lower()}."} for i in range(n_authors)]
+    books = []
+    for i in range(n_books):
+        city = CITIES[i % len(CITIES)]
+        books.append({
+            "id": f"B{i}",
+            "title": f"Book {i} of {GENRES[i % len(GENRES)]}",
+            "author": authors[i % n_authors]["name"],
+            "rating": round(rng.uniform(3.0, 5.0), 2),
+            "publishYear": 1950 + i % 70,
+            "genres": [GENRES[i % len(GENRES)], GENRES[(i * 7) % len(GENRES)]],
+            "description": f"A {GENRES[i % len(GENRES)].lower()} story set in {city[0]}.",
+            "setting": city[0],
+            "latitude": city[1] + rng.uniform(-0.5, 0.5),
+            "longitude": city[2] + rng.uniform(-0.5, 0.5),
+        })
+    # Named classics so title/author queries have something to find
+    books[0].update(title="The Lord of the Rings", author="J.R.R. Tolkien", genres=["Fantasy"])
+    books[1].update(title="Harry Potter and the Philosopher's Stone", author="J.K. Rowling", genres=["Fantasy"])
+    books[2].update(title="Dune", author="Frank Herbert", genres=["Science Fiction"])
+    authors += [{"name": "J.R.R. Tolkien", "birthYear": 1892, "deathYear": 1973, "bio": "Philologist."},
+                {"name": "J.K. Rowling", "birthYear": 1965, "deathYear": "", "bio": "British author."},
+                {"name": "Frank Herbert", "birthYear": 1920, "deathYear": 1986, "bio": "American author."}]
+    # Readers named like loadgen's userIds, each mostly reading one genre
+    reading = []
+    for u in range(n_users):
+        favourite = [b for b in books if GENRES[u % len(GENRES)] in b["genres"]]
+        for b in rng.sample(favourite, 15) + rng.sample(books, 5):
+            rel = rng.choice(["RATES", "FINISHED", "READING", "WANTS_TO_READ"])
+            reading.append({"userId": f"LOAD-{u}", "title": b["title"], "rel": rel,
+                            "rating": rng.randint(1, 5) if rel == "RATES" else None})
+    return {"books": books, "authors": authors, "reading": reading}
+
+
+class InMemoryGraph:
+    """
+    Drop-in for GraphDatabaseService backed by in-memory data. Query
+    parsing (search_book_knowledge) is inherited from the real class;
+    only the data-access methods are replaced. Every call waits for one
+    sample of the "graph" latency.
+    """
+    dataset: Dict[str, Any] = {}
+    web_cache: Dict[str, List[Dict[str, str]]] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+    def execute_query(self, query, parameters=None):
+        PROFILE.latencies["graph"].wait()
+        return []
+
+    def _books(self):
+        return InMemoryGraph.dataset.get("books", [])
+
+    def get_book_recommendations(self, limit=3):
+        PROFILE.latencies["graph"].wait()
+        top = sorted((b for b in self._books() if b["rating"] > 4.0), key=lambda b: -b["rating"])[:limit]
+        return [{"title": b["title"], "author": b["author"], "rating": b["rating"],
+                 "matchScore": int(b["rating"] / 5 * 100)} for b in top]
+
+    def get_author_info(self, author_name, book_limit=None):
+        PROFILE.latencies["graph"].wait()
+        name = author_name.lower()
+        author = next((a for a in InMemoryGraph.dataset.get("authors", []) if name in a["name"].lower()), None)
+        if author is None:
+            return None
+        books = [b for b in self._books() if b["author"] == author["name"]][:book_limit]
+        return {"author": dict(author),
+                "books": [{"title": b["title"], "publishYear": b["publishYear"]} for b in books]}
+
+    def get_top_genres(self, limit=3):
+        PROFILE.latencies["graph"].wait()
+        counts: Dict[str, int] = {}
+        for b in self._books():
+            for g in b["genres"]:
+                counts[g] = counts.get(g, 0) + 1
+        top = sorted(counts.items(), key=lambda kv: -kv[1])[:limit]
+        return [{"name": g, "percentage": int(c / 10 * 100)} for g, c in top]
+
+    def find_similar_books(self, title_query: str):
+        PROFILE.latencies["graph"].wait()
+        title = title_query.lower()
+        book = next((b for b in sorted(self._books(), key=lambda b: len(b["title"]))
+                     if title in b["title"].lower()), None)
+        if book is None:
+            return []
+        scored = [(len(set(book["genres"]) & set(b["genres"])), b) for b in self._books() if b["id"] != book["id"]]
+        scored = sorted((s for s in scored if s[0] > 0), key=lambda s: (-s[0], -s[1]["rating"]))[:3]
+        return [{"title": b["title"], "author": b["author"], "rating": b["rating"],
+                 "matchScore": min(100, int(overlap / 3 * 100))} for overlap, b in scored]
+
+    def iter_books(self):
+        return iter(self._books())
+
+    def iter_reading(self, user_ids=None):
+        return (r for r in InMemoryGraph.dataset.get("reading", []) if user_ids is None or r["userId"] in user_ids)
+
+    def users_changed_since(self, since: str) -> list:
+        PROFILE.latencies["graph"].wait()
+        return []
+
+    def get_places(self) -> list:
+        PROFILE.latencies["graph"].wait()
+        return [{"name": name, "aliases": [], "latitude": lat, "longitude": lon} for name, lat, lon in CITIES]
+
+    def find_books_near(self, latitude: float, longitude: float, radius_km: float, limit: int = 30) -> list:
+        PROFILE.latencies["graph"].wait()
+        lat0, lon0 = np.radians(latitude), np.radians(longitude)
+        near = []
+        for b in self._books():
+            lat, lon = np.radians(b["latitude"]), np.radians(b["longitude"])
+            h = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+            distance = 2 * 6371.0 * float(np.arcsin(np.sqrt(h)))
+            if distance <= radius_km:
+                near.append((distance, b))
+        near.sort(key=lambda s: (s[0], -s[1]["rating"]))
+        return [{"title": b["title"], "author": b["author"], "rating": b["rating"], "setting": b["setting"],
+                 "distanceKm": round(d, 1), "genres": list(b["genres"])} for d, b in near[:limit]]
+
+    def find_similar_query(self, vec, threshold: float = 0.90):
+        PROFILE.latencies["graph"].wait()
+        return None
+
+    def get_or_create_query_node(self, original: str, exact: bool = False) -> str:
+        from graph_agent import normalize_text
+        PROFILE.latencies["graph"].wait()
+        return normalize_text(original)
+
+    def save_web_results(self, original_query: str, results: list, exact: bool = False):
+        from graph_agent import normalize_text
+        PROFILE.latencies["graph"].wait()
+        with InMemoryGraph._lock:
+            InMemoryGraph.web_cache[normalize_text(original_query)] = [
+                {"title": r.get("title"), "content": r.get("content"), "url": r.get("url")} for r in results]
+
+    def get_cached_web_results(self, original_query: str) -> list:
+        from graph_agent import normalize_text
+        PROFILE.latencies["graph"].wait()
+        return list(InMemoryGraph.web_cache.get(normalize_text(original_query), []))
+
+    def indexed_search(self, label: str) -> bool:
+        return True
+
+    def find_passages(self, vec, k: int = 4, per_source: int = 2) -> list:
+        PROFILE.latencies["graph"].wait()
+        return []
+
+    def save_passages(self, url: str, passages: list) -> list:
+        return []
+
+    def lookup_web_results(self, original_query: str) -> tuple:
+        results = self.get_cached_web_results(original_query)
+        return results, "fresh" if results else "miss"
+
+    def get_cached_web_results_bulk(self, queries: List[str], track: bool = True) -> Dict[str, list]:
+        from graph_agent import normalize_text
+        PROFILE.latencies["graph"].wait()
+        norms = [normalize_text(q) for q in queries]
+        return {n: list(InMemoryGraph.web_cache.get(n, [])) for n in norms}
+
+
+def install(profile: Optional[BackendProfile] = None, dataset: Optional[Dict[str, Any]] = None) -> None:
+    """Patch every external service in the agent modules with its stand-in."""
+    global PROFILE
+    if profile is not None:
+        PROFILE = profile
+
+    import graph_agent
+    import web_agent
+    import web_refresh
+    import passages
+    import location_agent
+    import trading_agent
+    import user_profiles
+
+    # Inherit the real query parsing, replace the data access
+    methods = {k: v for k, v in InMemoryGraph.__dict__.items() if callable(v)}
+    FakeGraph = type("InMemoryGraphService", (graph_agent.GraphDatabaseService,), methods)
+    InMemoryGraph.dataset = dataset or build_dataset()
+    InMemoryGraph.web_cache = {}
+
+    graph_agent._encode_batch = fake_encode
+    graph_agent._scheduler = None
+    graph_agent._remote_encoder = None
+    graph_agent._embedding_cache.clear()
+    graph_agent.ChatOpenAI = FakeChatModel
+    for module in (graph_agent, web_agent, web_refresh, passages, location_agent, trading_agent):
+        module.GraphDatabaseService = FakeGraph
+    web_agent.tavily_search = FakeTavily()
+
+    # Serve the trading topics from an index built over the fake books (pseudo-embeddings
+    # don't cluster by meaning, so keep every book in the running)
+    trading_agent.TRADING_BOOK_MIN_SCORE = -1.0
+    trading_agent.TRADING_INDEX = trading_agent.TopicIndex(path="")
+    trading_agent.TRADING_INDEX.set(trading_agent.build_index(FakeGraph()))
+
+    # Personalise from profiles built over the fake reading edges
+    graph_agent.USER_PROFILES = user_profiles.ProfileStore(directory="")
+    graph_agent.USER_PROFILES.set(user_profiles.build_profiles(FakeGraph()))
+    import main
+    main.GraphDatabaseService = FakeGraph
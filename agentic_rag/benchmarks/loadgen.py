@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+Open-loop load generator for the chat endpoints of app.py.
+
+Requests arrive as a Poisson process at each target rate, regardless of
+how fast the server answers (so a slow server builds a queue instead of
+slowing the client down), with queries drawn from the routing classes
+in bench_chat.QUERY_MIX. For every offered rate it reports achieved
+throughput, latency percentiles, error rates and queueing delay: the
+client latency minus the in-app time from the Server-Timing header, and
+separately the time spent in the app's admission queue.
+
+   python benchmarks/loadgen.py --url http://127.0.0.1:5000 --rates 2,5,10
+   python benchmarks/loadgen.py --standin --rates 10,50,100,200
+
+--standin serves app.py in-process against the stand-ins from fakes.py,
+so it needs no Neo4j or API keys.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+sys.path.append(BENCH_DIR)
+
+import fakes
+from bench_chat import QUERY_MIX, percentile
+
+DEFAULT_MIX = "graph=0.4,web=0.3,trading=0.15,location=0.15"
+ENDPOINTS = ("chat", "frontend-chat")
+
+_server_timing = re.compile(r"(app|queue);dur=([0-9.]+)")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """"graph=0.4,web=0.6" -> normalized weights per query class."""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in QUERY_MIX:
+            raise ValueError(f"Unknown query class {name!r}; choose from {', '.join(QUERY_MIX)}")
+        mix[name] = float(weight or 1)
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def send(base_url: str, endpoint: str, query: str, user: str, timeout: float) -> Dict[str, Any]:
+    """
+    One request; returns status, latency and in-app time (None if unknown).
+    A 200 whose body is the chatbot's error response counts as "app-error".
+    """
+    if endpoint == "chat":
+        payload = {"query": query}
+    else:
+        payload = {"message": query, "userId": user}
+    req = urllib.request.Request(f"{base_url}/api/{endpoint}", data=json.dumps(payload).encode(),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            status, headers = resp.status, resp.headers
+        if json.loads(body or b"{}").get("type") == "error":
+            status = "app-error"
+    except urllib.error.HTTPError as e:
+        e.read()
+        status, headers = e.code, e.headers
+    except Exception as e:
+        return {"status": type(e).__name__, "latency": time.perf_counter() - start, "app": None, "admission": None}
+    latency = time.perf_counter() - start
+
+    timings = {name: float(ms) / 1000 for name, ms in _server_timing.findall(headers.get("Server-Timing", ""))}
+    return {"status": status, "latency": latency, "app": timings.get("app"), "admission": timings.get("queue")}
+
+
+def run_rate(base_url: str, rate: float, duration: float, mix: Dict[str, float], endpoints: List[str],
+             users: int, timeout: float, max_inflight: int, rng: random.Random) -> Dict[str, Any]:
+    """Offer ``rate`` requests/s for ``duration`` seconds and summarize the outcome."""
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    inflight = threading.Semaphore(max_inflight)
+    dropped = 0
+    classes, weights = list(mix), list(mix.values())
+
+    def one(cls: str, endpoint: str, query: str, user: str, scheduled: float):
+        try:
+            # Client lag: how late the request left relative to its arrival time
+            lag = time.perf_counter() - scheduled
+            outcome = send(base_url, endpoint, query, user, timeout)
+            outcome.update({"class": cls, "endpoint": endpoint, "lag": lag,
+                            "done": time.perf_counter()})
+            with lock:
+                results.append(outcome)
+        finally:
+            inflight.release()
+
+    start = time.perf_counter()
+    next_arrival = start
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        while True:
+            next_arrival += rng.expovariate(rate)
+            if next_arrival - start >= duration:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Never block the arrival process; count what the client can't send
+            if not inflight.acquire(blocking=False):
+                dropped += 1
+                continue
+            cls = rng.choices(classes, weights)[0]
+            pool.submit(one, cls, rng.choice(endpoints), rng.choice(QUERY_MIX[cls]),
+                        f"LOAD-{rng.randrange(users)}", next_arrival)
+    end = max([r["done"] for r in results], default=time.perf_counter())
+
+    ok = [r for r in results if r["status"] == 200]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    latencies = [r["latency"] for r in ok]
+    queueing = [r["latency"] - r["app"] for r in ok if r["app"] is not None]
+    offered = len(results) + dropped
+
+    return {
+        "offered_rps": rate,
+        "sent": len(results),
+        "client_dropped": dropped,
+        "achieved_rps": len(ok) / (end - start) if end > start else 0.0,
+        "error_rate": (offered - len(ok)) / offered if offered else 0.0,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queue_p50_ms": percentile(queueing, 0.50) * 1000,
+        "queue_p95_ms": percentile(queueing, 0.95) * 1000,
+        "admission_p95_ms": percentile([r["admission"] for r in ok if r["admission"] is not None], 0.95) * 1000,
+        "client_lag_p95_ms": percentile([r["lag"] for r in results], 0.95) * 1000,
+        "p50_ms_by_class": {cls: percentile([r["latency"] for r in ok if r["class"] == cls], 0.5) * 1000
+                            for cls in mix},
+    }
+
+
+def start_standin_server(args) -> str:
+    """Serve app.py on an ephemeral local port with every backend replaced by a stand-in."""
+    from werkzeug.serving import make_server
+
+    # The real clients are still constructed before being swapped out
+    os.environ.setdefault("OPENAI_API_KEY", "standin")
+    os.environ.setdefault("TAVILY_API_KEY", "standin")
+    fakes.install(fakes.BackendProfile(llm=args.llm, tavily=args.tavily, graph=args.graph,
+                                       embedding=args.embedding, seed=args.seed))
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="standin-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def print_report(reports: List[Dict[str, Any]]) -> None:
+    print(f"{'offered':>8}{'achieved':>9}{'err %':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'q p50':>9}{'q p95':>9}{'adm p95':>9}{'lag p95':>9}  errors")
+    for r in reports:
+        print(f"{r['offered_rps']:>8.1f}{r['achieved_rps']:>9.1f}{r['error_rate'] * 100:>7.1f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+              f"{r['queue_p50_ms']:>9.1f}{r['queue_p95_ms']:>9.1f}{r['admission_p95_ms']:>9.1f}"
+              f"{r['client_lag_p95_ms']:>9.1f}  {r['errors'] or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test of the chat endpoints.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="base URL of a running app.py")
+    parser.add_argument("--standin", action="store_true", help="serve app.py in-process against the stand-ins")
+    parser.add_argument("--rates", default="1,2,5,10", help="comma-separated offered loads (requests/s)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per rate")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="query class weights, e.g. graph=0.5,web=0.5")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--users", type=int, default=50, help="distinct userIds for /api/frontend-chat")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--max-inflight", type=int, default=512, help="client-side cap on open requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm", default=fakes.BackendProfile.llm)
+    parser.add_argument("--tavily", default=fakes.BackendProfile.tavily)
+    parser.add_argument("--graph", default=fakes.BackendProfile.graph)
+    parser.add_argument("--embedding", default=fakes.BackendProfile.embedding)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    base_url: Optional[str] = start_standin_server(args) if args.standin else args.url.rstrip("/")
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+
+    reports = []
+    for rate in (float(r) for r in args.rates.split(",")):
+        print(f"offering {rate:g} req/s for {args.duration:g}s ...", file=sys.stderr)
+        reports.append(run_rate(base_url, rate, args.duration, mix, args.endpoints, args.users,
+                                args.timeout, args.max_inflight, rng))
+    print_report(reports)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"url": base_url, "mix": mix, "reports": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Record/replay of external calls (OpenAI, Tavily, embeddings, Neo4j).
+
+CASSETTE_MODE=record captures the inputs, outputs and latency of every
+external call into a gzip'd JSON-lines cassette at CASSETTE_PATH;
+CASSETTE_MODE=replay serves the recorded outputs back instead of calling
+out, optionally sleeping for the original latency
+(CASSETTE_REPLAY_TIMING=1). With the default CASSETTE_MODE=off calls go
+straight through.
+
+Calls are matched on (kind, hash of the request); repeated identical
+requests are replayed in recorded order. Batched calls whose batches
+depend on timing (embeddings) are recorded per item, see ``through_each``. Replay needs no network or
+credentials, but the clients are still constructed, so set dummy
+OPENAI_API_KEY/TAVILY_API_KEY values.
+"""
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMiss(KeyError):
+    """Replay found no recorded response for a request."""
+
+
+def _default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    # neo4j temporal/spatial values and anything else exotic
+    return str(value)
+
+
+def _object_hook(obj):
+    if len(obj) == 1 and "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+def request_key(kind: str, request: Dict[str, Any]) -> str:
+    payload = json.dumps(request, sort_keys=True, default=_default)
+    return hashlib.sha1(f"{kind}\n{payload}".encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, replay_timing: bool = False):
+        self.path = path
+        self.mode = mode
+        self.replay_timing = replay_timing
+        self._lock = threading.Lock()
+        self._entries: Dict[str, deque] = defaultdict(deque)
+        self._file = None
+
+        if mode == "replay":
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line, object_hook=_object_hook)
+                    self._entries[entry["key"]].append(entry)
+        elif mode == "record":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = gzip.open(path, "at", encoding="utf-8")
+            atexit.register(self.close)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, kind: str, request: Dict[str, Any], response: Any, latency: float) -> None:
+        entry = {"kind": kind, "key": request_key(kind, request), "request": request,
+                 "response": response, "latency": latency}
+        line = json.dumps(entry, default=_default)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def replay(self, kind: str, request: Dict[str, Any]) -> Any:
+        key = request_key(kind, request)
+        with self._lock:
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded {kind} response for request {key[:12]}")
+            # Keep the last response around for any further repeats
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.replay_timing:
+            time.sleep(entry["latency"])
+        return entry["response"]
+
+
+_cassette: Optional[Cassette] = None
+_cassette_lock = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette, or None when CASSETTE_MODE is off."""
+    global _cassette
+    mode = os.getenv("CASSETTE_MODE", "off").lower()
+    if mode not in ("record", "replay"):
+        return None
+    with _cassette_lock:
+        if _cassette is None or _cassette.mode != mode:
+            _cassette = Cassette(os.getenv("CASSETTE_PATH", "cassettes/session.jsonl.gz"), mode,
+                                 os.getenv("CASSETTE_REPLAY_TIMING", "").lower() in ("1", "true", "yes"))
+        return _cassette
+
+
+def through(kind: str, request: Dict[str, Any], call: Callable[[], Any],
+            encode: Callable[[Any], Any] = lambda x: x,
+            decode: Callable[[Any], Any] = lambda x: x) -> Any:
+    """
+    Run an external call through the cassette. ``request`` identifies the
+    call; ``encode`` turns the live result into JSON-able data and
+    ``decode`` turns recorded data back into what callers expect.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return call()
+    if cassette.mode == "replay":
+        return decode(cassette.replay(kind, request))
+
+    start = time.perf_counter()
+    result = call()
+    latency = time.perf_counter() - start
+    try:
+        cassette.record(kind, request, encode(result), latency)
+    except Exception:
+        logger.exception("Failed to record %s call", kind)
+    return result
+
+
+def through_each(kind: str, key: str, items: Sequence[Any], call: Callable[[List[Any]], List[Any]],
+                 encode: Callable[[Any], Any] = lambda x: x,
+                 decode: Callable[[Any], Any] = lambda x: x) -> List[Any]:
+    """
+    ``through`` for a batched call, with one entry per item ({key: item}),
+    so replay doesn't depend on how items were grouped into batches.
+    ``call`` maps a list of items to their results; ``encode``/``decode``
+    handle one result. Each entry gets an equal share of the batch latency.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return call(list(items))
+    if cassette.mode == "replay":
+        return [decode(cassette.replay(kind, {key: item})) for item in items]
+
+    start = time.perf_counter()
+    results = call(list(items))
+    latency = (time.perf_counter() - start) / max(1, len(results))
+    for item, result in zip(items, results):
+        try:
+            cassette.record(kind, {key: item}, encode(result), latency)
+        except Exception:
+            logger.exception("Failed to record %s call", kind)
+    return results
+
+
+# — helpers for the calls this app makes
+
+def invoke_chat(model, messages):
+    """``model.invoke(messages)`` for a chat model, through the cassette."""
+    request = {
+        "model": getattr(model, "model_name", None),
+        "temperature": getattr(model, "temperature", None),
+        "messages": [getattr(m, "content", str(m)) for m in messages],
+    }
+
+    def decode(data):
+        from langchain_core.messages import AIMessage
+        return AIMessage(content=data["content"])
+
+    return through("openai.chat", request, lambda: model.invoke(messages),
+                   encode=lambda r: {"content": r.content}, decode=decode)
+
+
+def encode_vectors(vectors: Sequence[Sequence[float]]) -> Dict[str, Any]:
+    """Float32 rows as base64; several times smaller than JSON float lists."""
+    import numpy as np
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return {"shape": list(matrix.shape), "data": base64.b64encode(matrix.tobytes()).decode("ascii")}
+
+
+def decode_vectors(data: Dict[str, Any]) -> List[List[float]]:
+    import numpy as np
+    raw = data["data"]
+    if isinstance(raw, str):
+        raw = base64.b64decode(raw)
+    return np.frombuffer(raw, dtype=np.float32).reshape(data["shape"]).tolist()
+
+
+def encode_records(records) -> List[Dict[str, Any]]:
+    """neo4j Records as plain dicts (nodes become their property maps)."""
+    return [record.data() for record in records]
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+"""
+Retention and compaction job for the Query/WebResult cache graph.
+
+Every web fallback adds Query and WebResult nodes, and similarity lookups
+get slower as they pile up. Each run:
+
+1) merges near-duplicate Query nodes (cosine >= CACHE_MERGE_THRESHOLD)
+   into the most-hit one of each group, re-pointing HAS_RESULT edges and
+   leaving a (:QueryAlias {normText})-[:ALIAS_OF]-> node behind so exact
+   lookups of the merged text still hit. Only Queries created since the
+   last run are compared (with the rest of the cache), through the vector
+   index or sidecar store when there is one; the watermark is kept on a
+   (:CacheCompaction {name}) node;
+2) evicts WebResults fetched more than CACHE_MAX_AGE_DAYS ago, or with
+   fewer than CACHE_MIN_HITS hits once they are CACHE_MIN_HITS_GRACE_DAYS
+   old;
+3) caps the cache at CACHE_MAX_WEB_RESULTS / CACHE_MAX_QUERIES nodes,
+   evicting least recently (CACHE_EVICTION=lru) or least often (lfu) hit
+   ones first;
+4) sweeps WebResults no Query points to and Queries left without results
+   (both only after CACHE_ORPHAN_GRACE_MINUTES, so nodes a live request is
+   still writing are left alone), and the Passages of evicted WebResults;
+5) deletes stored content bodies (ContentBody nodes, or files in the
+   CONTENT_STORE_DIR blob store) that no WebResult references any more;
+
+and drops the deleted nodes from the sidecar embedding store. Deletes run
+in small batches, one transaction each, so live traffic is never locked
+out for long. Limits of 0 disable that step.
+
+Usage:
+   python compact_cache.py [--dry-run] [--batch-size 500]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+import content_store
+from embedding_codec import decode_rows
+from embedding_store import get_embedding_store
+from graph_agent import GraphDatabaseService, iter_batches
+from log_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Neighbours looked up per new Query when merging through the vector index / store
+MERGE_NEIGHBOURS = 10
+
+# Eviction order for the size caps: oldest/least-hit first
+EVICTION_ORDER = {
+    "lru": "coalesce(n.lastHitAt, n.createdAt, n.fetchedAt, datetime({epochMillis: 0})) ASC",
+    "lfu": "coalesce(n.hits, 0) ASC, coalesce(n.lastHitAt, n.createdAt, n.fetchedAt, datetime({epochMillis: 0})) ASC",
+}
+
+
+class CacheCompactor:
+    def __init__(self, db: GraphDatabaseService,
+                 merge_threshold: float = 0.97,
+                 max_age_days: float = 30,
+                 min_hits: int = 1,
+                 min_hits_grace_days: float = 7,
+                 max_queries: int = 0,
+                 max_web_results: int = 0,
+                 eviction: str = "lru",
+                 orphan_grace_minutes: float = 10,
+                 batch_size: int = 500,
+                 pause: float = 0.05,
+                 dry_run: bool = False):
+        if eviction not in EVICTION_ORDER:
+            raise ValueError(f"eviction must be one of {sorted(EVICTION_ORDER)}")
+        self.db = db
+        self.merge_threshold = merge_threshold
+        self.max_age_days = max_age_days
+        self.min_hits = min_hits
+        self.min_hits_grace_days = min_hits_grace_days
+        self.max_queries = max_queries
+        self.max_web_results = max_web_results
+        self.eviction = eviction
+        self.orphan_grace_minutes = orphan_grace_minutes
+        self.batch_size = max(1, batch_size)
+        self.pause = pause
+        self.dry_run = dry_run
+        self.deleted: Dict[str, List[str]] = {"Query": [], "WebResult": [], "Passage": [], "ContentBody": []}
+
+    @classmethod
+    def from_env(cls, db: GraphDatabaseService, **overrides) -> "CacheCompactor":
+        settings = dict(
+            merge_threshold=float(os.getenv("CACHE_MERGE_THRESHOLD", "0.97")),
+            max_age_days=float(os.getenv("CACHE_MAX_AGE_DAYS", "30")),
+            min_hits=int(os.getenv("CACHE_MIN_HITS", "1")),
+            min_hits_grace_days=float(os.getenv("CACHE_MIN_HITS_GRACE_DAYS", "7")),
+            max_queries=int(os.getenv("CACHE_MAX_QUERIES", "0")),
+            max_web_results=int(os.getenv("CACHE_MAX_WEB_RESULTS", "0")),
+            eviction=os.getenv("CACHE_EVICTION", "lru").lower(),
+            orphan_grace_minutes=float(os.getenv("CACHE_ORPHAN_GRACE_MINUTES", "10")),
+        )
+        settings.update(overrides)
+        return cls(db, **settings)
+
+    def run(self) -> Dict[str, int]:
+        """Run every step once; returns how many nodes each step merged or deleted."""
+        if not self.dry_run:
+            self.db.ensure_indexes()
+        stats = {
+            "merged": self.merge_duplicates(),
+            "expired": self.evict_web_results(),
+            "capped_web_results": self.cap("WebResult", self.max_web_results),
+            "capped_queries": self.cap("Query", self.max_queries),
+        }
+        stats["orphan_web_results"], stats["orphan_queries"], stats["orphan_passages"] = self.sweep_orphans()
+        stats["orphan_content_bodies"] = self.sweep_content_bodies()
+        stats["store_rows_removed"] = self.prune_embedding_stores()
+        return stats
+
+    def _pace(self) -> None:
+        # Leave room between write transactions for live traffic
+        if self.pause:
+            time.sleep(self.pause)
+
+    # — 1) near-duplicate queries
+
+    def _merged_through(self) -> Optional[str]:
+        """When the last completed run started, or None before the first one."""
+        rows = self.db.execute_query("""
+        MATCH (c:CacheCompaction {name: 'compact_cache'}) RETURN toString(c.mergedThrough) AS at
+        """)
+        return rows[0]["at"] if rows else None
+
+    def _set_merged_through(self, at: str) -> None:
+        self.db.execute_query("""
+        MERGE (c:CacheCompaction {name: 'compact_cache'})
+        SET c.mergedThrough = datetime($at)
+        """, {"at": at})
+
+    def _iter_queries(self, since: Optional[str] = None) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """(ids, unit embeddings) of Queries (created at or after ``since``), a batch at a time."""
+        records = self.db.stream_query("""
+        MATCH (n:Query)
+        WHERE (n.embeddingBlob IS NOT NULL OR n.embedding IS NOT NULL)
+          AND ($since IS NULL OR n.createdAt >= datetime($since))
+        RETURN elementId(n) AS nodeId,
+               n.embeddingBlob AS blob,
+               n.embeddingScale AS scale,
+               n.embeddingCodec AS codec,
+               CASE WHEN n.embeddingBlob IS NULL THEN n.embedding END AS embedding
+        """, {"since": since}, fetch_size=self.batch_size * 4)
+        for batch in iter_batches(records, self.batch_size * 4):
+            ids, matrix = decode_rows(batch)
+            if ids:
+                # decode_rows already returns unit-length rows
+                yield ids, matrix
+
+    def _similar_pairs(self, new_ids: List[str], new_matrix: np.ndarray) -> Set[Tuple[str, str]]:
+        """Pairs of Query ids, at least one of them new, at or above the merge threshold."""
+        pairs: Set[Tuple[str, str]] = set()
+        if self.db.indexed_search("Query"):
+            for node_id, vec in zip(new_ids, new_matrix):
+                for other, sim in self.db.similar_nodes("Query", vec.tolist(), MERGE_NEIGHBOURS):
+                    if other != node_id and sim >= self.merge_threshold:
+                        pairs.add((node_id, other))
+            return pairs
+
+        # One streamed pass over the cache, compared with the new rows in blocks
+        # so the similarity matrix never exceeds ~64 MB
+        for ids, matrix in self._iter_queries():
+            block = max(1, (1 << 24) // max(1, len(ids)))
+            for start in range(0, len(new_ids), block):
+                rows, cols = np.nonzero(new_matrix[start:start + block] @ matrix.T >= self.merge_threshold)
+                for r, c in zip(rows, cols):
+                    a, b = new_ids[start + int(r)], ids[int(c)]
+                    if a != b:
+                        pairs.add((a, b))
+        return pairs
+
+    def find_duplicates(self, since: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        [{canonical, duplicate}] pairs for Queries created at or after ``since``
+        (all of them when None): each group of near-duplicates folds into its
+        most-hit Query, the oldest on a tie.
+        """
+        new_ids: List[str] = []
+        chunks: List[np.ndarray] = []
+        for ids, matrix in self._iter_queries(since):
+            new_ids.extend(ids)
+            chunks.append(matrix)
+        if not new_ids:
+            return []
+        pairs = self._similar_pairs(new_ids, np.vstack(chunks))
+        if not pairs:
+            return []
+
+        parent: Dict[str, str] = {}
+
+        def find(i: str) -> str:
+            parent.setdefault(i, i)
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for a, b in pairs:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[rb] = ra
+
+        members = list(parent)
+        ranks = {r["nodeId"]: (r["hits"], -r["created"]) for r in self.db.execute_query("""
+        UNWIND $ids AS id
+        MATCH (n:Query) WHERE elementId(n) = id
+        RETURN id AS nodeId, coalesce(n.hits, 0) AS hits,
+               coalesce(n.createdAt.epochMillis, 0) AS created
+        """, {"ids": members})}
+        groups: Dict[str, List[str]] = {}
+        for node_id in members:
+            if node_id in ranks:
+                groups.setdefault(find(node_id), []).append(node_id)
+        merges = []
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            canonical = max(group, key=lambda i: ranks[i])
+            merges.extend({"canonical": canonical, "duplicate": i} for i in group if i != canonical)
+        return merges
+
+    def merge_duplicates(self) -> int:
+        # Taken before reading, so Queries created meanwhile are compared next run
+        started = datetime.now(timezone.utc).isoformat()
+        merges = self.find_duplicates(self._merged_through())
+        if self.dry_run:
+            return len(merges)
+        if not merges:
+            self._set_merged_through(started)
+            return 0
+
+        cypher = """
+        UNWIND $merges AS m
+        MATCH (c:Query) WHERE elementId(c) = m.canonical
+        MATCH (d:Query) WHERE elementId(d) = m.duplicate
+        OPTIONAL MATCH (d)-[:HAS_RESULT]->(w:WebResult)
+        WITH c, d, collect(w) AS results
+        OPTIONAL MATCH (a:QueryAlias)-[:ALIAS_OF]->(d)
+        WITH c, d, results, collect(a) AS aliases
+        FOREACH (w IN results | MERGE (c)-[:HAS_RESULT]->(w))
+        FOREACH (a IN aliases | MERGE (a)-[:ALIAS_OF]->(c))
+        MERGE (alias:QueryAlias {normText: d.normText})
+        MERGE (alias)-[:ALIAS_OF]->(c)
+        SET c.hits = coalesce(c.hits, 0) + coalesce(d.hits, 0),
+            c.lastHitAt = CASE WHEN c.lastHitAt IS NULL OR d.lastHitAt > c.lastHitAt
+                               THEN d.lastHitAt ELSE c.lastHitAt END
+        WITH d, elementId(d) AS duplicateId
+        DETACH DELETE d
+        RETURN duplicateId
+        """
+        merged = 0
+        for start in range(0, len(merges), self.batch_size):
+            records = self.db.execute_query(cypher, {"merges": merges[start:start + self.batch_size]})
+            self.deleted["Query"].extend(r["duplicateId"] for r in records)
+            merged += len(records)
+            self._pace()
+        self._set_merged_through(started)
+        logger.info("Merged %d near-duplicate queries", merged)
+        return merged
+
+    # — 2) age / hit based WebResult eviction
+
+    def evict_web_results(self) -> int:
+        conditions = []
+        if self.max_age_days > 0:
+            conditions.append("n.fetchedAt < datetime() - duration({seconds: toInteger($maxAge)})")
+        if self.min_hits > 0:
+            conditions.append("(coalesce(n.hits, 0) < $minHits"
+                              " AND n.fetchedAt < datetime() - duration({seconds: toInteger($grace)}))")
+        if not conditions:
+            return 0
+        where = " OR ".join(conditions)
+        params = {"maxAge": self.max_age_days * 86400, "minHits": self.min_hits,
+                  "grace": self.min_hits_grace_days * 86400}
+        if self.dry_run:
+            rows = self.db.execute_query(f"MATCH (n:WebResult) WHERE {where} RETURN count(n) AS n", params)
+            return rows[0]["n"] if rows else 0
+
+        cypher = f"""
+        MATCH (n:WebResult) WHERE {where}
+        WITH n LIMIT $limit
+        WITH n, elementId(n) AS nodeId
+        DETACH DELETE n
+        RETURN nodeId
+        """
+        return self._delete_until_done("WebResult", cypher, params)
+
+    def _delete_until_done(self, label: str, cypher: str, params: Dict) -> int:
+        deleted = 0
+        while True:
+            records = self.db.execute_query(cypher, {**params, "limit": self.batch_size})
+            self.deleted[label].extend(r["nodeId"] for r in records)
+            deleted += len(records)
+            self._pace()
+            if len(records) < self.batch_size:
+                logger.info("Evicted %d %s nodes", deleted, label)
+                return deleted
+
+    # — 3) size caps
+
+    def cap(self, label: str, limit: int) -> int:
+        """Evict ``label`` nodes beyond ``limit``, in eviction-policy order."""
+        if limit <= 0:
+            return 0
+        total = self.db.execute_query(f"MATCH (n:{label}) RETURN count(n) AS n")[0]["n"]
+        excess = total - limit
+        if excess <= 0 or self.dry_run:
+            return max(0, excess)
+
+        # Pick the victims in one read, then delete them in small batches
+        victims = [r["nodeId"] for r in self.db.execute_query(f"""
+        MATCH (n:{label})
+        RETURN elementId(n) AS nodeId
+        ORDER BY {EVICTION_ORDER[self.eviction]}
+        LIMIT $excess
+        """, {"excess": excess})]
+        return self._delete_ids(label, victims)
+
+    def _delete_ids(self, label: str, ids: List[str]) -> int:
+        # Aliases go with the Query they point to
+        cypher = f"""
+        UNWIND $ids AS id
+        MATCH (n:{label}) WHERE elementId(n) = id
+        OPTIONAL MATCH (a:QueryAlias)-[:ALIAS_OF]->(n)
+        DETACH DELETE a, n
+        RETURN DISTINCT id AS nodeId
+        """
+        deleted = 0
+        for start in range(0, len(ids), self.batch_size):
+            records = self.db.execute_query(cypher, {"ids": ids[start:start + self.batch_size]})
+            self.deleted[label].extend(r["nodeId"] for r in records)
+            deleted += len(records)
+            self._pace()
+        logger.info("Evicted %d %s nodes over the size cap", deleted, label)
+        return deleted
+
+    # — 4) orphans
+
+    def sweep_orphans(self) -> Tuple[int, int, int]:
+        params = {"grace": self.orphan_grace_minutes * 60}
+        old_enough = ("coalesce(n.{field}, datetime({{epochMillis: 0}})) "
+                      "< datetime() - duration({{seconds: toInteger($grace)}})")
+        web_where = f"NOT (n)<-[:HAS_RESULT]-(:Query) AND {old_enough.format(field='fetchedAt')}"
+        query_where = f"NOT (n)-[:HAS_RESULT]->(:WebResult) AND {old_enough.format(field='createdAt')}"
+        # Passages are written together with their WebResult link, so no grace period
+        passage_where = "NOT (:WebResult)-[:HAS_PASSAGE]->(n)"
+        if self.dry_run:
+            counts = []
+            for label, where in (("WebResult", web_where), ("Query", query_where), ("Passage", passage_where)):
+                rows = self.db.execute_query(f"MATCH (n:{label}) WHERE {where} RETURN count(n) AS n", params)
+                counts.append(rows[0]["n"] if rows else 0)
+            return counts[0], counts[1], counts[2]
+
+        web = self._delete_until_done("WebResult", f"""
+        MATCH (n:WebResult) WHERE {web_where}
+        WITH n LIMIT $limit
+        WITH n, elementId(n) AS nodeId
+        DETACH DELETE n
+        RETURN nodeId
+        """, params)
+        queries = self._delete_until_done("Query", f"""
+        MATCH (n:Query) WHERE {query_where}
+        WITH n LIMIT $limit
+        OPTIONAL MATCH (a:QueryAlias)-[:ALIAS_OF]->(n)
+        WITH n, collect(a) AS aliases, elementId(n) AS nodeId
+        FOREACH (a IN aliases | DETACH DELETE a)
+        DETACH DELETE n
+        RETURN nodeId
+        """, params)
+        passages = self._delete_until_done("Passage", f"""
+        MATCH (n:Passage) WHERE {passage_where}
+        WITH n LIMIT $limit
+        WITH n, elementId(n) AS nodeId
+        DETACH DELETE n
+        RETURN nodeId
+        """, {})
+        return web, queries, passages
+
+    # — 5) content bodies
+
+    def sweep_content_bodies(self) -> int:
+        """Delete stored bodies whose hash no WebResult has (they're shared across URLs)."""
+        if content_store.CONTENT_STORE_DIR:
+            referenced = [r["hash"] for r in self.db.stream_query(
+                "MATCH (w:WebResult) WHERE w.contentHash IS NOT NULL RETURN DISTINCT w.contentHash AS hash")]
+            # Bodies are written before their WebResult, so give live saves the grace period
+            removed = content_store.sweep_files(referenced, min_age=self.orphan_grace_minutes * 60,
+                                                dry_run=self.dry_run)
+            logger.info("Removed %d unreferenced content files", len(removed))
+            return len(removed)
+
+        # A body is MERGEd in the same transaction that sets its WebResult's contentHash
+        where = "NOT EXISTS { MATCH (w:WebResult) WHERE w.contentHash = n.hash }"
+        if self.dry_run:
+            return self.db.execute_query(f"MATCH (n:ContentBody) WHERE {where} RETURN count(n) AS n")[0]["n"]
+        return self._delete_until_done("ContentBody", f"""
+        MATCH (n:ContentBody) WHERE {where}
+        WITH n LIMIT $limit
+        WITH n, elementId(n) AS nodeId
+        DELETE n
+        RETURN nodeId
+        """, {})
+
+    # — sidecar store
+
+    def prune_embedding_stores(self) -> int:
+        removed = 0
+        for label, ids in self.deleted.items():
+            if label not in self.db.EMBEDDING_LABELS:
+                continue
+            store = get_embedding_store(label)
+            if store is not None and ids:
+                removed += store.remove(ids)
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge, expire and cap the Query/WebResult cache.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be merged or evicted")
+    parser.add_argument("--batch-size", type=int, default=500, help="nodes per write transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--eviction", choices=sorted(EVICTION_ORDER), help="overrides CACHE_EVICTION")
+    args = parser.parse_args()
+
+    configure_logging()
+    db = GraphDatabaseService()
+    try:
+        overrides = {"batch_size": args.batch_size, "pause": args.pause, "dry_run": args.dry_run}
+        if args.eviction:
+            overrides["eviction"] = args.eviction
+        stats = CacheCompactor.from_env(db, **overrides).run()
+        print(json.dumps(stats, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
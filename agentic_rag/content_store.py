@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Compressed storage for WebResult content.
+
+A WebResult node only keeps what cache reads need:
+  contentPreview - the search snippet, cut to CONTENT_PREVIEW_CHARS (what
+                   prompts and clients see)
+  contentHash    - sha256 of the full text (the raw page when Tavily sent
+                   one, the snippet otherwise)
+  contentLength  - characters in the full text
+
+The full text is zlib-compressed and stored once per hash, so the same
+page under several URLs is stored once: as a (:ContentBody {hash, blob,
+codec}) node by default, or as <hash[:2]>/<hash>.zz under
+CONTENT_STORE_DIR (a local blob store, keeping the bodies out of Neo4j's
+page cache altogether). ``load_bodies`` fetches full texts lazily, for
+the few callers that need more than the preview.
+
+Convert WebResults saved with a plain ``content`` property with:
+   python content_store.py [--batch-size 500]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CONTENT_PREVIEW_CHARS = int(os.getenv("CONTENT_PREVIEW_CHARS", "500"))
+CONTENT_STORE_DIR = os.getenv("CONTENT_STORE_DIR")
+CONTENT_CODEC = "zlib"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def decompress(blob: bytes, codec: Optional[str] = CONTENT_CODEC) -> str:
+    if codec not in (None, CONTENT_CODEC):
+        raise ValueError(f"Unknown content codec: {codec}")
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(CONTENT_STORE_DIR, digest[:2], f"{digest}.zz")
+
+
+def _write_file(digest: str, blob: bytes) -> None:
+    path = _blob_path(digest)
+    if os.path.exists(path):
+        return  # Same hash, same body
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def encode_content(preview: Optional[str], body: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Storage properties for one result: ``preview`` is the snippet, ``body``
+    the full text (defaults to the snippet). With CONTENT_STORE_DIR set the
+    body is written to the blob store and ``contentBlob`` is None.
+    """
+    preview = preview or ""
+    body = body or preview
+    digest = content_hash(body)
+    blob = compress(body)
+    if CONTENT_STORE_DIR:
+        _write_file(digest, blob)
+        blob = None
+    return {
+        "contentPreview": preview[:CONTENT_PREVIEW_CHARS],
+        "contentHash": digest,
+        "contentLength": len(body),
+        "contentBlob": blob,
+        "contentCodec": CONTENT_CODEC,
+    }
+
+
+def load_bodies(db, hashes: Iterable[str]) -> Dict[str, str]:
+    """Full texts for ``hashes`` (missing ones are left out), from the blob store or Neo4j."""
+    wanted = sorted({h for h in hashes if h})
+    if not wanted:
+        return {}
+    bodies: Dict[str, str] = {}
+    if CONTENT_STORE_DIR:
+        for digest in wanted:
+            try:
+                with open(_blob_path(digest), "rb") as f:
+                    bodies[digest] = decompress(f.read())
+            except FileNotFoundError:
+                logger.warning("Content body %s is missing from the blob store", digest)
+        return bodies
+
+    records = db.execute_query("""
+    MATCH (c:ContentBody) WHERE c.hash IN $hashes
+    RETURN c.hash AS hash, c.blob AS blob, c.codec AS codec
+    """, {"hashes": wanted})
+    for r in records:
+        bodies[r["hash"]] = decompress(bytes(r["blob"]), r["codec"])
+    return bodies
+
+
+def with_full_content(db, results: List[Dict[str, Any]], min_chars: int) -> List[Dict[str, Any]]:
+    """
+    ``results`` with the full text as ``content`` where a prompt wants more
+    than the stored preview (``min_chars`` above CONTENT_PREVIEW_CHARS);
+    bodies are only loaded in that case, and only for results that have more.
+    """
+    if min_chars <= CONTENT_PREVIEW_CHARS:
+        return results
+    needed = [r.get("contentHash") for r in results
+              if r.get("contentHash") and len(r.get("content") or "") < (r.get("contentLength") or 0)]
+    if not needed:
+        return results
+    bodies = load_bodies(db, needed)
+    return [{**r, "content": bodies[r["contentHash"]]} if r.get("contentHash") in bodies else r
+            for r in results]
+
+
+def sweep_files(referenced: Iterable[str], min_age: float = 600, dry_run: bool = False) -> List[str]:
+    """Delete blob-store files not in ``referenced`` (older than ``min_age`` seconds); returns their hashes."""
+    if not CONTENT_STORE_DIR or not os.path.isdir(CONTENT_STORE_DIR):
+        return []
+    import time
+    keep = set(referenced)
+    cutoff = time.time() - min_age
+    removed = []
+    for root, _, files in os.walk(CONTENT_STORE_DIR):
+        for name in files:
+            digest, ext = os.path.splitext(name)
+            path = os.path.join(root, name)
+            if ext == ".zz" and digest not in keep and os.path.getmtime(path) < cutoff:
+                if not dry_run:
+                    os.remove(path)
+                removed.append(digest)
+    return removed
+
+
+def migrate(db, batch_size: int = 500) -> int:
+    """
+    Move plain ``content`` properties into the compressed layout, one batch
+    per transaction. Safe to re-run; returns the number of WebResults converted.
+    """
+    fetch = """
+    MATCH (w:WebResult)
+    WHERE w.content IS NOT NULL AND w.contentHash IS NULL
+    RETURN elementId(w) AS nodeId, w.content AS content
+    LIMIT $limit
+    """
+    write = """
+    UNWIND $rows AS r
+      MATCH (w:WebResult) WHERE elementId(w) = r.nodeId
+      SET w.contentPreview = r.contentPreview,
+          w.contentHash    = r.contentHash,
+          w.contentLength  = r.contentLength
+      REMOVE w.content
+      FOREACH (_ IN CASE WHEN r.contentBlob IS NULL THEN [] ELSE [1] END |
+        MERGE (c:ContentBody {hash: r.contentHash})
+          ON CREATE SET c.blob = r.contentBlob, c.codec = r.contentCodec)
+    """
+    migrated = 0
+    while True:
+        records = db.execute_query(fetch, {"limit": batch_size})
+        if not records:
+            return migrated
+        db.execute_query(write, {"rows": [{"nodeId": r["nodeId"], **encode_content(r["content"])}
+                                          for r in records]})
+        migrated += len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress stored WebResult content.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from graph_agent import GraphDatabaseService
+
+    db = GraphDatabaseService()
+    try:
+        print(f"Converted {migrate(db, batch_size=args.batch_size)} WebResults")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compact storage format for embeddings kept on Neo4j nodes.
+
+Instead of a list of 64-bit floats, a node stores:
+  embeddingBlob  - the L2-normalised vector as raw bytes
+  embeddingScale - the int8 dequantisation factor (1.0 for float32)
+  embeddingCodec - "int8" or "float32"
+
+Vectors are normalised before encoding, so cosine similarity against
+decoded rows is a plain dot product.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+CODECS = ("int8", "float32")
+
+
+def _unit(vec) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+def encode_embedding(vec, codec: str = "int8") -> Dict[str, Any]:
+    """Encode a vector into the node properties described above."""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown embedding codec '{codec}', expected one of {CODECS}")
+    if vec is None or len(vec) == 0:
+        return {"embeddingBlob": None, "embeddingScale": None, "embeddingCodec": None}
+
+    u = _unit(vec)
+    if codec == "float32":
+        return {"embeddingBlob": u.astype("<f4").tobytes(), "embeddingScale": 1.0, "embeddingCodec": codec}
+
+    peak = float(np.max(np.abs(u)))
+    scale = peak / 127.0 if peak > 0 else 1.0
+    q = np.clip(np.rint(u / scale), -127, 127).astype(np.int8)
+    return {"embeddingBlob": q.tobytes(), "embeddingScale": scale, "embeddingCodec": codec}
+
+
+def decode_embedding(blob: bytes, scale: Optional[float], codec: Optional[str]) -> np.ndarray:
+    """Decode stored properties back into a float32 (unit-length) vector."""
+    if codec == "float32":
+        return np.frombuffer(blob, dtype="<f4")
+    if codec == "int8":
+        return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * np.float32(scale)
+    raise ValueError(f"Unknown embedding codec '{codec}'")
+
+
+def decode_rows(rows: Iterable[Dict[str, Any]]) -> Tuple[List[Any], np.ndarray]:
+    """
+    Turn query records with ``nodeId`` plus either compact properties
+    (``blob``, ``scale``, ``codec``) or a legacy ``embedding`` list into
+    (ids, matrix) with one unit-length float32 row per id.
+    Rows whose dimension doesn't match the first row are skipped.
+    """
+    ids, vectors = [], []
+    for r in rows:
+        if r.get("blob") is not None:
+            v = decode_embedding(r["blob"], r.get("scale"), r.get("codec"))
+        elif r.get("embedding"):
+            v = _unit(r["embedding"])
+        else:
+            continue
+        if vectors and v.shape != vectors[0].shape:
+            continue
+        ids.append(r["nodeId"])
+        vectors.append(v)
+
+    if not vectors:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return ids, np.vstack(vectors)
+
+
+def top_matches(vec, ids: List[Any], matrix: np.ndarray, k: int) -> List[Tuple[Any, float]]:
+    """Return up to ``k`` (id, cosine similarity) pairs, best first."""
+    if not ids or k <= 0:
+        return []
+    u = _unit(vec)
+    if u.shape[0] != matrix.shape[1]:
+        return []
+    sims = matrix @ u
+    k = min(k, len(ids))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(ids[i], float(sims[i])) for i in top]
@@ -0,0 +1,206 @@
+"""
+Dynamic micro-batching for embedding requests.
+
+Concurrent ``embed_text`` calls each want one small forward pass. The
+MicroBatchEmbedder queues them, waits at most ``max_wait_ms`` for more
+to arrive (up to ``max_batch_size``), runs one batched encode and
+resolves every caller's future. Works for threads (``embed``) and
+asyncio callers (``aembed``).
+
+The model can also live in a separate local process, so web workers
+don't each load it:
+
+   EMBEDDING_SERVER_AUTHKEY=<secret> python embedding_scheduler.py --serve 127.0.0.1:6001
+
+and workers set EMBEDDING_SERVER_ADDRESS=127.0.0.1:6001 and the same
+EMBEDDING_SERVER_AUTHKEY. The server runs its own micro-batcher, so
+requests from all workers batch together.
+
+The connection pickles its messages, so anyone who can connect with the
+key can run code in the server: both sides refuse to start without
+EMBEDDING_SERVER_AUTHKEY, and the server only listens on loopback or a
+Unix socket path unless started with --allow-remote.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+EncodeBatch = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+
+def server_authkey() -> bytes:
+    """EMBEDDING_SERVER_AUTHKEY, which the server and its clients must share."""
+    authkey = os.getenv("EMBEDDING_SERVER_AUTHKEY", "").encode()
+    if not authkey:
+        raise RuntimeError("EMBEDDING_SERVER_AUTHKEY must be set to use the embedding server")
+    return authkey
+
+
+class MicroBatchEmbedder:
+    def __init__(self, encode_batch: EncodeBatch, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the returned future resolves to its embedding."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first: Tuple[str, Future]) -> Tuple[List[Tuple[str, Future]], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+
+            # Identical texts in one batch are encoded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = self.encode_batch(texts)
+                by_text = {t: list(map(float, v)) for t, v in zip(texts, vectors)}
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if stop:
+                return
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """"host:port" -> TCP address, anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+class RemoteEncoder:
+    """Client for an embedding server; one connection per calling thread."""
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None):
+        self.address = parse_address(address)
+        self.authkey = authkey or server_authkey()
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        conn = self._connection()
+        try:
+            conn.send(texts)
+            status, payload = conn.recv()
+        except (EOFError, OSError):
+            # Server restarted; reconnect once
+            self._local.conn = None
+            conn = self._connection()
+            conn.send(texts)
+            status, payload = conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Embedding server error: {payload}")
+        return payload
+
+
+def is_local(address: Union[str, Tuple[str, int]]) -> bool:
+    """A Unix socket path, or a TCP address on a loopback interface."""
+    return isinstance(address, str) or address[0] in ("127.0.0.1", "::1", "localhost")
+
+
+def serve(address: str, authkey: bytes,
+          model_name: str = "all-MiniLM-L6-v2",
+          max_batch_size: int = 32, max_wait_ms: float = 5.0) -> None:
+    """Load the model once and answer embedding requests from local workers."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    batcher = MicroBatchEmbedder(lambda texts: model.encode(texts).tolist(),
+                                 max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    texts = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    # Fan out so texts from every connection share batches
+                    futures = [batcher.submit(t) for t in texts]
+                    conn.send(("ok", [f.result() for f in futures]))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        logger.info("Embedding server listening on %s", address)
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a shared local embedding server.")
+    parser.add_argument("--serve", metavar="ADDRESS", default="127.0.0.1:6001",
+                        help="host:port or Unix socket path to listen on (default 127.0.0.1:6001)")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="allow listening on a non-loopback interface")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    from log_config import configure_logging
+    configure_logging()
+    if not args.allow_remote and not is_local(parse_address(args.serve)):
+        parser.error(f"{args.serve} is not a loopback address; pass --allow-remote to listen on it")
+    authkey = server_authkey()
+    serve(args.serve, authkey, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Sidecar embedding store shared by all worker processes.
+
+Each store is a pair of append-only files in EMBEDDING_STORE_DIR:
+  <name>.f32  - unit-length float32 rows, ``dim`` values each, no header
+  <name>.ids  - one node id per line, in the same order as the rows
+
+Readers map the row file read-only with np.memmap, so every process
+shares the same page-cache pages instead of holding its own copy.
+Writers append the row first and the id second, under a file lock, so a
+reader never sees an id without its row. Readers pick up appends made by
+other processes on their next search (a cheap stat of the id file,
+under the lock held shared).
+
+``remove`` (used by cache compaction) rewrites both files and swaps them
+in with os.replace under the same lock held exclusively. Readers check
+the inodes, read the ids and map the rows while holding it shared, so
+they never pair one generation's ids with another's rows.
+"""
+import argparse
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+DEFAULT_DIM = 384
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str, name: str, dim: int = DEFAULT_DIM):
+        os.makedirs(directory, exist_ok=True)
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.data_path = os.path.join(directory, f"{name}.f32")
+        self.ids_path = os.path.join(directory, f"{name}.ids")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        for path in (self.data_path, self.ids_path):
+            open(path, "ab").close()
+
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._id_set: set = set()
+        self._ids_offset = 0
+        self._matrix: Optional[np.ndarray] = None
+        # (ids inode, rows inode) of the generation currently loaded
+        self._inodes: Optional[Tuple[int, int]] = None
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._ids)
+
+    def _file_lock(self, mode: int):
+        lock_file = open(self.lock_path, "ab")
+        if fcntl:
+            fcntl.flock(lock_file, mode)
+        return lock_file
+
+    def _file_unlock(self, lock_file) -> None:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def _inode_pair(self) -> Tuple[int, int]:
+        return os.stat(self.ids_path).st_ino, os.stat(self.data_path).st_ino
+
+    def refresh(self) -> None:
+        """Pick up rows appended since the last refresh (by any process)."""
+        with self._lock:
+            # Held shared while checking, reading and mapping, so a rewrite
+            # (which holds it exclusively) can't swap the files in between
+            lock_file = self._file_lock(fcntl.LOCK_SH if fcntl else 0)
+            try:
+                inodes = self._inode_pair()
+                if inodes != self._inodes:
+                    # First load, or the files were rewritten: start over
+                    self._ids, self._id_set, self._ids_offset, self._matrix = [], set(), 0, None
+                    self._inodes = inodes
+                self._read_new_ids()
+                self._map_rows()
+            finally:
+                self._file_unlock(lock_file)
+
+    def _read_new_ids(self) -> None:
+        if os.path.getsize(self.ids_path) > self._ids_offset:
+            with open(self.ids_path, "rb") as f:
+                f.seek(self._ids_offset)
+                chunk = f.read()
+            # Only consume complete lines; a writer may be mid-append
+            complete = chunk[:chunk.rfind(b"\n") + 1]
+            for line in complete.decode("utf-8").splitlines():
+                self._ids.append(line)
+                self._id_set.add(line)
+            self._ids_offset += len(complete)
+
+    def _map_rows(self) -> None:
+        rows = min(len(self._ids), os.path.getsize(self.data_path) // self.row_bytes)
+        if rows and (self._matrix is None or self._matrix.shape[0] != rows):
+            self._matrix = np.memmap(self.data_path, dtype="<f4", mode="r", shape=(rows, self.dim))
+
+    def snapshot(self) -> Tuple[List[str], np.ndarray]:
+        """Return (ids, read-only matrix view) of everything visible right now."""
+        self.refresh()
+        with self._lock:
+            if self._matrix is None:
+                return [], np.empty((0, self.dim), dtype=np.float32)
+            rows = self._matrix.shape[0]
+            return self._ids[:rows], self._matrix
+
+    def append(self, ids: Sequence[str], vectors: Sequence[Sequence[float]]) -> int:
+        """Append rows for ids not already in the store; returns how many were added."""
+        self.refresh()
+        new_ids, new_rows = [], []
+        for node_id, vec in zip(ids, vectors):
+            v = np.asarray(vec, dtype=np.float32)
+            if node_id in self._id_set or node_id in new_ids or v.shape != (self.dim,):
+                continue
+            norm = float(np.linalg.norm(v))
+            new_ids.append(str(node_id))
+            new_rows.append(v / norm if norm > 0 else v)
+        if not new_ids:
+            return 0
+
+        with self._lock, open(self.lock_path, "ab") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have appended since our refresh; drop any
+                # partial id line left by a writer that died mid-append
+                with open(self.ids_path, "r+b") as f:
+                    content = f.read()
+                    complete = content[:content.rfind(b"\n") + 1]
+                    if len(complete) != len(content):
+                        f.truncate(len(complete))
+                on_disk = complete.decode("utf-8").splitlines()
+                known = set(on_disk)
+                keep = [i for i, node_id in enumerate(new_ids) if node_id not in known]
+                if not keep:
+                    return 0
+                # Keep the row file aligned with the id file before appending,
+                # in case an earlier writer died between the two writes.
+                # Readers never map rows past the id count, so this is safe.
+                aligned = len(on_disk) * self.row_bytes
+                with open(self.data_path, "r+b") as f:
+                    f.truncate(aligned)
+                    f.seek(aligned)
+                    f.write(np.vstack([new_rows[i] for i in keep]).astype("<f4").tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.ids_path, "ab") as f:
+                    f.write("".join(f"{new_ids[i]}\n" for i in keep).encode("utf-8"))
+                    f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return len(keep)
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """
+        Drop the rows for ``ids`` (e.g. nodes deleted by cache compaction)
+        by rewriting the store. Returns how many rows were removed.
+        """
+        drop = set(map(str, ids))
+        if not drop:
+            return 0
+        with self._lock:
+            lock_file = self._file_lock(fcntl.LOCK_EX if fcntl else 0)
+            try:
+                with open(self.ids_path, "rb") as f:
+                    content = f.read()
+                on_disk = content[:content.rfind(b"\n") + 1].decode("utf-8").splitlines()
+                matrix = np.fromfile(self.data_path, dtype="<f4")
+                rows = min(len(on_disk), matrix.size // self.dim)
+                matrix = matrix[:rows * self.dim].reshape(rows, self.dim)
+                keep = [i for i, node_id in enumerate(on_disk[:rows]) if node_id not in drop]
+                if len(keep) == rows:
+                    return 0
+
+                data_tmp, ids_tmp = self.data_path + ".tmp", self.ids_path + ".tmp"
+                with open(data_tmp, "wb") as f:
+                    f.write(matrix[keep].astype("<f4").tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(ids_tmp, "wb") as f:
+                    f.write("".join(f"{on_disk[i]}\n" for i in keep).encode("utf-8"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(data_tmp, self.data_path)
+                os.replace(ids_tmp, self.ids_path)
+                # Reload on the next refresh (existing snapshots keep the old mapping)
+                self._inodes = None
+                return rows - len(keep)
+            finally:
+                self._file_unlock(lock_file)
+
+
+_stores: Dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(name: str) -> Optional[EmbeddingStore]:
+    """
+    Return the process-wide store called ``name`` (e.g. "Query"),
+    or None when EMBEDDING_STORE_DIR isn't configured.
+    """
+    directory = os.getenv("EMBEDDING_STORE_DIR")
+    if not directory:
+        return None
+    with _stores_lock:
+        if name not in _stores:
+            dim = int(os.getenv("EMBEDDING_DIM", str(DEFAULT_DIM)))
+            _stores[name] = EmbeddingStore(directory, name, dim)
+        return _stores[name]
+
+
+def main():
+    """Backfill the sidecar store from the embeddings already in Neo4j."""
+    parser = argparse.ArgumentParser(description="Sync the sidecar embedding store with Neo4j.")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from graph_agent import GraphDatabaseService
+
+    db = GraphDatabaseService()
+    try:
+        for label in GraphDatabaseService.EMBEDDING_LABELS:
+            added = db.sync_embedding_store(label, batch_size=args.batch_size)
+            print(f"Added {added} {label} embeddings to the sidecar store")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
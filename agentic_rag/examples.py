@@ -0,0 +1,11 @@
+"""Example queries shown in the UI and warmed by ``warm_cache.py --examples``."""
+
+example_queries = [
+    "Recommend fantasy books similar to Lord of the Rings",
+    "What are good science fiction books about space exploration?",
+    "Tell me about top trading topics and book recommendations",
+    "Recommend books on cryptocurrency trading strategies",
+    "Suggest books about the history of Paris",
+    "What are good books set in Tokyo?",
+    "Recommend travel literature about Iceland"
+]
@@ -0,0 +1,86 @@
+"""
+LLM-polished versions of fast-path (templated) graph answers.
+
+With GRAPH_FAST_PATH enabled, generate_response answers structured graph
+intents from templates and the chat response carries a ``polishId``. The
+LLM-written version of the same answer can then be fetched from
+``GET /api/chat/polish/<polishId>``: with GRAPH_FAST_PATH=polish it is
+generated in the background straight away, with GRAPH_FAST_PATH=template
+only when someone asks for it. Entries expire after POLISH_TTL seconds.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
+from typing import Any, Dict, Optional
+
+from graph_agent import GRAPH_FAST_PATH, build_response_prompt, complete, grounding_terms
+
+logger = logging.getLogger(__name__)
+
+POLISH_TTL = float(os.getenv("POLISH_TTL", "600"))
+POLISH_TIMEOUT = float(os.getenv("POLISH_TIMEOUT", "60"))
+
+
+class PolishStore:
+    def __init__(self, max_entries: int = 1024, ttl: float = POLISH_TTL, workers: int = 4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="polish")
+
+    def register(self, query: str, graph_data: Dict[str, Any], background: bool = GRAPH_FAST_PATH == "polish") -> str:
+        """Remember a templated answer's inputs; returns its polish id."""
+        polish_id = uuid.uuid4().hex
+        entry = {"query": query, "graph_data": graph_data, "created": time.monotonic(), "future": None}
+        with self._lock:
+            self._entries[polish_id] = entry
+            self._expire()
+        if background:
+            self._start(entry)
+        return polish_id
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and now - oldest["created"] < self.ttl:
+                break
+            del self._entries[oldest_id]
+
+    def _start(self, entry: Dict[str, Any]) -> Future:
+        with self._lock:
+            if entry["future"] is None:
+                entry["future"] = self._executor.submit(polish, entry["query"], entry["graph_data"])
+            return entry["future"]
+
+    def get(self, polish_id: str, wait: Optional[float] = None) -> Optional[str]:
+        """
+        The polished answer, starting it if needed. Waits up to ``wait``
+        seconds; returns None if it isn't ready by then. Raises KeyError
+        for unknown or expired ids, and whatever the LLM call raised if
+        polishing failed.
+        """
+        with self._lock:
+            self._expire()
+            entry = self._entries[polish_id]
+        future = self._start(entry)
+        if wait:
+            futures_wait([future], timeout=wait)
+        if not future.done():
+            return None
+        return future.result()
+
+
+def polish(query: str, graph_data: Dict[str, Any]) -> str:
+    """The LLM-written answer for graph data that was answered from a template."""
+    state = {"query": query, "graph_data": graph_data, "found_in_graph": True, "web_data": None}
+    return complete(build_response_prompt(state), "graph", graph_data.get("type"), grounding_terms(state),
+                    timeout=POLISH_TIMEOUT)
+
+
+POLISH_STORE = PolishStore()
@@ -1,86 +1,484 @@
-from typing import Dict, List, Any, TypedDict, Literal, Optional
+from typing import Dict, Iterable, Iterator, List, Any, TypedDict, Literal, Optional
 import os
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import HumanMessage, AIMessage
-from neo4j import GraphDatabase
-import re
-import numpy as np
+from neo4j import GraphDatabase, Query
+from neo4j.exceptions import ClientError
 from sentence_transformers import SentenceTransformer
+from content_store import encode_content
+from embedding_codec import encode_embedding, decode_rows, top_matches
+from embedding_store import get_embedding_store
+from embedding_scheduler import MicroBatchEmbedder, RemoteEncoder
+import cassette
+import resilience
+from resilience import CircuitOpen, DeadlineExceeded
+from metrics import timed, instrument_node
+from model_policy import TIER_STATS, build_model, select_tier
+from query_analysis import QueryAnalysis, analysis_of, analyze, normalize_text
+from user_profiles import USER_PROFILES
 
+logger = logging.getLogger(__name__)
 
-# — normalize text (lowercase, strip punctuation, collapse spaces)
-def normalize_text(text: str) -> str:
-    t = text.lower().strip()
-    t = re.sub(r'[^\w\s]', '', t)
-    return re.sub(r'\s+', ' ', t)
 
-# — load one SentenceTransformer once for embeddings
-_embedder = SentenceTransformer("all-MiniLM-L6-v2")
+# — load one SentenceTransformer once for embeddings (lazily, so workers that
+#   use a shared embedding server never load the model themselves)
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _get_embedder() -> SentenceTransformer:
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = SentenceTransformer("all-MiniLM-L6-v2")
+        return _embedder
+
+
+def _encode_batch(texts: List[str], batch_size: int = 64) -> List[list[float]]:
+    """One forward pass for ``texts``, locally or on the shared embedding server."""
+    def encode(batch: List[str]) -> List[list[float]]:
+        if _remote_encoder is not None:
+            return _remote_encoder(batch)
+        return _get_embedder().encode(batch, batch_size=batch_size).tolist()
+
+    # Recorded per text: which texts share a micro-batch depends on timing
+    return cassette.through_each("embedding", "text", texts, encode,
+                                 encode=lambda vec: cassette.encode_vectors([vec]),
+                                 decode=lambda data: cassette.decode_vectors(data)[0])
+
+
+# — optional micro-batching of concurrent single-text embed_text calls
+#   (EMBEDDING_MICROBATCH=1), and an optional out-of-process model
+#   (EMBEDDING_SERVER_ADDRESS=host:port with a shared EMBEDDING_SERVER_AUTHKEY,
+#   see embedding_scheduler.py)
+_remote_encoder = (RemoteEncoder(os.environ["EMBEDDING_SERVER_ADDRESS"])
+                   if os.getenv("EMBEDDING_SERVER_ADDRESS") else None)
+_scheduler = (MicroBatchEmbedder(_encode_batch,
+                                 max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH", "32")),
+                                 max_wait_ms=float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5")))
+              if _remote_encoder is not None or os.getenv("EMBEDDING_MICROBATCH", "").lower() in ("1", "true", "yes")
+              else None)
+
+# — small in-process LRU of recent embeddings, so batch callers can pre-embed
+#   everything in one forward pass and later per-query lookups hit the cache
+_EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+_embedding_cache: "OrderedDict[str, list[float]]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+
+def _cache_get(text: str) -> Optional[list[float]]:
+    with _embedding_cache_lock:
+        vec = _embedding_cache.get(text)
+        if vec is not None:
+            _embedding_cache.move_to_end(text)
+        return vec
+
+
+def _cache_put(text: str, vec: list[float]) -> None:
+    with _embedding_cache_lock:
+        _embedding_cache[text] = vec
+        _embedding_cache.move_to_end(text)
+        while len(_embedding_cache) > _EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
 
 def embed_text(text: str) -> list[float]:
-    return _embedder.encode(text).tolist()
+    with timed("embedding.embed_text") as span:
+        cached = _cache_get(text)
+        if cached is not None:
+            span.cache = "hit"
+            return cached
+        span.cache = "miss"
+        if _scheduler is not None:
+            vec = _scheduler.embed(text)
+        else:
+            vec = _encode_batch([text])[0]
+        _cache_put(text, vec)
+        return vec
+
+
+def embed_texts(texts: List[str], batch_size: int = 64) -> List[list[float]]:
+    """
+    Embed many strings with a single batched forward pass.
+    Duplicates and already-cached strings are only encoded once;
+    results are returned in input order and left in the cache.
+    """
+    missing = list(dict.fromkeys(t for t in texts if _cache_get(t) is None))
+    if missing:
+        with timed("embedding.embed_texts"):
+            vectors = _encode_batch(missing, batch_size=batch_size)
+        for t, v in zip(missing, vectors):
+            _cache_put(t, v)
+
+    return [embed_text(t) for t in texts]
+
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Consecutive lists of up to ``size`` items, pulled lazily from ``items``."""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def book_text(book: Dict[str, Any]) -> str:
+    """The text a BOOK is embedded by: title, description and genres."""
+    genres = ", ".join(g for g in book.get("genres") or [] if g)
+    return " ".join(part for part in (book.get("title"), book.get("description"), genres) if part)
+
+
+# Stale-while-revalidate for cached web results, by the age of the oldest
+# result (seconds): younger than the soft TTL is served as-is, up to the
+# hard TTL is served while a background refresh runs (see web_refresh.py),
+# older is treated as a miss. 0 disables either limit.
+WEB_CACHE_SOFT_TTL = float(os.getenv("WEB_CACHE_SOFT_TTL", str(24 * 3600)))
+WEB_CACHE_HARD_TTL = float(os.getenv("WEB_CACHE_HARD_TTL", str(30 * 24 * 3600)))
+
+
+def web_cache_freshness(age: Optional[float]) -> str:
+    """"fresh", "stale" or "expired" for cached results ``age`` seconds old."""
+    if age is None:
+        return "fresh"
+    if WEB_CACHE_HARD_TTL > 0 and age >= WEB_CACHE_HARD_TTL:
+        return "expired"
+    if WEB_CACHE_SOFT_TTL > 0 and age >= WEB_CACHE_SOFT_TTL:
+        return "stale"
+    return "fresh"
+
+
+# Cache hits are counted in memory and written every CACHE_HIT_FLUSH_SECONDS,
+# so cache reads stay read-only transactions
+CACHE_HIT_FLUSH_SECONDS = float(os.getenv("CACHE_HIT_FLUSH_SECONDS", "30"))
+
+
+class CacheHitCounter:
+    """Pending hits and last-hit times per Query/WebResult elementId, flushed in batches."""
+
+    def __init__(self, interval: float = CACHE_HIT_FLUSH_SECONDS, batch_size: int = 500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Dict[str, Dict[str, list]] = {"Query": {}, "WebResult": {}}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, query_ids: Iterable[str], result_ids: Iterable[str]) -> None:
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            for label, ids in (("Query", query_ids), ("WebResult", result_ids)):
+                pending = self._pending[label]
+                for node_id in ids:
+                    entry = pending.setdefault(node_id, [0, now_ms])
+                    entry[0] += 1
+                    entry[1] = now_ms
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cache-hit-flush", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> int:
+        """Write the pending hits; ones that fail to write are kept for the next flush."""
+        with self._lock:
+            pending, self._pending = self._pending, {"Query": {}, "WebResult": {}}
+        if not any(pending.values()):
+            return 0
+        written = 0
+        db = None
+        try:
+            db = GraphDatabaseService()
+            for label, hits in pending.items():
+                rows = [{"id": node_id, "count": c, "lastHitAt": t} for node_id, (c, t) in hits.items()]
+                for batch in iter_batches(rows, self.batch_size):
+                    db.execute_query(f"""
+                    UNWIND $hits AS h
+                    MATCH (n:{label}) WHERE elementId(n) = h.id
+                    WITH n, h, datetime({{epochMillis: h.lastHitAt}}) AS hitAt
+                    SET n.hits = coalesce(n.hits, 0) + h.count,
+                        n.lastHitAt = CASE WHEN n.lastHitAt IS NULL OR n.lastHitAt < hitAt
+                                           THEN hitAt ELSE n.lastHitAt END
+                    """, {"hits": batch})
+                    for row in batch:
+                        del hits[row["id"]]
+                    written += len(batch)
+        except Exception as e:
+            logger.warning("Could not write cache hits, keeping them for the next flush: %s", e)
+            with self._lock:
+                for label, hits in pending.items():
+                    current = self._pending[label]
+                    for node_id, (count, last) in hits.items():
+                        entry = current.setdefault(node_id, [0, last])
+                        entry[0] += count
+                        entry[1] = max(entry[1], last)
+        finally:
+            if db is not None:
+                db.close()
+        return written
+
+
+CACHE_HITS = CacheHitCounter()
 
 
 class GraphDatabaseService:
+    # Storage format for Query/WebResult embeddings (see embedding_codec)
+    EMBEDDING_CODEC = os.getenv("EMBEDDING_CODEC", "int8")
+    EMBEDDING_LABELS = ("Query", "WebResult", "Passage")
+    EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "384"))
+
+    # Native vector indexes on the float-list ``embedding`` property, used
+    # when the server supports them: "auto" (detect), "on" or "off"
+    VECTOR_INDEX_MODE = os.getenv("NEO4J_VECTOR_INDEX", "auto").lower()
+    VECTOR_INDEXES = {"Query": "query_embedding", "WebResult": "webresult_embedding", "Passage": "passage_embedding"}
+
+    # Records pulled from the server per round-trip by stream_query
+    FETCH_SIZE = int(os.getenv("NEO4J_FETCH_SIZE", "1000"))
+
+    # Server capabilities, detected once per URI (and index set) per process
+    _capabilities: Dict[tuple, Dict[str, Any]] = {}
+    _capabilities_lock = threading.Lock()
+
     def __init__(self, uri=None, username=None, password=None):
         # Use environment variables with fallbacks
+        self.uri = uri or os.getenv("NEO4J_URI", "bolt://localhost:7687")
         self.driver = GraphDatabase.driver(
-            uri or os.getenv("NEO4J_URI", "bolt://localhost:7687"),
+            self.uri,
             auth=(
                 username or os.getenv("NEO4J_USERNAME", "neo4j"),
                 password or os.getenv("NEO4J_PASSWORD", "Admin@123")
-            )
+            ),
+            # Fail fast when Neo4j is unreachable instead of hanging the request
+            connection_timeout=float(os.getenv("NEO4J_CONNECTION_TIMEOUT", "5")),
+            connection_acquisition_timeout=float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "5"))
         )
         
     def close(self):
         self.driver.close()
         
     def execute_query(self, query, parameters=None):
-        with self.driver.session() as session:
-            result = session.run(query, parameters or {})
-            return [record for record in result]
+        def run():
+            # Bound the transaction by whatever is left of the request's budget
+            timeout = resilience.check_deadline()
+            with self.driver.session() as session:
+                result = session.run(Query(query, timeout=timeout) if timeout else query, parameters or {})
+                return [record for record in result]
+
+        with timed("neo4j.execute_query"):
+            return resilience.BREAKERS["neo4j"].call(
+                lambda: cassette.through("neo4j", {"query": query, "parameters": parameters or {}}, run,
+                                         encode=cassette.encode_records),
+                ignore=(ClientError,), neutral=(cassette.CassetteMiss,))
     
-    def search_book_knowledge(self, query: str) -> Dict[str, Any]:
-        """Search the Neo4j graph database for book-related information"""
-        keywords = query.lower().split()
+    def stream_query(self, query, parameters=None, fetch_size: Optional[int] = None) -> Iterator[Any]:
+        """
+        Yield records lazily, pulling ``fetch_size`` (NEO4J_FETCH_SIZE) at a
+        time from the server, so peak memory doesn't grow with the result.
+        Stopping early (break, islice) discards the rest without fetching
+        it. The query should RETURN only the fields the caller uses.
+        """
+        if cassette.get_cassette() is not None:
+            # Recording or replaying needs the whole result anyway
+            yield from self.execute_query(query, parameters)
+            return
+
+        timeout = resilience.check_deadline()
+        with timed("neo4j.stream_query"), self.driver.session(fetch_size=fetch_size or self.FETCH_SIZE) as session:
+            result = resilience.BREAKERS["neo4j"].call(
+                lambda: session.run(Query(query, timeout=timeout) if timeout else query, parameters or {}),
+                ignore=(ClientError,))
+            yield from result
+
+    def capabilities(self) -> Dict[str, Any]:
+        """
+        Server version/edition and whether native vector indexes are usable
+        (creating them on first detection). Detected once per URI and index
+        set; a failed
+        detection (e.g. server down) is retried on the next call.
+        """
+        key = (self.uri, tuple(sorted(self.VECTOR_INDEXES.values())))
+        caps = self._capabilities.get(key)
+        if caps is not None:
+            return caps
+        with self._capabilities_lock:
+            caps = self._capabilities.get(key)
+            if caps is None:
+                caps = self._detect_capabilities()
+                if caps is not None:
+                    GraphDatabaseService._capabilities[key] = caps
+        return caps or {"version": None, "edition": None, "vector_index": False}
+
+    def _detect_capabilities(self) -> Optional[Dict[str, Any]]:
+        caps = {"version": None, "edition": None, "vector_index": False}
+        try:
+            self.ensure_indexes()
+        except Exception as e:
+            logger.warning("Could not create lookup indexes: %s", e)
+        if self.VECTOR_INDEX_MODE == "off":
+            return caps
+        try:
+            component = self.execute_query("""
+            CALL dbms.components() YIELD name, versions, edition
+            WHERE name = 'Neo4j Kernel'
+            RETURN versions[0] AS version, edition
+            """)
+            if component:
+                caps["version"], caps["edition"] = component[0]["version"], component[0]["edition"]
+            procedures = self.execute_query("""
+            SHOW PROCEDURES YIELD name
+            WHERE name = 'db.index.vector.queryNodes'
+            RETURN count(*) AS n
+            """)
+        except ClientError:
+            # Pre-5 servers don't have SHOW PROCEDURES
+            logger.info("Neo4j vector indexes unavailable; using the Python similarity path")
+            return caps
+        except Exception as e:
+            logger.warning("Could not detect Neo4j capabilities: %s", e)
+            return None
+
+        if procedures and procedures[0]["n"] > 0:
+            try:
+                self._ensure_vector_indexes()
+                caps["vector_index"] = True
+            except Exception:
+                logger.exception("Could not create vector indexes; using the Python similarity path")
+        logger.info("Neo4j %s %s, vector indexes: %s", caps["version"], caps["edition"], caps["vector_index"])
+        return caps
+
+    def ensure_indexes(self) -> None:
+        """Lookup indexes the web cache and the location agent MERGE and match on."""
+        for name, pattern, prop in (("query_alias_norm", "a:QueryAlias", "a.normText"),
+                                    ("content_body_hash", "c:ContentBody", "c.hash"),
+                                    ("web_result_content_hash", "w:WebResult", "w.contentHash"),
+                                    ("place_norm_name", "p:PLACE", "p.normName")):
+            self.execute_query(f"CREATE INDEX {name} IF NOT EXISTS FOR ({pattern}) ON ({prop})")
+        try:
+            # Answers point.distance(p.location, ...) <= r radius predicates
+            self.execute_query("CREATE POINT INDEX place_location IF NOT EXISTS FOR (p:PLACE) ON (p.location)")
+        except ClientError:
+            # Pre-5 servers index points in their default (b-tree) indexes
+            self.execute_query("CREATE INDEX place_location IF NOT EXISTS FOR (p:PLACE) ON (p.location)")
+
+    def _ensure_vector_indexes(self) -> None:
+        for label, name in self.VECTOR_INDEXES.items():
+            try:
+                self.execute_query(f"""
+                CREATE VECTOR INDEX {name} IF NOT EXISTS
+                FOR (n:{label}) ON (n.embedding)
+                OPTIONS {{indexConfig: {{
+                  `vector.dimensions`: {self.EMBEDDING_DIM},
+                  `vector.similarity_function`: 'cosine'
+                }}}}
+                """)
+            except ClientError:
+                # 5.11/5.12 only have the procedure form
+                existing = self.execute_query("SHOW INDEXES YIELD name WHERE name = $name RETURN name", {"name": name})
+                if not existing:
+                    self.execute_query("CALL db.index.vector.createNodeIndex($name, $label, 'embedding', $dim, 'cosine')",
+                                       {"name": name, "label": label, "dim": self.EMBEDDING_DIM})
+
+    def vector_search_enabled(self) -> bool:
+        if self.VECTOR_INDEX_MODE == "off":
+            return False
+        return self.capabilities()["vector_index"]
+
+    def indexed_search(self, label: str) -> bool:
+        """
+        Whether similar_nodes on ``label`` avoids streaming every embedding
+        over Bolt: a native vector index or a sidecar embedding store is available.
+        """
+        return self.vector_search_enabled() or get_embedding_store(label) is not None
+
+    def _vector_matches(self, label: str, vec: list[float], k: int) -> List[tuple]:
+        """Top ``k`` (elementId, cosine similarity) from ``label``'s vector index."""
+        records = self.execute_query("""
+        CALL db.index.vector.queryNodes($index, $k, $vec) YIELD node, score
+        RETURN elementId(node) AS nodeId, score
+        """, {"index": self.VECTOR_INDEXES[label], "k": k, "vec": [float(x) for x in vec]})
+        # The index reports cosine scores rescaled to [0, 1]
+        return [(r["nodeId"], 2 * r["score"] - 1) for r in records]
+
+    def _scan_matches(self, label: str, vec: list[float], k: int) -> List[tuple]:
+        """Top ``k`` (elementId, cosine similarity) by scanning ``label``'s embeddings in Python."""
+        store = get_embedding_store(label)
+        if store is not None and len(store) > 0:
+            ids, matrix = store.snapshot()
+            return top_matches(vec, ids, matrix, k)
+
+        # Stream the embeddings and keep a running top k, one fetch at a time
+        records = self.stream_query(f"""
+        MATCH (n:{label})
+        WHERE n.embeddingBlob IS NOT NULL OR n.embedding IS NOT NULL
+        RETURN elementId(n) AS nodeId,
+               n.embeddingBlob AS blob,
+               n.embeddingScale AS scale,
+               n.embeddingCodec AS codec,
+               CASE WHEN n.embeddingBlob IS NULL THEN n.embedding END AS embedding
+        """)
+        best: List[tuple] = []
+        for batch in iter_batches(records, self.FETCH_SIZE):
+            ids, matrix = decode_rows(batch)
+            best = sorted(best + top_matches(vec, ids, matrix, k), key=lambda m: -m[1])[:k]
+        return best
+
+    def similar_nodes(self, label: str, vec: list[float], k: int = 1) -> List[tuple]:
+        """
+        Top ``k`` (elementId, cosine similarity) for ``label``: pushed down to
+        the native vector index when available, otherwise scanned in Python.
+        """
+        if self.vector_search_enabled():
+            try:
+                return self._vector_matches(label, vec, k)
+            except (CircuitOpen, DeadlineExceeded):
+                raise
+            except Exception as e:
+                logger.warning("Vector index query failed, scanning in Python: %s", e)
+        return self._scan_matches(label, vec, k)
+
+    def search_book_knowledge(self, query: str, analysis: Optional[QueryAnalysis] = None,
+                              user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Search the Neo4j graph database for book-related information,
+        personalised from the user's precomputed profile when they have one
+        """
+        analysis = analysis or analyze(query)
         graph_data = {}
         
         # Check for recommendation intent
-        if any(k in keywords for k in ['recommend', 'recommendation', 'similar', 'like', 'suggest', 'suggestion']):
-            # Try to extract a book title from the query
-            title_match = None
-            
-            # Look for patterns like "similar to [TITLE]" or "like [TITLE]"
-            similar_patterns = [
-                r'similar to (?:the )?(.*?)(?:$|\.|\?|,|by)', 
-                r'like (?:the )?(.*?)(?:$|\.|\?|,|by)',
-                r'recommend (?:books? )?(?:like|similar to) (?:the )?(.*?)(?:$|\.|\?|,|by)',
-                r'books? similar to (?:the )?(.*?)(?:$|\.|\?|,|by)'
-            ]
-            
-            for pattern in similar_patterns:
-                match = re.search(pattern, query.lower())
-                if match:
-                    title_match = match.group(1).strip()
-                    break
+        if analysis.has("recommend"):
+            # A title from patterns like "similar to [TITLE]" or "like [TITLE]"
+            title_match = analysis.title
             
             # If we found a potential title, search for similar books
             if title_match:
-                print(f"Detected book title in query: '{title_match}'")
-                similar_books = self.find_similar_books(title_match)
+                logger.debug("Detected book title in query: '%s'", title_match)
+                similar_books = USER_PROFILES.unread(user_id, self.find_similar_books(title_match))
                 if similar_books:
                     graph_data["recommendations"] = similar_books
                     graph_data["type"] = "recommendations"
                     graph_data["search_term"] = title_match
             else:
-                # No specific title, get general recommendations
-                graph_data["recommendations"] = self.get_book_recommendations(3)
+                # No specific title: unread books closest to the user's taste,
+                # or the general top-rated list without a profile
+                personal = USER_PROFILES.recommend(user_id, 3)
+                graph_data["recommendations"] = personal or self.get_book_recommendations(3)
                 graph_data["type"] = "recommendations"
+                graph_data["personalized"] = bool(personal)
         
         # Check for author intent
-        if any(k in keywords for k in ['author', 'wrote', 'writer']):
-            potential_author = query.lower().replace("who is", "").replace("tell me about", "").strip()
+        if analysis.has("author"):
+            potential_author = analysis.author or analysis.norm
             if potential_author:
                 author_info = self.get_author_info(potential_author)
                 if author_info:
@@ -89,9 +487,11 @@ class GraphDatabaseService:
                     graph_data["type"] = "author"
         
         # Check for genre intent
-        if any(k in keywords for k in ['genre', 'type', 'category']):
-            graph_data["genres"] = self.get_top_genres()
+        if analysis.has("genre"):
+            personal = USER_PROFILES.top_genres(user_id)
+            graph_data["genres"] = personal or self.get_top_genres()
             graph_data["type"] = "genres"
+            graph_data["personalized"] = bool(personal)
             
         return graph_data
         
@@ -112,23 +512,28 @@ class GraphDatabaseService:
             "matchScore": int((float(record["rating"]) / 5) * 100)
         } for record in records]
     
-    def get_author_info(self, author_name):
+    def get_author_info(self, author_name, max_books=20):
+        # Pick the author first and only then their (bounded) books,
+        # returning just the properties the answer uses
         query = """
         MATCH (a:AUTHOR)
         WHERE toLower(a.name) CONTAINS toLower($name)
+        WITH a LIMIT 1
         OPTIONAL MATCH (a)-[:WROTE]->(b:BOOK)
-        RETURN a, collect(b) as books
-        LIMIT 1
+        WITH a, b LIMIT $maxBooks
+        RETURN a {.name, .birthYear, .deathYear, .bio} AS a,
+               collect(b {.title, .publishYear}) AS books
         """
         
-        records = self.execute_query(query, {"name": author_name})
+        records = self.execute_query(query, {"name": author_name, "maxBooks": max_books})
         
         if not records:
             return None
             
         record = records[0]
-        author = record["a"]
-        books = record["books"]
+        # Map projections include missing properties as nulls; drop them so the defaults apply
+        author = {k: v for k, v in record["a"].items() if v is not None}
+        books = [{k: v for k, v in book.items() if v is not None} for book in record["books"]]
         
         return {
             "author": {
@@ -163,7 +568,7 @@ class GraphDatabaseService:
         find_book_query = """
         MATCH (b:BOOK)
         WHERE toLower(b.title) CONTAINS toLower($title)
-        RETURN b
+        RETURN b.id AS id
         ORDER BY size(b.title) ASC
         LIMIT 1
         """
@@ -171,11 +576,10 @@ class GraphDatabaseService:
         records = self.execute_query(find_book_query, {"title": title_query})
         
         if not records:
-            print(f"No book found with title containing '{title_query}'")
+            logger.debug("No book found with title containing '%s'", title_query)
             return []
         
-        book = records[0]["b"]
-        book_id = book.get("id", "")
+        book_id = records[0]["id"] or ""
         
         if not book_id:
             return []
@@ -203,98 +607,497 @@ class GraphDatabaseService:
             "matchScore": min(100, int((record.get("genreOverlap", 1) / 3) * 100))
         } for record in similar_books]
 
-    def find_similar_query(self, vec: list[float], threshold: float = 0.90):
+    def iter_books(self) -> Iterator[Dict[str, Any]]:
+        """Every BOOK with its genres, streamed (for offline index builds)."""
+        records = self.stream_query("""
+        MATCH (b:BOOK)
+        OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:GENRE)
+        RETURN b.title AS title, b.author AS author, b.description AS description,
+               b.rating AS rating, collect(g.name) AS genres
+        """)
+        for r in records:
+            yield {"title": r["title"], "author": r["author"], "description": r["description"],
+                   "rating": r["rating"], "genres": list(r["genres"])}
+
+    def iter_reading(self, user_ids: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
         """
-        Community-Edition fallback:
-        Pull all Query nodes with embeddings into Python,
-        compute cosine similarity, and return the id of the best match
-        if it's above the threshold.
+        Every USER -> BOOK reading edge (RATES, FINISHED, READING, WANTS_TO_READ),
+        streamed, for all users or just ``user_ids`` (for offline profile builds).
         """
-        # 1) Fetch every stored Query node's id + embedding
-        cypher = """
-        MATCH (q:Query)
-        WHERE q.embedding IS NOT NULL
-        RETURN elementId(q) AS nodeId, q.embedding AS embedding
+        records = self.stream_query("""
+        MATCH (u:USER)-[r:RATES|FINISHED|READING|WANTS_TO_READ]->(b:BOOK)
+        WHERE $userIds IS NULL OR u.id IN $userIds
+        RETURN u.id AS userId, b.title AS title, type(r) AS rel, r.rating AS rating
+        """, {"userIds": user_ids})
+        for r in records:
+            yield {"userId": r["userId"], "title": r["title"], "rel": r["rel"], "rating": r["rating"]}
+
+    def users_changed_since(self, since: str) -> List[str]:
+        """
+        Users whose reading edges or reading history changed at or after the
+        ISO-8601 time ``since`` (history entries also record removed statuses).
         """
-        records = self.execute_query(cypher, {})
+        records = self.execute_query("""
+        MATCH (u:USER)-[r:RATES|FINISHED|READING|WANTS_TO_READ]->(:BOOK)
+        WHERE coalesce(r.timestamp, r.date) >= datetime($since)
+        RETURN DISTINCT u.id AS userId
+        UNION
+        MATCH (u:USER)-[:HAS_HISTORY]->(:READING_HISTORY)-[:CONTAINS_ENTRY]->(he:HISTORY_ENTRY)
+        WHERE he.timestamp >= datetime($since)
+        RETURN DISTINCT u.id AS userId
+        """, {"since": since})
+        return [r["userId"] for r in records]
 
-        # 2) Compute cosine similarity in Python
-        v1 = np.array(vec, dtype=float)
-        best_sim, best_id = -1.0, None
-        for r in records:
-            v2 = np.array(r["embedding"], dtype=float)
-            sim = float((v1 @ v2) / (np.linalg.norm(v1) * np.linalg.norm(v2)))
-            if sim > best_sim:
-                best_sim, best_id = sim, r["nodeId"]
+    def get_places(self) -> List[Dict[str, Any]]:
+        """Every PLACE with a location, as {"name", "aliases", "latitude", "longitude"}."""
+        records = self.stream_query("""
+        MATCH (p:PLACE) WHERE p.location IS NOT NULL
+        RETURN p.name AS name, coalesce(p.aliases, []) AS aliases,
+               p.location.latitude AS latitude, p.location.longitude AS longitude
+        """)
+        return [{"name": r["name"], "aliases": list(r["aliases"]),
+                 "latitude": r["latitude"], "longitude": r["longitude"]} for r in records]
 
-        # 3) Only return the id if it passes threshold
+    def find_books_near(self, latitude: float, longitude: float, radius_km: float,
+                        limit: int = 30) -> List[Dict[str, Any]]:
+        """
+        Books set at a PLACE within ``radius_km`` of the point, closest
+        setting first (then by rating). The radius predicate is answered
+        by the place_location point index.
+        """
+        query = """
+        WITH point({latitude: $latitude, longitude: $longitude}) AS center
+        MATCH (p:PLACE)
+        WHERE point.distance(p.location, center) <= $radius
+        WITH p, point.distance(p.location, center) AS distance
+        MATCH (b:BOOK)-[:SET_IN]->(p)
+        WITH b, p, distance
+        ORDER BY distance ASC, coalesce(b.rating, 0) DESC
+        LIMIT $limit
+        OPTIONAL MATCH (b)-[:BELONGS_TO]->(g:GENRE)
+        RETURN b.title AS title, b.author AS author, b.rating AS rating,
+               p.name AS place, distance, collect(g.name) AS genres
+        ORDER BY distance ASC, coalesce(rating, 0) DESC
+        """
+        records = self.execute_query(query, {"latitude": latitude, "longitude": longitude,
+                                             "radius": radius_km * 1000, "limit": limit})
+        return [{
+            "title": r["title"],
+            "author": r["author"],
+            "rating": r["rating"],
+            "setting": r["place"],
+            "distanceKm": round(r["distance"] / 1000, 1),
+            "genres": list(r["genres"]),
+        } for r in records]
+
+    def find_similar_query(self, vec: list[float], threshold: float = 0.90):
+        """
+        Return the id of the stored Query most similar to ``vec`` if it's
+        above the threshold. Uses the native vector index when the server
+        has one; otherwise (Community Edition, Neo4j 4) the embeddings are
+        compared in Python, from the sidecar store when configured or by
+        pulling the compact byte arrays (see similar_nodes).
+        """
+        matches = self.similar_nodes("Query", vec, 1)
+        if not matches:
+            return None
+        best_id, best_sim = matches[0]
         return best_id if best_sim >= threshold else None
+
+    def find_similar_web_results(self, vec: list[float], limit: int = 5, threshold: float = 0.0) -> List[tuple]:
+        """(elementId, similarity) of the WebResults closest to ``vec``, best first."""
+        return [(node_id, sim) for node_id, sim in self.similar_nodes("WebResult", vec, limit) if sim >= threshold]
     
-    def get_or_create_query_node(self, original: str) -> int:
+    def get_or_create_query_node(self, original: str, exact: bool = False) -> str:
         """
         1) Normalize & embed the question
         2) If a semantically‐similar Query exists, return its id
+           (skipped when ``exact`` is set, so the node is keyed on this normText,
+           or on the Query it was merged into by cache compaction)
         3) Otherwise MERGE on normText and store embedding+raw text
         """
         norm = normalize_text(original)
         vec  = embed_text(norm)
 
-        existing = self.find_similar_query(vec)
-        if existing is not None:
-            return existing
+        if exact:
+            alias = self.execute_query("""
+            MATCH (:QueryAlias {normText: $norm})-[:ALIAS_OF]->(q:Query)
+            RETURN elementId(q) AS nodeId LIMIT 1
+            """, {"norm": norm})
+            if alias:
+                return alias[0]["nodeId"]
+        else:
+            existing = self.find_similar_query(vec)
+            if existing is not None:
+                return existing
 
+        # The float list is only kept when the vector index needs it
         cypher = """
         MERGE (q:Query {normText: $norm})
           ON CREATE SET
-            q.text      = $orig,
-            q.embedding = $vec
-        RETURN id(q) AS nodeId
+            q.text           = $orig,
+            q.createdAt      = datetime(),
+            q.embeddingBlob  = $emb.embeddingBlob,
+            q.embeddingScale = $emb.embeddingScale,
+            q.embeddingCodec = $emb.embeddingCodec,
+            q.embedding      = $vec
+        RETURN elementId(q) AS nodeId
         """
-        rec = self.execute_query(cypher, {"norm": norm, "orig": original, "vec": vec})
-        return rec[0]["nodeId"]
+        emb = encode_embedding(vec, self.EMBEDDING_CODEC)
+        rec = self.execute_query(cypher, {"norm": norm, "orig": original, "emb": emb,
+                                          "vec": vec if self.vector_search_enabled() else None})
+        node_id = rec[0]["nodeId"]
+
+        store = get_embedding_store("Query")
+        if store is not None:
+            store.append([node_id], [vec])
+        return node_id
 
-    def save_web_results(self, original_query: str, results: list[dict]):
+    def save_web_results(self, original_query: str, results: list[dict], exact: bool = False):
         """
         Upsert the Query node (via get_or_create_query_node),
         then MERGE each WebResult + a HAS_RESULT edge exactly once.
-        Assumes each result dict has keys: url, title, content, embedding.
+        Assumes each result dict has keys: url, title, content, embedding
+        (and optionally raw_content). The content is kept as a preview; the
+        full text is stored compressed, once per distinct body (see content_store).
+        Pass ``exact`` to guarantee a later get_cached_web_results hit
+        for this exact question (used by the cache warmer).
         """
-        qid = self.get_or_create_query_node(original_query)
+        qid = self.get_or_create_query_node(original_query, exact=exact)
 
+        keep_vector = self.vector_search_enabled()
+        rows = [{
+            "url": r["url"],
+            "title": r.get("title"),
+            **encode_content(r.get("content"), r.get("raw_content")),
+            "embedding": (r.get("embedding") or None) if keep_vector else None,
+            **encode_embedding(r.get("embedding"), self.EMBEDDING_CODEC)
+        } for r in results]
+
+        # Results that are already cached get the new content and fetchedAt;
+        # stale results of this Query that the new search no longer returns
+        # are unlinked, so a refresh replaces the cached answer
         cypher = """
+        MATCH (q) WHERE elementId(q) = $qid
+        OPTIONAL MATCH (q)-[old:HAS_RESULT]->(prev:WebResult)
+          WHERE $softTtl > 0 AND NOT prev.url IN $urls
+            AND prev.fetchedAt < datetime() - duration({seconds: toInteger($softTtl)})
+        DELETE old
+        WITH DISTINCT q
         UNWIND $results AS r
           MERGE (w:WebResult {url: r.url})
-            ON CREATE SET
-              w.title     = r.title,
-              w.content   = r.content,
-              w.fetchedAt = datetime(),
-              w.embedding = r.embedding
-          WITH w
-          MATCH (q) WHERE id(q) = $qid
+          SET w.title          = r.title,
+              w.contentPreview = r.contentPreview,
+              w.contentHash    = r.contentHash,
+              w.contentLength  = r.contentLength,
+              w.fetchedAt      = datetime(),
+              w.embeddingBlob  = r.embeddingBlob,
+              w.embeddingScale = r.embeddingScale,
+              w.embeddingCodec = r.embeddingCodec,
+              w.embedding      = r.embedding
+          REMOVE w.content
+          // Bodies live in the blob store when contentBlob is null
+          FOREACH (_ IN CASE WHEN r.contentBlob IS NULL THEN [] ELSE [1] END |
+            MERGE (c:ContentBody {hash: r.contentHash})
+              ON CREATE SET c.blob = r.contentBlob, c.codec = r.contentCodec)
           MERGE (q)-[:HAS_RESULT]->(w)
+          RETURN elementId(w) AS nodeId, r.url AS url
+        """
+        records = self.execute_query(cypher, {"results": rows, "qid": qid, "urls": [r["url"] for r in rows],
+                                              "softTtl": WEB_CACHE_SOFT_TTL})
+
+        store = get_embedding_store("WebResult")
+        if store is not None:
+            by_url = {r["url"]: r.get("embedding") for r in results}
+            saved = [(rec["nodeId"], by_url.get(rec["url"])) for rec in records]
+            saved = [(node_id, vec) for node_id, vec in saved if vec]
+            store.append([node_id for node_id, _ in saved], [vec for _, vec in saved])
+
+    def save_passages(self, url: str, passages: List[Dict[str, Any]]) -> List[str]:
+        """
+        Replace the passages of the WebResult at ``url`` with ``passages``
+        ({"text", "embedding"} dicts, in document order). Returns the new
+        Passage ids.
+        """
+        keep_vector = self.vector_search_enabled()
+        rows = [{
+            "position": i,
+            "text": p["text"],
+            "embedding": (p.get("embedding") or None) if keep_vector else None,
+            **encode_embedding(p.get("embedding"), self.EMBEDDING_CODEC)
+        } for i, p in enumerate(passages)]
+
+        cypher = """
+        MATCH (w:WebResult {url: $url})
+        OPTIONAL MATCH (w)-[:HAS_PASSAGE]->(old:Passage)
+        DETACH DELETE old
+        WITH DISTINCT w
+        UNWIND $rows AS r
+          CREATE (w)-[:HAS_PASSAGE]->(p:Passage {
+            position:       r.position,
+            text:           r.text,
+            embeddingBlob:  r.embeddingBlob,
+            embeddingScale: r.embeddingScale,
+            embeddingCodec: r.embeddingCodec,
+            embedding:      r.embedding
+          })
+          RETURN elementId(p) AS nodeId, r.position AS position
+        """
+        records = self.execute_query(cypher, {"url": url, "rows": rows})
+        ids = [r["nodeId"] for r in records]
+
+        store = get_embedding_store("Passage")
+        if store is not None:
+            by_position = {r["position"]: r["nodeId"] for r in records}
+            saved = [(by_position[i], p.get("embedding")) for i, p in enumerate(passages) if i in by_position]
+            saved = [(node_id, vec) for node_id, vec in saved if vec]
+            store.append([node_id for node_id, _ in saved], [vec for _, vec in saved])
+        return ids
+
+    def find_passages(self, vec: list[float], k: int = 4, per_source: int = 2) -> List[Dict[str, Any]]:
+        """
+        The ``k`` cached passages closest to ``vec`` (at most ``per_source``
+        from any one page), best first, as {"title", "url", "content", "score"}.
+        """
+        matches = self.similar_nodes("Passage", vec, k * 3)
+        if not matches:
+            return []
+        records = self.execute_query("""
+        UNWIND $ids AS id
+        MATCH (w:WebResult)-[:HAS_PASSAGE]->(p:Passage) WHERE elementId(p) = id
+        RETURN id AS nodeId, p.text AS text, w.title AS title, w.url AS url
+        """, {"ids": [node_id for node_id, _ in matches]})
+        by_id = {r["nodeId"]: r for r in records}
+
+        passages, per_url = [], {}
+        for node_id, score in matches:
+            r = by_id.get(node_id)
+            if r is None or per_url.get(r["url"], 0) >= per_source:
+                continue
+            per_url[r["url"]] = per_url.get(r["url"], 0) + 1
+            passages.append({"title": r["title"], "url": r["url"], "content": r["text"], "score": score})
+            if len(passages) == k:
+                break
+        return passages
+
+    def sync_embedding_store(self, label: str, batch_size: int = 1000) -> int:
+        """
+        Backfill the sidecar embedding store with ``label`` nodes that were
+        created before it was enabled. Returns the number of rows added.
+        """
+        if label not in self.EMBEDDING_LABELS:
+            raise ValueError(f"Can only sync embeddings on {self.EMBEDDING_LABELS}")
+        store = get_embedding_store(label)
+        if store is None:
+            raise RuntimeError("EMBEDDING_STORE_DIR is not set")
+
+        records = self.stream_query(f"""
+        MATCH (n:{label})
+        WHERE n.embeddingBlob IS NOT NULL OR n.embedding IS NOT NULL
+        RETURN elementId(n) AS nodeId,
+               n.embeddingBlob AS blob,
+               n.embeddingScale AS scale,
+               n.embeddingCodec AS codec,
+               CASE WHEN n.embeddingBlob IS NULL THEN n.embedding END AS embedding
+        """, fetch_size=batch_size)
+        added = 0
+        for batch in iter_batches(records, batch_size):
+            ids, matrix = decode_rows(batch)
+            added += store.append(ids, matrix)
+        return added
+
+    def migrate_embeddings(self, label: str, batch_size: int = 500) -> int:
+        """
+        Re-encode legacy ``embedding`` float lists on ``label`` nodes into
+        the compact format, one batch per transaction. Safe to re-run;
+        returns the number of nodes migrated.
+        """
+        if label not in self.EMBEDDING_LABELS:
+            raise ValueError(f"Can only migrate embeddings on {self.EMBEDDING_LABELS}")
+
+        fetch = f"""
+        MATCH (n:{label})
+        WHERE n.embedding IS NOT NULL AND n.embeddingBlob IS NULL
+        RETURN elementId(n) AS nodeId, n.embedding AS embedding
+        LIMIT $limit
+        """
+        # The float list stays when the native vector index is built on it
+        write = f"""
+        UNWIND $rows AS row
+          MATCH (n:{label}) WHERE elementId(n) = row.nodeId
+          SET n.embeddingBlob  = row.embeddingBlob,
+              n.embeddingScale = row.embeddingScale,
+              n.embeddingCodec = row.embeddingCodec
+          {"" if self.vector_search_enabled() else "REMOVE n.embedding"}
+        """
+        migrated = 0
+        while True:
+            records = self.execute_query(fetch, {"limit": batch_size})
+            if not records:
+                return migrated
+            rows = [{"nodeId": r["nodeId"], **encode_embedding(r["embedding"], self.EMBEDDING_CODEC)}
+                    for r in records]
+            # Empty legacy lists encode to nulls; REMOVE still drops them, so the loop terminates
+            self.execute_query(write, {"rows": rows})
+            migrated += len(rows)
+
+    def backfill_vector_embeddings(self, label: str, batch_size: int = 500) -> int:
+        """
+        Give compact-only ``label`` nodes the float-list ``embedding`` the
+        native vector index is built on (decoded from the blob). Safe to
+        re-run; returns the number of nodes updated.
+        """
+        if label not in self.EMBEDDING_LABELS:
+            raise ValueError(f"Can only backfill embeddings on {self.EMBEDDING_LABELS}")
+
+        fetch = f"""
+        MATCH (n:{label})
+        WHERE n.embeddingBlob IS NOT NULL AND n.embedding IS NULL
+        RETURN elementId(n) AS nodeId,
+               n.embeddingBlob AS blob,
+               n.embeddingScale AS scale,
+               n.embeddingCodec AS codec
+        LIMIT $limit
+        """
+        write = f"""
+        UNWIND $rows AS row
+          MATCH (n:{label}) WHERE elementId(n) = row.nodeId
+          SET n.embedding = row.embedding
         """
-        self.execute_query(cypher, {"results": results, "qid": qid})
+        updated = 0
+        while True:
+            records = self.execute_query(fetch, {"limit": batch_size})
+            ids, matrix = decode_rows(records)
+            if not ids:
+                return updated
+            self.execute_query(write, {"rows": [{"nodeId": i, "embedding": v.tolist()} for i, v in zip(ids, matrix)]})
+            updated += len(ids)
+
+    # Look a normText up directly or through the alias left behind when
+    # cache compaction merged its Query into another one
+    _MATCH_CACHED_QUERY = """
+        CALL {
+          WITH norm
+          MATCH (q:Query {normText: norm}) RETURN q
+          UNION
+          WITH norm
+          MATCH (:QueryAlias {normText: norm})-[:ALIAS_OF]->(q:Query) RETURN q
+        }
+    """
+
+    # The node ids come back so hits can be counted (see CacheHitCounter)
+    _MATCH_CACHED_RESULTS = """
+        MATCH (q)-[:HAS_RESULT]->(w:WebResult)
+        WITH norm, w, collect(DISTINCT elementId(q)) AS queryIds
+    """
+
+    @staticmethod
+    def _track_hits(records: list) -> None:
+        """Count a hit on every Query and WebResult behind ``records``; feeds cache eviction."""
+        if records:
+            CACHE_HITS.record({qid for r in records for qid in r["queryIds"]},
+                              {r["resultId"] for r in records})
 
     def get_cached_web_results(self, original_query: str) -> list[dict]:
         """
         If we've previously saved web‐fallback results for this question,
         return them instead of hitting the web again.
         """
+        return self.lookup_web_results(original_query)[0]
+
+    def lookup_web_results(self, original_query: str) -> tuple:
+        """
+        (results, freshness) for this question, where freshness is "fresh",
+        "stale" (served, with a background refresh queued), "expired" or
+        "miss" (both returned with no results, so the caller searches again).
+        """
         # Normalize the query the same way we did on write
         norm = normalize_text(original_query)
 
-        cypher = """
-        MATCH (q:Query {normText: $norm})
-          -[:HAS_RESULT]->(w:WebResult)
+        cypher = f"""
+        WITH $norm AS norm
+        {self._MATCH_CACHED_QUERY}
+        {self._MATCH_CACHED_RESULTS}
         RETURN w.title AS title,
-               w.content AS content,
-               w.url AS url
+               coalesce(w.contentPreview, w.content) AS content,
+               w.contentHash AS contentHash,
+               w.contentLength AS contentLength,
+               w.url AS url,
+               duration.inSeconds(w.fetchedAt, datetime()).seconds AS age,
+               elementId(w) AS resultId,
+               queryIds
         """
         records = self.execute_query(cypher, {"norm": norm})
-        return [
-            {"title": r["title"], "content": r["content"], "url": r["url"]}
-            for r in records
-        ]
+        self._track_hits(records)
+        return self._revalidate(original_query, records, refresh=True)
+
+    def _revalidate(self, query: str, records: list, refresh: bool) -> tuple:
+        """Apply the soft/hard TTLs to one question's cached result records."""
+        if not records:
+            return [], "miss"
+        ages = [r["age"] for r in records if r["age"] is not None]
+        freshness = web_cache_freshness(max(ages) if ages else None)
+        if freshness == "expired":
+            return [], freshness
+        if freshness == "stale" and refresh:
+            try:
+                # Imported here: web_refresh needs web_agent, which imports this module
+                from web_refresh import REFRESH_SCHEDULER
+                REFRESH_SCHEDULER.schedule(query)
+            except Exception:
+                logger.exception("Could not queue a refresh for '%s'", query)
+        # contentHash/contentLength let prompt packing load full bodies lazily;
+        # web_agent.public_results drops them before results reach clients
+        results = [{"title": r["title"], "content": r["content"], "url": r["url"],
+                    "contentHash": r["contentHash"], "contentLength": r["contentLength"]} for r in records]
+        return results, freshness
+
+    def get_cached_web_results_bulk(self, queries: List[str], track: bool = True) -> Dict[str, list[dict]]:
+        """
+        Batch version of get_cached_web_results: one UNWIND round-trip
+        for many questions. Returns {normText: [results]} and includes
+        an empty list for every question without cached results.
+        Pass ``track=False`` for lookups that aren't user traffic (e.g. the
+        cache warmer checking what's missing), so they don't count as hits
+        or queue refreshes. Expired entries come back empty, like in
+        get_cached_web_results.
+        """
+        originals: Dict[str, str] = {}
+        for q in queries:
+            originals.setdefault(normalize_text(q), q)
+        norms = list(originals)
+        cached: Dict[str, list[dict]] = {norm: [] for norm in norms}
+        if not norms:
+            return cached
+
+        cypher = f"""
+        UNWIND $norms AS norm
+        {self._MATCH_CACHED_QUERY}
+        {self._MATCH_CACHED_RESULTS}
+        RETURN norm,
+               w.title AS title,
+               coalesce(w.contentPreview, w.content) AS content,
+               w.contentHash AS contentHash,
+               w.contentLength AS contentLength,
+               w.url AS url,
+               duration.inSeconds(w.fetchedAt, datetime()).seconds AS age,
+               elementId(w) AS resultId,
+               queryIds
+        """
+        rows = self.execute_query(cypher, {"norms": norms})
+        if track:
+            self._track_hits(rows)
+        records: Dict[str, list] = {norm: [] for norm in norms}
+        for r in rows:
+            records[r["norm"]].append(r)
+        for norm, rows in records.items():
+            cached[norm] = self._revalidate(originals[norm], rows, refresh=track)[0]
+        return cached
+
+
+# Answer structured graph intents from templates instead of the LLM:
+# "off", "template" (polish only when asked) or "polish" (polish in the background)
+GRAPH_FAST_PATH = os.getenv("GRAPH_FAST_PATH", "off").lower()
 
 
 class AgentState(TypedDict):
@@ -304,17 +1107,44 @@ class AgentState(TypedDict):
     web_data: Optional[List[Dict[str, str]]]
     response: Optional[str]
     found_in_graph: bool
+    # Cached web results fetched ahead of time (e.g. by a batch run);
+    # None means "not prefetched, look them up".
+    prefetched_web: Optional[List[Dict[str, str]]]
+    # time.monotonic() by which the request must finish (see resilience.py)
+    deadline: Optional[float]
+    # True when the response is a templated graph answer (GRAPH_FAST_PATH)
+    fast_path: Optional[bool]
+    # {"location", "categories"} from location_agent
+    location_data: Optional[Dict[str, Any]]
+    # [{"name", "description", "books"}] from trading_agent
+    trading_data: Optional[List[Dict[str, Any]]]
+    # Intents, entities and embedding of the query (see query_analysis.py)
+    analysis: Optional[QueryAnalysis]
+    # Who is asking, for answers from their taste profile (see user_profiles.py)
+    user_id: Optional[str]
+
+def analyze_query(state: AgentState) -> AgentState:
+    """Parse the query once; later nodes read state["analysis"]."""
+    return { **state, "analysis": analyze(state["query"]) }
+
 
 def query_graph(state: AgentState) -> AgentState:
+    if resilience.expired(state):
+        return { **state, "graph_data": {}, "found_in_graph": False }
+
     db = GraphDatabaseService()
     try:
         # 1) Domain lookup
-        graph_data = db.search_book_knowledge(state["query"])
+        graph_data = db.search_book_knowledge(state["query"], analysis_of(state), state.get("user_id"))
         if graph_data.get("type"):
             return { **state, "graph_data": graph_data, "found_in_graph": True }
 
         # 2) Cached‐web lookup
-        cached = db.get_cached_web_results(state["query"])
+        with timed("graph.web_cache_lookup") as span:
+            cached, freshness = state.get("prefetched_web"), "hit"
+            if cached is None:
+                cached, freshness = db.lookup_web_results(state["query"])
+            span.cache = "hit" if freshness in ("hit", "fresh") else freshness
         if cached:
             # Treat it as "found," storing cached web into state.web_data
             return { **state,
@@ -323,6 +1153,10 @@ def query_graph(state: AgentState) -> AgentState:
         
         # 3) genuinely not found → fall back
         return { **state, "graph_data": {}, "found_in_graph": False }
+    except Exception as e:
+        # Neo4j down, circuit open or out of time: answer without the graph
+        logger.warning("Graph lookup failed, falling back to web search: %s", e)
+        return { **state, "graph_data": {}, "found_in_graph": False }
     finally:
         db.close()
 
@@ -342,7 +1176,10 @@ def format_graph_data(graph_data: Dict[str, Any]) -> str:
     
     if graph_data.get("type") == "recommendations" and graph_data.get("recommendations"):
         if len(graph_data["recommendations"]) > 0:
-            context_text += "Book Recommendations:\n"
+            if graph_data.get("personalized"):
+                context_text += "Book Recommendations (from the user's reading, excluding books they have read):\n"
+            else:
+                context_text += "Book Recommendations:\n"
             for i, book in enumerate(graph_data["recommendations"]):
                 context_text += f"{i+1}. \"{book['title']}\" by {book.get('author', 'Unknown')} - {book.get('matchScore', 0)}% match\n"
         else:
@@ -357,7 +1194,7 @@ def format_graph_data(graph_data: Dict[str, Any]) -> str:
     
     if graph_data.get("type") == "genres" and graph_data.get("genres"):
         if len(graph_data["genres"]) > 0:
-            context_text += "User's Top Genres:\n"
+            context_text += "User's Top Genres:\n" if graph_data.get("personalized") else "Top Genres:\n"
             for i, genre in enumerate(graph_data["genres"]):
                 context_text += f"{i+1}. {genre.get('name', 'Unknown')} ({genre.get('percentage', 0)}% of books)\n"
         else:
@@ -366,14 +1203,53 @@ def format_graph_data(graph_data: Dict[str, Any]) -> str:
     return context_text
 
 
-def generate_response(state: AgentState) -> AgentState:
-    """Generate a response using OpenAI with context from graph or web data."""
-    model = ChatOpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-4",
-        temperature=0.7
-    )
-    
+def template_graph_answer(graph_data: Dict[str, Any]) -> Optional[str]:
+    """
+    A plain answer for graph results that are structured enough to need no
+    rephrasing (recommendations, author info, top genres); None otherwise.
+    """
+    graph_type = graph_data.get("type")
+
+    if graph_type == "recommendations":
+        books = [b for b in graph_data.get("recommendations", []) if b.get("title")]
+        if not books:
+            return None
+        if graph_data.get("search_term"):
+            intro = f"If you enjoyed \"{graph_data['search_term'].title()}\", you might also like:"
+        elif graph_data.get("personalized"):
+            intro = "Based on your reading, you might enjoy:"
+        else:
+            intro = "Here are some highly rated books you might enjoy:"
+        lines = [f"- \"{b['title']}\" by {b.get('author') or 'Unknown'} ({b.get('matchScore', 0)}% match)"
+                 for b in books]
+        return "\n".join([intro, *lines])
+
+    if graph_type == "author" and graph_data.get("author"):
+        author = graph_data["author"]
+        answer = f"{author['name']} ({author.get('birthYear', 'Unknown')}-{author.get('deathYear') or 'present'})."
+        bio = author.get("bio")
+        if bio and bio != "No biography available":
+            answer += f" {bio}"
+        titles = [b["title"] for b in graph_data.get("books", []) if b.get("title")]
+        if titles:
+            answer += f" Known for: {', '.join(titles)}."
+        return answer
+
+    if graph_type == "genres":
+        genres = [g for g in graph_data.get("genres", []) if g.get("name")]
+        if not genres:
+            return None
+        if graph_data.get("personalized"):
+            listed = ", ".join(f"{g['name']} ({g.get('percentage', 0)}% of your books)" for g in genres)
+            return f"Your top genres are {listed}."
+        listed = ", ".join(f"{g['name']} ({g.get('percentage', 0)}% of books)" for g in genres)
+        return f"The most popular genres are {listed}."
+
+    return None
+
+
+def build_response_prompt(state: Dict[str, Any]) -> str:
+    """The answer-generation prompt for graph or web data in ``state``."""
     if state["found_in_graph"]:
         context = format_graph_data(state["graph_data"])
         source = "graph database"
@@ -390,7 +1266,7 @@ def generate_response(state: AgentState) -> AgentState:
         ])
         source = "web search"
     
-    prompt = f"""
+    return f"""
     You are a helpful assistant for a book social network called BookLovers. 
     You have access to a knowledge graph that contains information about users, books, authors, genres, and more.
     
@@ -405,29 +1281,97 @@ def generate_response(state: AgentState) -> AgentState:
     DO NOT make up fake book titles or authors. Instead, acknowledge that you don't have that specific information
     and offer to help with a different query or suggest a search for similar topics.
     """
-    
-    response = model.invoke([HumanMessage(content=prompt)])
+
+
+def grounding_terms(state: Dict[str, Any]) -> List[str]:
+    """Titles/names from the context that a faithful answer should mention."""
+    if state.get("found_in_graph"):
+        graph_data = state.get("graph_data") or {}
+        terms = [b.get("title") for b in graph_data.get("recommendations", [])]
+        terms += [g.get("name") for g in graph_data.get("genres", [])]
+        if graph_data.get("author"):
+            terms.append(graph_data["author"].get("name"))
+        return [t for t in terms if t]
+    return [r.get("title") for r in (state.get("web_data") or [])[:4] if r.get("title")]
+
+
+def complete(prompt: str, route: str = "graph", intent: Optional[str] = None,
+             terms: Optional[List[str]] = None, timeout: Optional[float] = None) -> str:
+    """
+    One chat completion for ``prompt`` on the model tier chosen for its
+    route/intent/size (see model_policy), bounded by the request deadline
+    and ``timeout``. ``terms`` feed the tier's grounding statistics.
+    """
+    tier = select_tier(route, intent, len(prompt))
+    model = build_model(tier, ChatOpenAI)
+    call = lambda: cassette.invoke_chat(model, [HumanMessage(content=prompt)])
+    try:
+        with timed("openai.chat"), timed(f"llm.{tier.name}"):
+            if tier.is_local:
+                response = call()
+            else:
+                response = resilience.guarded("openai", call, timeout=timeout,
+                                                  neutral=(cassette.CassetteMiss,))
+    except Exception:
+        TIER_STATS.record(tier.name, "", failed=True)
+        raise
+    TIER_STATS.record(tier.name, response.content, terms or ())
+    return response.content
+
+
+def generate_response(state: AgentState) -> AgentState:
+    """Generate a response using OpenAI with context from graph or web data."""
+    if resilience.expired(state):
+        # Keep any response an agent already produced; process_message
+        # falls back to a templated answer otherwise
+        return state
+
+    # Location and trading answers come from their indexes with their own templated response
+    if state.get("location_data") or state.get("trading_data"):
+        return state
+
+    # Fast path: structured graph answers go out as-is, without the LLM
+    if state["found_in_graph"] and GRAPH_FAST_PATH != "off":
+        answer = template_graph_answer(state["graph_data"])
+        if answer:
+            return {**state, "response": answer, "fast_path": True}
+
+    try:
+        route = "graph" if state["found_in_graph"] else "web"
+        intent = state["graph_data"].get("type") if state["found_in_graph"] else "synthesis"
+        response = complete(build_response_prompt(state), route, intent, grounding_terms(state))
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning("Skipping response generation: %s", e)
+        return state
     
     return {
         **state,
-        "response": response.content
+        "response": response
     }
 
 
-def create_graph_rag_workflow():
-    """Create the LangGraph workflow for RAG with web fallback."""
+def create_graph_rag_workflow(router=None, routes: Optional[Dict[str, str]] = None):
+    """
+    Create the LangGraph workflow for RAG with web fallback. ``router``
+    and ``routes`` replace the default routing after query_graph (there
+    can only be one set of conditional edges from a node, or every router
+    fires); nodes they route to other than generate_response are added by
+    the caller.
+    """
     workflow = StateGraph(AgentState)
     
     # Define nodes
-    workflow.add_node("query_graph", query_graph)
-    workflow.add_node("generate_response", generate_response)
+    workflow.add_node("analyze_query", instrument_node("analyze_query", analyze_query))
+    workflow.add_node("query_graph", instrument_node("query_graph", query_graph))
+    workflow.add_node("generate_response", instrument_node("generate_response", generate_response))
     
     # Define edges
-    workflow.set_entry_point("query_graph")
+    workflow.set_entry_point("analyze_query")
+    workflow.add_edge("analyze_query", "query_graph")
     workflow.add_conditional_edges(
         "query_graph",
-        should_search_web,
-        {
+        router or should_search_web,
+        routes or {
             "generate_response": "generate_response",
             "web_search": "web_agent"  # This will be added in main.py
         }
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+"""
+Location agent: books set in or near a place.
+
+Book settings are (:BOOK)-[:SET_IN]->(:PLACE {name, normName, aliases,
+location}) in the graph, where ``location`` is a WGS-84 point covered by
+the place_location point index. A question is resolved against an
+in-memory gazetteer of PLACE names (reloaded every LOCATION_GAZETTEER_TTL
+seconds), then answered with one radius query on the index:
+
+  "books set in Tokyo"              -> within LOCATION_RADIUS_KM of Tokyo
+  "novels near Reykjavik"           -> within LOCATION_NEAR_RADIUS_KM
+  "books within 200 km of Kyoto"    -> within 200 km
+
+When nothing is set inside the radius it is doubled, up to
+LOCATION_MAX_RADIUS_KM, so the nearest settings still come back. The
+answer is templated (no LLM call); questions that name no known place go
+to the web agent instead.
+
+Load settings from a CSV with title, place, latitude and longitude columns
+(rows without a title just add the place to the gazetteer):
+   python location_agent.py --load settings.csv
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+from graph_agent import GraphDatabaseService, iter_batches, normalize_text
+from metrics import timed
+from query_analysis import QueryAnalysis, analysis_of
+import resilience
+
+logger = logging.getLogger(__name__)
+
+LOCATION_RADIUS_KM = float(os.getenv("LOCATION_RADIUS_KM", "50"))
+LOCATION_NEAR_RADIUS_KM = float(os.getenv("LOCATION_NEAR_RADIUS_KM", "300"))
+LOCATION_MAX_RADIUS_KM = float(os.getenv("LOCATION_MAX_RADIUS_KM", "2000"))
+LOCATION_MAX_BOOKS = int(os.getenv("LOCATION_MAX_BOOKS", "30"))
+LOCATION_MAX_CATEGORIES = int(os.getenv("LOCATION_MAX_CATEGORIES", "4"))
+LOCATION_GAZETTEER_TTL = float(os.getenv("LOCATION_GAZETTEER_TTL", "600"))
+
+# Longest place name, in words, the gazetteer tries to match
+_MAX_NAME_WORDS = 4
+
+
+class Gazetteer:
+    """Normalized PLACE names and aliases -> (name, latitude, longitude), loaded from the graph."""
+
+    def __init__(self, ttl: float = LOCATION_GAZETTEER_TTL):
+        self.ttl = ttl
+        self._names: Dict[str, Dict[str, Any]] = {}
+        self._loaded_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self, db: GraphDatabaseService) -> None:
+        """
+        Reload the names once they are older than ``ttl``. One request
+        rebuilds the dict while the others keep answering from the old one
+        (only the very first load is waited for); it is swapped in whole.
+        """
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+        first_load = self._loaded_at == float("-inf")
+        if not self._lock.acquire(blocking=first_load):
+            return
+        try:
+            if time.monotonic() - self._loaded_at < self.ttl:
+                return
+            names = {}
+            for place in db.get_places():
+                for name in [place["name"], *place["aliases"]]:
+                    if name:
+                        names.setdefault(normalize_text(name), place)
+            self._names = names
+            self._loaded_at = time.monotonic()
+            logger.debug("Loaded %d place names", len(names))
+        finally:
+            self._lock.release()
+
+    def _lookup(self, norm: str) -> Optional[Dict[str, Any]]:
+        """Longest known name in ``norm`` ("new york" over "york"), then the earliest."""
+        names = self._names
+        tokens = norm.split()
+        for n in range(min(_MAX_NAME_WORDS, len(tokens)), 0, -1):
+            for i in range(len(tokens) - n + 1):
+                place = names.get(" ".join(tokens[i:i + n]))
+                if place is not None:
+                    return place
+        return None
+
+    def resolve(self, db: GraphDatabaseService, analysis: QueryAnalysis) -> Optional[Dict[str, Any]]:
+        """
+        The place the question is about and the radius to search, or None.
+        The place phrase the analyzer extracted is tried first, then the
+        capitalized phrases after "in"/"near"/"of"/..., never the whole
+        question (where "reading" or "nice" would match a town).
+        """
+        self._ensure_loaded(db)
+        candidates = ([analysis.location] if analysis.location else []) + analysis.place_phrases
+        for phrase in candidates:
+            place = self._lookup(normalize_text(phrase))
+            if place is not None:
+                return {**place, "radius_km": search_radius(analysis)}
+        return None
+
+
+def search_radius(analysis: QueryAnalysis) -> float:
+    """Radius in km: an explicit "within N km of", "near", or the place itself."""
+    if analysis.within_km is not None:
+        return analysis.within_km
+    return LOCATION_NEAR_RADIUS_KM if analysis.near else LOCATION_RADIUS_KM
+
+
+GAZETTEER = Gazetteer()
+
+
+def find_books(db: GraphDatabaseService, place: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Books set within the place's radius, doubling it (up to LOCATION_MAX_RADIUS_KM) until some are found."""
+    radius = place["radius_km"]
+    while True:
+        books = db.find_books_near(place["latitude"], place["longitude"], radius, LOCATION_MAX_BOOKS)
+        if books or radius >= LOCATION_MAX_RADIUS_KM:
+            return books
+        radius = min(radius * 2, LOCATION_MAX_RADIUS_KM)
+
+
+def categorize(place: str, books: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Group books by their first genre, largest groups first."""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for book in books:
+        genre = book["genres"][0] if book.get("genres") else "Other"
+        groups.setdefault(genre, []).append(
+            {k: book[k] for k in ("title", "author", "rating", "setting", "distanceKm")})
+    ranked = sorted(groups.items(), key=lambda kv: -len(kv[1]))[:LOCATION_MAX_CATEGORIES]
+    return [{
+        "name": genre,
+        "description": f"{genre} books set in or near {place}.",
+        "books": group,
+    } for genre, group in ranked]
+
+
+def location_answer(location_data: Dict[str, Any]) -> str:
+    location = location_data["location"]
+    categories = location_data["categories"]
+    if not categories:
+        return (f"I couldn't find books set in or near {location}. "
+                f"Try asking about a different place or a larger region.")
+    names = ", ".join(c["name"] for c in categories[:3])
+    # categorize orders by group size, so look across all of them
+    nearest = min((b for c in categories for b in c["books"]), key=lambda b: b["distanceKm"])
+    by = f" by {nearest['author']}" if nearest.get("author") else ""
+    return (f"I found books set in or near {location} in these categories: {names}. "
+            f"The one set closest is {nearest['title']}{by}, set in {nearest['setting']}.")
+
+
+def location_agent(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer "books set in/near <place>" questions from the place index."""
+    if resilience.expired(state):
+        return {**state, "location_data": None}
+
+    db = GraphDatabaseService()
+    try:
+        with timed("location.lookup") as span:
+            place = GAZETTEER.resolve(db, analysis_of(state))
+            span.cache = "hit" if place else "miss"
+            books = find_books(db, place) if place else []
+    except Exception:
+        logger.exception("Location lookup failed")
+        place = None
+    finally:
+        db.close()
+
+    if place is None:
+        # No known place named; answer like any other question
+        if state.get("found_in_graph"):
+            return {**state, "location_data": None}
+        from web_agent import web_agent
+        return {**web_agent(state), "location_data": None}
+
+    location_data = {"location": place["name"], "categories": categorize(place["name"], books)}
+    return {**state, "location_data": location_data, "response": location_answer(location_data)}
+
+
+def load_settings(db: GraphDatabaseService, rows: List[Dict[str, str]], batch_size: int = 500) -> int:
+    """MERGE PLACE nodes (and SET_IN edges for rows with a title); returns the rows written."""
+    db.ensure_indexes()
+    cypher = """
+    UNWIND $rows AS r
+      MERGE (p:PLACE {normName: r.normName})
+        ON CREATE SET p.name = r.place
+      SET p.location = point({latitude: r.latitude, longitude: r.longitude})
+      WITH p, r WHERE r.title <> ''
+      MATCH (b:BOOK {title: r.title})
+      MERGE (b)-[:SET_IN]->(p)
+    """
+    written = 0
+    for batch in iter_batches(rows, batch_size):
+        db.execute_query(cypher, {"rows": [{
+            "title": (r.get("title") or "").strip(),
+            "place": r["place"].strip(),
+            "normName": normalize_text(r["place"]),
+            "latitude": float(r["latitude"]),
+            "longitude": float(r["longitude"]),
+        } for r in batch]})
+        written += len(batch)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load book settings into the place index.")
+    parser.add_argument("--load", required=True, help="CSV with title, place, latitude, longitude columns")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with open(args.load, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    db = GraphDatabaseService()
+    try:
+        print(f"Loaded {load_settings(db, rows, batch_size=args.batch_size)} settings")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
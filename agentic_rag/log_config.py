@@ -0,0 +1,110 @@
+"""
+Non-blocking structured logging.
+
+Modules log through ``logging.getLogger(__name__)`` with %-style
+arguments, so messages are only formatted if a handler actually emits
+them. ``configure_logging()`` installs a QueueHandler on the root logger;
+a single QueueListener thread does the formatting and the writes to
+stdout, so request threads never contend on stdout.
+
+Environment:
+  LOG_LEVEL              default level (INFO)
+  LOG_LEVELS             per-module levels, e.g. "web_agent=DEBUG,neo4j=WARNING"
+  LOG_FORMAT             "text" (default) or "json"
+  LOG_DEBUG_SAMPLE_RATE  fraction of DEBUG records kept (1.0 = all)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Optional
+
+# Attributes every LogRecord has; anything else was passed via ``extra=``
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in record.__dict__.items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extras = {k: v for k, v in record.__dict__.items() if k not in _STANDARD_ATTRS}
+        if extras:
+            text += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return text
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread.
+    (The stock prepare() formats the message in the logging thread.)
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _parse_levels(spec: str):
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip() and level.strip():
+            yield name.strip(), level.strip().upper()
+
+
+def configure_logging() -> None:
+    """Install the queue-based handler on the root logger (idempotent)."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else TextFormatter())
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        handler = DeferredQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+
+        root = logging.getLogger()
+        root.handlers[:] = [handler]
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")):
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
@@ -1,5 +1,7 @@
 import os
-from typing import Dict, Any
+import asyncio
+import logging
+from typing import AsyncIterator
 from dotenv import load_dotenv
 from langgraph.graph import END
 from pathlib import Path as FSPath
@@ -17,10 +19,16 @@ sys.path.append(str(FSPath(__file__).parent.parent))
 load_dotenv()
 
 # Import the components
-from graph_agent import create_graph_rag_workflow
+from graph_agent import create_graph_rag_workflow, GraphDatabaseService, normalize_text, embed_texts, template_graph_answer
+from fast_path import POLISH_STORE
 from web_agent import web_agent
 from trading_agent import trading_agent
 from location_agent import location_agent
+from metrics import instrument_node, start_request, set_route, timed
+from query_analysis import analysis_of
+import resilience
+
+logger = logging.getLogger(__name__)
 
 class BookChatbot:
     def __init__(self):
@@ -28,31 +36,13 @@ class BookChatbot:
         self.workflow = self._setup_workflow()
     
     def _setup_workflow(self):
-        # Get the basic workflow
-        workflow = create_graph_rag_workflow()
-        
-        # Add the web_agent node and edge
-        workflow.add_node("web_agent", web_agent)
-        workflow.add_edge("web_agent", "generate_response")
-        
-        # Add the trading_agent node
-        workflow.add_node("trading_agent", trading_agent)
-        
-        # Add the location_agent node
-        workflow.add_node("location_agent", location_agent)
-        
-        # Add decision point after query_graph
+        # Decision point after query_graph, from the intents analyze_query found
         def route_to_agent(state):
-            query = state.get("query", "").lower()
+            agent = analysis_of(state).agent
             
-            # Check for trading-related query
-            if any(term in query for term in ["trading", "trade", "stock", "forex", "invest", "market", "crypto", "option", "day trade", "value invest"]):
-                return "trading_agent"
-                
-            # Check for location-related query
-            location_terms = ["location", "city", "country", "place", "travel", "visit", "in ", "from "]
-            if any(term in query for term in location_terms) or "books about " in query or "books set in " in query:
-                return "location_agent"
+            # Trading and location questions go to their agents
+            if agent is not None:
+                return f"{agent}_agent"
                 
             # If not found in graph, use web search
             elif not state.get("found_in_graph", False):
@@ -62,18 +52,23 @@ class BookChatbot:
             else:
                 return "generate_response"
         
-        # Add conditional edges without trying to remove existing ones first
-        # Just define the routing from query_graph directly
-        workflow.add_conditional_edges(
-            "query_graph",
-            route_to_agent,
-            {
-                "trading_agent": "trading_agent",
-                "location_agent": "location_agent", 
-                "web_search": "web_agent",
-                "generate_response": "generate_response"
-            }
-        )
+        # Get the basic workflow, routed by route_to_agent alone
+        workflow = create_graph_rag_workflow(route_to_agent, {
+            "trading_agent": "trading_agent",
+            "location_agent": "location_agent",
+            "web_search": "web_agent",
+            "generate_response": "generate_response"
+        })
+        
+        # Add the web_agent node and edge
+        workflow.add_node("web_agent", instrument_node("web_agent", web_agent))
+        workflow.add_edge("web_agent", "generate_response")
+        
+        # Add the trading_agent node
+        workflow.add_node("trading_agent", instrument_node("trading_agent", trading_agent))
+        
+        # Add the location_agent node
+        workflow.add_node("location_agent", instrument_node("location_agent", location_agent))
         
         # Add edges from agents to generate_response
         workflow.add_edge("trading_agent", "generate_response")
@@ -82,8 +77,80 @@ class BookChatbot:
         # Compile the workflow after all nodes are set
         return workflow.compile()
     
-    async def process_message(self, query: str) -> Dict[str, Any]:
-        """Process a user message and return a response."""
+    async def process_batch(self, queries: List[str], max_concurrency: int = 4,
+                            user_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process many messages with bounded concurrency.
+
+        Identical normalized queries are only run once, all unique queries
+        are embedded in a single batch, and cached web results are fetched
+        with one bulk graph lookup. Results are yielded as they complete,
+        each tagged with the ``index`` and ``query`` it answers. Every query
+        is answered for ``user_id``.
+        """
+        # 1) Dedupe on the same normalization the Query cache uses
+        groups: Dict[str, List[int]] = {}
+        for i, q in enumerate(queries):
+            groups.setdefault(normalize_text(q), []).append(i)
+        norms = list(groups)
+
+        # 2) Warm the embedding cache in one forward pass
+        try:
+            await asyncio.to_thread(embed_texts, norms)
+        except Exception:
+            logger.exception("Error batch-embedding queries")
+
+        # 3) One UNWIND round-trip for every cached web lookup
+        prefetched: Dict[str, List[Dict[str, str]]] = {}
+        try:
+            db = GraphDatabaseService()
+            try:
+                prefetched = await asyncio.to_thread(db.get_cached_web_results_bulk, norms)
+            finally:
+                db.close()
+        except Exception:
+            logger.exception("Error prefetching cached web results")
+
+        # 4) Run each unique query once, at most max_concurrency at a time
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(norm: str):
+            query = queries[groups[norm][0]]
+            async with semaphore:
+                try:
+                    result = await self.process_message(query, prefetched_web=prefetched.get(norm), user_id=user_id)
+                except Exception as e:
+                    logger.exception("Error processing batch query")
+                    result = {"type": "error", "content": str(e), "data": None}
+            return norm, result
+
+        tasks = [asyncio.ensure_future(run(norm)) for norm in norms]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                norm, result = await next_done
+                for i in groups[norm]:
+                    yield {"index": i, "query": queries[i], **result}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def process_message(self, query: str, prefetched_web: Optional[List[Dict[str, str]]] = None,
+                              user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Process a user message and return a response, personalised for ``user_id`` when given."""
+        request_metrics = start_request()
+        deadline = resilience.start_deadline()
+        result = None
+        try:
+            with timed("request.total"):
+                result = await self._process_message(query, prefetched_web, deadline, user_id)
+            return result
+        finally:
+            # Tag every span recorded for this request with the route it took
+            set_route(result["type"] if result else "error")
+            request_metrics.finish()
+
+    async def _process_message(self, query: str, prefetched_web: Optional[List[Dict[str, str]]] = None,
+                               deadline: Optional[float] = None, user_id: Optional[str] = None) -> Dict[str, Any]:
         # Initialize state
         state = {
             "query": query,
@@ -91,57 +158,42 @@ class BookChatbot:
             "web_data": None,
             "trading_data": None,
             "location_data": None,
+            "analysis": None,
+            "user_id": user_id,
             "response": None,
-            "found_in_graph": False
+            "found_in_graph": False,
+            "prefetched_web": prefetched_web,
+            "deadline": deadline,
+            "fast_path": False
         }
         
         # Execute the workflow
-        print("Starting workflow execution...")
+        logger.debug("Starting workflow execution...")
         final_state = None
         
         try:
             async for event in self.workflow.astream(state):
-                print(f"Received event type: {list(event.keys())}")
-                
-                # Check for web_agent node specifically
-                if "web_agent" in event:
-                    print("Received web agent response")
-                    web_state = event["web_agent"]
-                    if web_state.get("response"):
-                        print(f"Web agent response: {web_state['response'][:50]}...")
-                    else:
-                        print("Web agent did not return a response")
-                
-                # Check for trading_agent node
-                if "trading_agent" in event:
-                    print("Received trading agent response")
-                    trading_state = event["trading_agent"]
-                    if trading_state.get("response"):
-                        print(f"Trading agent response: {trading_state['response'][:50]}...")
-                    else:
-                        print("Trading agent did not return a response")
+                logger.debug("Received event type: %s", event.keys())
                 
-                # Check for location_agent node
-                if "location_agent" in event:
-                    print("Received location agent response")
-                    location_state = event["location_agent"]
-                    if location_state.get("response"):
-                        print(f"Location agent response: {location_state['response'][:50]}...")
-                    else:
-                        print("Location agent did not return a response")
+                # Log what each agent node produced
+                for agent in ("web_agent", "trading_agent", "location_agent"):
+                    if agent in event:
+                        agent_response = event[agent].get("response")
+                        if agent_response:
+                            logger.debug("%s response: %.50s...", agent, agent_response)
+                        else:
+                            logger.debug("%s did not return a response", agent)
                         
                 # The generate_response node will have the final state
                 if "generate_response" in event:
                     final_state = event["generate_response"]
-                    print("Received generate_response final state")
-        except Exception as e:
-            print(f"Error during workflow execution: {str(e)}")
-            import traceback
-            traceback.print_exc()
+                    logger.debug("Received generate_response final state")
+        except Exception:
+            logger.exception("Error during workflow execution")
         
         # If we didn't get a final state, return an error
         if not final_state:
-            print("No final state received from workflow")
+            logger.warning("No final state received from workflow")
             return {
                 "type": "error",
                 "content": "Failed to process message through the workflow.",
@@ -192,24 +244,32 @@ class BookChatbot:
                     response_content = f"I found some information that might help with your question about '{query}'. I found sources including {titles_text}."
                 else:
                     response_content = f"I searched the web for information about '{query}', but I'm having trouble summarizing the results."
+            elif response_type == "graph" and template_graph_answer(final_state["graph_data"]):
+                # Structured graph data reads fine without the LLM
+                response_content = template_graph_answer(final_state["graph_data"])
             else:
                 # Generic fallback
                 response_content = f"I processed your query about '{query}', but I'm not able to generate a proper response. Please try asking in a different way."
         
         # Debug output
-        print(f"Final response type: {response_type}")
-        print(f"Response data count: {len(response_data) if isinstance(response_data, list) else 'N/A'}")
-        print(f"Response content: {response_content[:100]}...")
+        logger.debug("Final response", extra={
+            "response_type": response_type,
+            "data_count": len(response_data) if isinstance(response_data, list) else None,
+        })
+        logger.debug("Response content: %.100s...", response_content)
         
-        return {
+        result = {
             "type": response_type,
             "content": response_content,
             "data": response_data
         }
+        if final_state.get("fast_path"):
+            # Templated answer; the LLM-written one can be fetched later
+            result["polishId"] = POLISH_STORE.register(query, final_state["graph_data"])
+        return result
 
 # Example usage
 if __name__ == "__main__":
-    import asyncio
     import sys
     import os
     
@@ -221,6 +281,9 @@ if __name__ == "__main__":
     from agentic_rag.web_agent import web_agent
     from agentic_rag.trading_agent import trading_agent
     from agentic_rag.location_agent import location_agent
+    from log_config import configure_logging
+
+    configure_logging()
     
     async def test_chatbot():
         chatbot = BookChatbot()
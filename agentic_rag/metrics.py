@@ -0,0 +1,173 @@
+"""
+Lightweight latency instrumentation for the chat pipeline.
+
+Every LangGraph node and every external call (Neo4j, embeddings, Tavily,
+OpenAI) is wrapped in a ``timed(stage)`` span. Spans recorded while a
+request is being processed are buffered on that request and flushed when
+it finishes, so they can all be tagged with the route the request
+eventually took. Spans outside a request (CLI jobs, warmup) are recorded
+immediately with route "none".
+
+Percentiles are computed over a sliding window of the most recent
+observations per (stage, route, cache) series.
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from profiling import active_session
+
+WINDOW_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self._recent.append(seconds)
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            recent = sorted(self._recent)
+            count, total = self.count, self.total
+        result = {"count": count, "sum": total}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.0
+        return result
+
+
+SeriesKey = Tuple[str, str, str]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._series: Dict[SeriesKey, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, route: str = "none", cache: str = "none") -> None:
+        key = (stage, route, cache)
+        hist = self._series.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._series.setdefault(key, Histogram())
+        hist.observe(seconds)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            series = list(self._series.items())
+        return [{"stage": stage, "route": route, "cache": cache, **hist.summary()}
+                for (stage, route, cache), hist in sorted(series)]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def render_prometheus(self) -> str:
+        """Render every series as a Prometheus summary in text exposition format."""
+        lines = [
+            "# HELP booklovers_stage_seconds Latency of chat pipeline stages.",
+            "# TYPE booklovers_stage_seconds summary",
+        ]
+        for s in self.snapshot():
+            labels = f'stage="{s["stage"]}",route="{s["route"]}",cache="{s["cache"]}"'
+            for q in QUANTILES:
+                lines.append(f'booklovers_stage_seconds{{{labels},quantile="{q}"}} {s[f"p{int(q * 100)}"]:.6f}')
+            lines.append(f"booklovers_stage_seconds_sum{{{labels}}} {s['sum']:.6f}")
+            lines.append(f"booklovers_stage_seconds_count{{{labels}}} {s['count']}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class RequestMetrics:
+    """Spans buffered for one request until its route is known."""
+
+    def __init__(self):
+        self.route = "unknown"
+        self.spans: List[Tuple[str, float, str]] = []
+
+    def finish(self, registry: Optional[MetricsRegistry] = None) -> None:
+        registry = registry or REGISTRY
+        for stage, seconds, cache in self.spans:
+            registry.observe(stage, seconds, self.route, cache)
+        self.spans = []
+
+
+_current_request: contextvars.ContextVar[Optional[RequestMetrics]] = \
+    contextvars.ContextVar("current_request_metrics", default=None)
+
+
+def start_request() -> RequestMetrics:
+    """Begin buffering spans for the request running in this context."""
+    request = RequestMetrics()
+    _current_request.set(request)
+    return request
+
+
+def set_route(route: str) -> None:
+    """Tag the current request's spans with the route it took."""
+    request = _current_request.get()
+    if request is not None:
+        request.route = route
+
+
+class timed:
+    """
+    Time the enclosed block as ``stage``::
+
+        with timed("neo4j.execute_query") as span:
+            ...
+            span.cache = "hit"
+
+    The span's ``cache`` attribute can be set to "hit"/"miss" inside the
+    block. (A plain class rather than @contextmanager: it is cheaper on
+    the hot path.)
+    """
+    __slots__ = ("stage", "cache", "_start")
+
+    def __init__(self, stage: str, cache: Optional[str] = None):
+        self.stage = stage
+        self.cache = cache
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        request = _current_request.get()
+        if request is not None:
+            request.spans.append((self.stage, seconds, self.cache or "none"))
+        else:
+            REGISTRY.observe(self.stage, seconds, "none", self.cache or "none")
+        return False
+
+
+def instrument_node(name: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]):
+    """
+    Wrap a LangGraph node so its runtime is recorded as ``node.<name>``,
+    and so the thread running it is sampled when its request is profiled.
+    """
+    stage = f"node.{name}"
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        session = active_session()
+        if session is not None:
+            with session.thread_scope(), timed(stage):
+                return fn(state)
+        with timed(stage):
+            return fn(state)
+    return wrapper
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+One-off migration of Query/WebResult embeddings from float lists
+to the compact byte format (see embedding_codec.py).
+
+Usage:
+   python migrate_embeddings.py [--batch-size 500] [--vector]
+
+The codec is taken from EMBEDDING_CODEC (default: int8).
+The migration runs in small batches and can be interrupted and re-run.
+
+When the server supports native vector indexes the float lists are kept
+(the index is built on them); --vector also restores them on nodes that
+were migrated to the compact format earlier.
+"""
+
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+from graph_agent import GraphDatabaseService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored embeddings to the compact format.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vector", action="store_true",
+                        help="backfill float-list embeddings for the native vector indexes")
+    args = parser.parse_args()
+
+    db = GraphDatabaseService()
+    try:
+        for label in GraphDatabaseService.EMBEDDING_LABELS:
+            migrated = db.migrate_embeddings(label, batch_size=args.batch_size)
+            print(f"Migrated {migrated} {label} embeddings to {GraphDatabaseService.EMBEDDING_CODEC}")
+        if args.vector:
+            if not db.vector_search_enabled():
+                sys.exit("This server has no native vector index support")
+            for label in GraphDatabaseService.EMBEDDING_LABELS:
+                updated = db.backfill_vector_embeddings(label, batch_size=args.batch_size)
+                print(f"Backfilled {updated} {label} embeddings for the vector index")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
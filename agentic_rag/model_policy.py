@@ -0,0 +1,136 @@
+"""
+Cost- and latency-aware model selection for chat completions.
+
+Each completion is assigned a tier from its route ("graph", "web"), its
+intent (the graph data type, or "synthesis" for web answers) and the size
+of the packed prompt:
+
+- "small": structured graph summaries (recommendations, author info,
+  genres) and any prompt under SMALL_MAX_PROMPT_CHARS;
+- "large": web syntheses and everything bigger.
+
+Tiers are configured with MODEL_TIER_SMALL / MODEL_TIER_LARGE as
+"<model>" or "<model>@<temperature>" (defaults gpt-4o-mini@0.7 and
+gpt-4@0.7); MODEL_TIERING=off sends everything to the large tier. A
+model name of "local" (or "local:<name>") selects LocalChatModel, a
+deterministic offline stand-in for tests and load runs.
+
+Per-tier latency is recorded in the metrics registry as ``llm.<tier>``;
+TIER_STATS keeps per-tier quality signals (empty answers, answer length,
+and how many of the context's titles the answer actually mentions).
+"""
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+MODEL_TIERING = os.getenv("MODEL_TIERING", "on").lower() not in ("0", "off", "false", "no")
+SMALL_MAX_PROMPT_CHARS = int(os.getenv("SMALL_MAX_PROMPT_CHARS", "4000"))
+
+# Graph intents whose data is already structured and only needs light phrasing
+STRUCTURED_INTENTS = ("recommendations", "author", "genres")
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    model: str
+    temperature: float = 0.7
+
+    @property
+    def is_local(self) -> bool:
+        return self.model == "local" or self.model.startswith("local:")
+
+
+def _tier_from_env(name: str, default: str) -> Tier:
+    spec = os.getenv(f"MODEL_TIER_{name.upper()}", default)
+    model, _, temperature = spec.partition("@")
+    return Tier(name, model, float(temperature) if temperature else 0.7)
+
+
+TIERS: Dict[str, Tier] = {
+    "small": _tier_from_env("small", "gpt-4o-mini@0.7"),
+    "large": _tier_from_env("large", "gpt-4@0.7"),
+}
+
+
+def select_tier(route: str, intent: Optional[str], prompt_chars: int) -> Tier:
+    """Pick the cheapest tier expected to handle this completion well."""
+    if not MODEL_TIERING:
+        return TIERS["large"]
+    if route == "graph" and intent in STRUCTURED_INTENTS and prompt_chars <= SMALL_MAX_PROMPT_CHARS:
+        return TIERS["small"]
+    if route == "web" or prompt_chars > SMALL_MAX_PROMPT_CHARS:
+        return TIERS["large"]
+    return TIERS["small"]
+
+
+class LocalMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class LocalChatModel:
+    """
+    Offline stand-in with ChatOpenAI's ``invoke``: answers by restating the
+    context lines of the prompt, so responses are deterministic and grounded.
+    """
+
+    def __init__(self, model: str = "local", temperature: float = 0.0):
+        self.model_name = model
+        self.temperature = temperature
+
+    def invoke(self, messages) -> LocalMessage:
+        prompt = messages[-1].content if messages else ""
+        facts = [line.strip(" -") for line in prompt.splitlines()
+                 if line.strip().startswith(("-", "1.", "2.", "3.", "Source", "Content:"))]
+        if not facts:
+            return LocalMessage("I don't have specific information about that in the knowledge graph.")
+        return LocalMessage("Here is what I found: " + "; ".join(facts[:5]))
+
+
+def build_model(tier: Tier, chat_model_class):
+    """Instantiate ``tier`` with ``chat_model_class`` (ChatOpenAI), or the local stand-in."""
+    if tier.is_local:
+        return LocalChatModel(tier.model, tier.temperature)
+    return chat_model_class(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=tier.model,
+        temperature=tier.temperature
+    )
+
+
+class TierStats:
+    """Running quality counters per tier."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, tier: str, answer: str, grounding_terms: Iterable[str] = (), failed: bool = False) -> None:
+        terms: List[str] = [t for t in grounding_terms if t]
+        lowered = answer.lower()
+        mentioned = sum(1 for t in terms if t.lower() in lowered)
+        with self._lock:
+            s = self._stats.setdefault(tier, {"calls": 0, "failures": 0, "empty": 0, "chars": 0,
+                                              "grounding_terms": 0, "grounding_hits": 0})
+            s["calls"] += 1
+            s["failures"] += int(failed)
+            s["empty"] += int(not failed and not answer.strip())
+            s["chars"] += len(answer)
+            s["grounding_terms"] += len(terms)
+            s["grounding_hits"] += mentioned
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            stats = {tier: dict(s) for tier, s in self._stats.items()}
+        for tier, s in stats.items():
+            answered = max(1, s["calls"] - s["failures"])
+            s["model"] = TIERS[tier].model if tier in TIERS else tier
+            s["avg_chars"] = round(s["chars"] / answered, 1)
+            s["grounding_rate"] = (round(s["grounding_hits"] / s["grounding_terms"], 3)
+                                   if s["grounding_terms"] else None)
+        return stats
+
+
+TIER_STATS = TierStats()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+Passage-level retrieval over the cached web corpus.
+
+Web results are split into passages of about PASSAGE_CHARS characters
+(on paragraph and sentence boundaries, PASSAGE_OVERLAP characters of
+overlap), embedded in batches and stored as (:WebResult)-[:HAS_PASSAGE]->
+(:Passage) nodes, searched like the other embeddings (native vector index,
+sidecar store or Python scan). Tavily's raw page content is used when it
+came back, the snippet otherwise.
+
+web_agent asks ``retrieve`` for the passages closest to a new question
+before calling Tavily, and answers from them (instead of whole pages)
+when at least PASSAGE_MIN_MATCHES score PASSAGE_MIN_SCORE or better. Results Tavily
+does return are ingested in the background, so the corpus (and the share
+of questions answered locally) grows with use. The lookup only runs when
+Passage embeddings are searchable without a full scan (a native vector
+index or EMBEDDING_STORE_DIR); LOCAL_RETRIEVAL=off disables it.
+
+Backfill passages for WebResults saved before this existed with:
+   python passages.py [--batch-size 100]
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+import content_store
+from graph_agent import GraphDatabaseService, embed_texts, embed_text, iter_batches, normalize_text
+from log_config import configure_logging
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+LOCAL_RETRIEVAL = os.getenv("LOCAL_RETRIEVAL", "on").lower() not in ("0", "off", "false", "no")
+# Matches the 500 characters per source that web prompts keep
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "500"))
+PASSAGE_OVERLAP = int(os.getenv("PASSAGE_OVERLAP", "100"))
+PASSAGE_TOP_K = int(os.getenv("PASSAGE_TOP_K", "4"))
+PASSAGE_MIN_SCORE = float(os.getenv("PASSAGE_MIN_SCORE", "0.6"))
+PASSAGE_MIN_MATCHES = int(os.getenv("PASSAGE_MIN_MATCHES", "2"))
+# Cap per page, so one long article doesn't turn into hundreds of passages
+PASSAGE_MAX_PER_PAGE = int(os.getenv("PASSAGE_MAX_PER_PAGE", "40"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_passages(text: str, size: int = PASSAGE_CHARS, overlap: int = PASSAGE_OVERLAP) -> List[str]:
+    """
+    Split ``text`` into passages of at most ``size`` characters, breaking
+    between paragraphs or sentences where possible. Each passage repeats
+    up to ``overlap`` characters from the end of the previous one.
+    """
+    units: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text or ""):
+        paragraph = " ".join(paragraph.split())
+        for sentence in _SENTENCE_END.split(paragraph):
+            # Hard-wrap sentences that are longer than a passage on their own
+            while len(sentence) > size:
+                cut = sentence.rfind(" ", 0, size)
+                cut = cut if cut > size // 2 else size
+                units.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+            if sentence:
+                units.append(sentence)
+
+    passages: List[str] = []
+    current = ""
+    for unit in units:
+        if current and len(current) + 1 + len(unit) > size:
+            passages.append(current)
+            tail = current[-overlap:] if overlap > 0 else ""
+            # Start the overlap on a word boundary
+            current = tail[tail.find(" ") + 1:] if " " in tail else ""
+            if len(current) + 1 + len(unit) > size:
+                current = ""
+        current = f"{current} {unit}".strip()
+    if current:
+        passages.append(current)
+    return passages
+
+
+def ingest(db: GraphDatabaseService, results: List[Dict[str, Any]], batch_size: int = 64) -> int:
+    """
+    Split, embed (in batches of ``batch_size`` passages) and store the
+    passages of ``results`` (saved WebResults: url, title, content and
+    optionally raw_content). Returns the number of passages stored.
+    """
+    pages = []
+    for r in results:
+        if not r.get("url"):
+            continue
+        texts = split_passages(r.get("raw_content") or r.get("content") or "")[:PASSAGE_MAX_PER_PAGE]
+        if texts:
+            pages.append((r["url"], r.get("title") or "", texts))
+    if not pages:
+        return 0
+
+    with timed("passages.ingest"):
+        # Embed with the page title in front, so short passages keep their context
+        flat = [(url, f"{title}\n{text}") for url, title, texts in pages for text in texts]
+        vectors: List[list] = []
+        for batch in iter_batches(flat, batch_size):
+            vectors.extend(embed_texts([text for _, text in batch], batch_size=batch_size))
+
+        stored, offset = 0, 0
+        for url, _, texts in pages:
+            passages = [{"text": text, "embedding": vec}
+                        for text, vec in zip(texts, vectors[offset:offset + len(texts)])]
+            offset += len(texts)
+            stored += len(db.save_passages(url, passages))
+    logger.debug("Stored %d passages from %d pages", stored, len(pages))
+    return stored
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="passage-ingest")
+
+
+def ingest_in_background(results: List[Dict[str, Any]]) -> None:
+    """Queue ``ingest`` off the request path, with its own connection."""
+    def run():
+        db = GraphDatabaseService()
+        try:
+            ingest(db, results)
+        except Exception:
+            logger.exception("Passage ingestion failed")
+        finally:
+            db.close()
+
+    _executor.submit(run)
+
+
+def retrieve(db: GraphDatabaseService, query: str, k: int = PASSAGE_TOP_K,
+             vec: Optional[list] = None) -> List[Dict[str, Any]]:
+    """
+    The cached passages scoring PASSAGE_MIN_SCORE or better for ``query``
+    (or its embedding ``vec``, when the caller already has it), best first
+    (see GraphDatabaseService.find_passages).
+    """
+    if not LOCAL_RETRIEVAL:
+        return []
+    if not db.indexed_search("Passage"):
+        # Scanning every Passage over Bolt costs more than the web call it might save
+        return []
+    with timed("passages.retrieve") as span:
+        vec = vec if vec is not None else embed_text(normalize_text(query))
+        passages = [p for p in db.find_passages(vec, k)
+                    if p["score"] >= PASSAGE_MIN_SCORE]
+        span.cache = "hit" if has_enough(passages) else "miss"
+    return passages
+
+
+def has_enough(passages: List[Dict[str, Any]]) -> bool:
+    """Whether the local passages are enough to answer without a web search."""
+    return len(passages) >= PASSAGE_MIN_MATCHES
+
+
+def backfill(db: GraphDatabaseService, batch_size: int = 100) -> int:
+    """Ingest passages for every WebResult that doesn't have any yet. Safe to re-run."""
+    fetch = """
+    MATCH (w:WebResult)
+    WHERE NOT (w)-[:HAS_PASSAGE]->(:Passage)
+      AND trim(coalesce(w.contentPreview, w.content, '')) <> ''
+    RETURN w.url AS url, w.title AS title, coalesce(w.contentPreview, w.content) AS content,
+           w.contentHash AS contentHash
+    LIMIT $limit
+    """
+    stored = 0
+    while True:
+        records = db.execute_query(fetch, {"limit": batch_size})
+        # Split the full stored bodies, not just the previews
+        bodies = content_store.load_bodies(db, [r["contentHash"] for r in records])
+        added = ingest(db, [{"url": r["url"], "title": r["title"], "content": r["content"],
+                             "raw_content": bodies.get(r["contentHash"])} for r in records])
+        # Ingested pages drop out of the MATCH; stop once a batch adds nothing
+        if not added:
+            return stored
+        stored += added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split and index passages of cached web results.")
+    parser.add_argument("--batch-size", type=int, default=100, help="web results per batch")
+    args = parser.parse_args()
+
+    configure_logging()
+
+    db = GraphDatabaseService()
+    try:
+        print(f"Stored {backfill(db, batch_size=args.batch_size)} passages")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+On-demand, per-request statistical profiling.
+
+A request is profiled when it is picked by PROFILE_SAMPLE_RATE (0.0-1.0,
+default 0) or, if PROFILE_HEADER_ENABLED is set, when it carries an
+``X-Profile: 1`` header. While it runs, a
+sampler thread snapshots the stacks of the threads working on that
+request every PROFILE_INTERVAL_MS (default 5 ms): the thread that called
+``profile_request`` plus any thread currently executing one of its
+workflow nodes (see ``metrics.instrument_node``). The samples are written
+as collapsed stacks to PROFILE_DIR/<request id>.folded, ready for
+flamegraph.pl or speedscope. The request id is the client's X-Request-ID
+(at most REQUEST_ID_MAX_LENGTH characters) plus a unique suffix, so a
+client can't overwrite another profile.
+
+When a request isn't profiled the only cost is a context variable lookup
+per workflow node.
+"""
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# The header lets any client start the profiler; only honour it when asked to
+PROFILE_HEADER_ENABLED = os.getenv("PROFILE_HEADER_ENABLED", "").lower() in ("1", "true", "yes")
+REQUEST_ID_MAX_LENGTH = 64
+
+
+class ProfileSession:
+    def __init__(self, request_id: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.request_id = request_id
+        self.interval = interval_ms / 1000.0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._threads: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{request_id}", daemon=True)
+
+    def start(self) -> None:
+        self._add_thread(threading.get_ident())
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+
+    def _add_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] += 1
+
+    def _remove_thread(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    @contextmanager
+    def thread_scope(self):
+        """Sample the calling thread for the duration of the block."""
+        ident = threading.get_ident()
+        self._add_thread(ident)
+        try:
+            yield
+        finally:
+            self._remove_thread(ident)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                idents = [i for i in self._threads if i != own]
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def write(self, directory: str = PROFILE_DIR) -> str:
+        """Write the collapsed stacks to <directory>/<request id>.folded."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.request_id}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+_active_session: contextvars.ContextVar[Optional[ProfileSession]] = \
+    contextvars.ContextVar("active_profile_session", default=None)
+
+
+def active_session() -> Optional[ProfileSession]:
+    return _active_session.get()
+
+
+def should_profile(headers: Mapping[str, str]) -> bool:
+    """Profile if it's picked by the sampling rate, or if the request asks for it and that is enabled."""
+    flag = headers.get("X-Profile", "").lower()
+    if PROFILE_HEADER_ENABLED and flag in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def request_id_from(headers: Mapping[str, str]) -> str:
+    request_id = headers.get("X-Request-ID", "")[:REQUEST_ID_MAX_LENGTH]
+    # Only keep ids that are safe to use as a file name, and never trust them to be unique
+    if not request_id or not all(c.isalnum() or c in "-_" for c in request_id):
+        request_id = time.strftime('%Y%m%d-%H%M%S')
+    return f"{request_id}-{uuid.uuid4().hex[:8]}"
+
+
+@contextmanager
+def profile_request(request_id: str, enabled: bool):
+    """
+    Profile the work done in this context (and the workflow nodes it runs)
+    when ``enabled``; yields the session, or None when not profiling.
+    """
+    if not enabled:
+        yield None
+        return
+
+    session = ProfileSession(request_id)
+    token = _active_session.set(session)
+    session.start()
+    try:
+        yield session
+    finally:
+        session.stop()
+        _active_session.reset(token)
+        try:
+            path = session.write()
+        except OSError:
+            # Losing the profile mustn't fail the request
+            logger.exception("Could not write profile for request %s", request_id)
+        else:
+            logger.info("Wrote profile for request %s (%d samples) to %s", request_id, session.samples, path)
@@ -0,0 +1,224 @@
+"""
+One-pass query analysis shared by the router, the graph intents and the agents.
+
+``analyze`` collapses the question's whitespace and lowercases it once,
+then scans it once with a single compiled alternation of every keyword
+and cue the pipeline looks for. The regex engine matches all of them in
+one left-to-right pass, longest phrase first. Each match is looked up in
+PHRASE_TAGS, and the entity that follows a cue is cut out of the same
+text:
+
+  intent:<name>  - trading, location, recommend, author, genre
+  cue:title      - "similar to" / "like": a book title follows
+  cue:author     - "books by" / "written by" / "who is" / "tell me about"
+  cue:place      - "set in" / "near" / "around" / "close to": a place follows;
+                   "in" / "from" / "about" / "books about": a place follows if
+                   it is capitalized
+
+The workflow's analyze_query node stores the QueryAnalysis in the state
+as ``analysis``. The embedding of the normalized question is computed on
+first use and then shared by every node that needs it.
+
+Check that the UI's example queries still reach the agents they should:
+   python query_analysis.py --check
+"""
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Set
+
+# — normalize text (lowercase, strip punctuation, collapse spaces)
+def normalize_text(text: str) -> str:
+    t = text.lower().strip()
+    t = re.sub(r'[^\w\s]', '', t)
+    return re.sub(r'\s+', ' ', t)
+
+
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "trading": ["trading", "trade", "trades", "trader", "traders", "stock", "stocks", "forex",
+                "invest", "investing", "investment", "investments", "investor", "investors",
+                "market", "markets", "crypto", "cryptocurrency", "cryptocurrencies", "option", "options",
+                "day trade", "day trading", "value invest", "value investing"],
+    "location": ["location", "city", "cities", "country", "countries", "place", "places",
+                 "travel", "visit", "set in", "near", "nearby", "located", "books about"],
+    "recommend": ["recommend", "recommendation", "recommendations", "similar", "similar to", "like",
+                  "suggest", "suggestion", "suggestions"],
+    "author": ["author", "authors", "wrote", "writer", "writers", "books by", "written by",
+               "who is", "tell me about"],
+    "genre": ["genre", "genres", "type", "category", "categories"],
+}
+CUES: Dict[str, List[str]] = {
+    "title": ["similar to", "like"],
+    "author": ["books by", "written by", "who is", "tell me about"],
+    "place": ["set in", "near", "around", "close to", "outside"],
+    # Only followed by a place when the next word is capitalized
+    "place?": ["in", "from", "about", "books about"],
+}
+
+PHRASE_TAGS: Dict[str, Set[str]] = {}
+for _intent, _phrases in INTENT_KEYWORDS.items():
+    for _phrase in _phrases:
+        PHRASE_TAGS.setdefault(_phrase, set()).add(f"intent:{_intent}")
+for _cue, _phrases in CUES.items():
+    for _phrase in _phrases:
+        PHRASE_TAGS.setdefault(_phrase, set()).add(f"cue:{_cue}")
+
+_WITHIN = r"within (\d+(?:\.\d+)?) ?(km|kilometers|kilometres|mi|miles?) of"
+# Longest phrases first, so "day trading" wins over "trading" and "set in" over "in"
+_SCANNER = re.compile(r"\b(?:" + _WITHIN + "|"
+                      + "|".join(re.escape(p) for p in sorted(PHRASE_TAGS, key=len, reverse=True))
+                      + r")\b")
+# An extracted entity ends at punctuation or at " by " (as in "like Dune, by ..."),
+# but not at the periods of initials ("J.K. Rowling")
+_ENTITY_END = re.compile(r"[?!,;]|(?<!\b\w)\.(?=\s|$)|\s[Bb]y\s")
+_AUTHOR_WORDS = re.compile(r"^(?:the )?author (?:of )?|(?: the)? author$")
+_CAPITALIZED = re.compile(r"(?:[A-Z][\w'-]*)(?:\s+(?:of|de|la|le|del|upon|on)?\s*[A-Z][\w'-]*)*")
+_MAX_PLACE_WORDS = 4
+# Where a place name may follow, for questions whose place the cues missed
+_PLACE_PREFIX = re.compile(r"\b(?:in|near|around|about|of|from|at|to)\s+(?:the\s+)?", re.IGNORECASE)
+
+
+@dataclass
+class QueryAnalysis:
+    text: str                      # the question, whitespace collapsed
+    norm: str                      # normalize_text(text): the cache key
+    intents: FrozenSet[str]
+    title: Optional[str] = None    # the book in "books similar to <title>"
+    author: Optional[str] = None
+    location: Optional[str] = None
+    near: bool = False             # "near"/"around" rather than "set in"
+    within_km: Optional[float] = None
+    _embedding: Optional[list] = field(default=None, repr=False, compare=False)
+
+    def has(self, intent: str) -> bool:
+        return intent in self.intents
+
+    @property
+    def agent(self) -> Optional[str]:
+        """The specialised agent the question is routed to ("trading", "location"), if any."""
+        if self.has("trading"):
+            return "trading"
+        if self.has("location"):
+            return "location"
+        return None
+
+    @property
+    def place_phrases(self) -> List[str]:
+        """Capitalized phrases after "in"/"near"/"about"/"of"/..., e.g. "Paris" in "the history of Paris"."""
+        phrases = []
+        for prefix in _PLACE_PREFIX.finditer(self.text):
+            match = _CAPITALIZED.match(self.text, prefix.end())
+            if match:
+                phrases.append(" ".join(match.group(0).split()[:_MAX_PLACE_WORDS]))
+        return phrases
+
+    @property
+    def embedding(self) -> list:
+        """Embedding of ``norm``, computed once."""
+        if self._embedding is None:
+            # Imported here: graph_agent imports this module
+            from graph_agent import embed_text
+            self._embedding = embed_text(self.norm)
+        return self._embedding
+
+
+def _entity(text: str, start: int) -> Optional[str]:
+    """The phrase starting at ``start``, up to punctuation or " by "."""
+    rest = text[start:].lstrip()
+    end = _ENTITY_END.search(rest)
+    entity = (rest[:end.start()] if end else rest).strip()
+    if entity.lower().startswith("the "):
+        entity = entity[4:]
+    return entity or None
+
+
+def _place(text: str, start: int, capitalized_only: bool) -> Optional[str]:
+    entity = _entity(text, start)
+    if not entity:
+        return None
+    if capitalized_only:
+        match = _CAPITALIZED.match(entity)
+        entity = match.group(0) if match else None
+    return " ".join(entity.split()[:_MAX_PLACE_WORDS]) if entity else None
+
+
+def analyze(query: str) -> QueryAnalysis:
+    """Scan ``query`` once and return its intents and entities."""
+    text = " ".join(query.split())
+    lowered = text.lower()
+    # Capitalization checks need lowered and text to line up character for character
+    cased = text if len(lowered) == len(text) else lowered
+
+    intents: Set[str] = set()
+    title = author = location = None
+    near = False
+    within_km = None
+    for match in _SCANNER.finditer(lowered):
+        if match.group(1):
+            distance = float(match.group(1))
+            within_km = distance * 1.609 if match.group(2).startswith("mi") else distance
+            intents.add("location")
+            location = location or _place(cased, match.end(), capitalized_only=False)
+            continue
+        tags = PHRASE_TAGS[match.group(0)]
+        intents.update(tag[7:] for tag in tags if tag.startswith("intent:"))
+        if "cue:title" in tags and title is None:
+            title = (_entity(cased, match.end()) or "").lower() or None
+        if "cue:author" in tags and author is None:
+            author = _AUTHOR_WORDS.sub("", (_entity(cased, match.end()) or "").lower()) or None
+        if location is None and ("cue:place" in tags or "cue:place?" in tags):
+            location = _place(cased, match.end(), capitalized_only="cue:place" not in tags)
+            near = near or (location is not None and match.group(0) != "set in" and "cue:place" in tags)
+
+    if location:
+        intents.add("location")
+    return QueryAnalysis(
+        text=text,
+        norm=normalize_text(text),
+        intents=frozenset(intents),
+        title=title if "recommend" in intents else None,
+        author=author,
+        location=location,
+        near=near or within_km is not None,
+        within_km=within_km,
+    )
+
+
+def analysis_of(state: Dict) -> QueryAnalysis:
+    """The state's analysis, or a fresh one for nodes run outside the workflow."""
+    return state.get("analysis") or analyze(state["query"])
+
+
+# Where each of the UI's example queries must be routed (None: graph or web)
+EXAMPLE_ROUTES: Dict[str, Optional[str]] = {
+    "Recommend fantasy books similar to Lord of the Rings": None,
+    "What are good science fiction books about space exploration?": "location",
+    "Tell me about top trading topics and book recommendations": "trading",
+    "Recommend books on cryptocurrency trading strategies": "trading",
+    "Suggest books about the history of Paris": "location",
+    "What are good books set in Tokyo?": "location",
+    "Recommend travel literature about Iceland": "location",
+}
+
+
+def check_examples() -> List[str]:
+    """Example queries routed somewhere other than EXAMPLE_ROUTES says (or missing from it)."""
+    from examples import example_queries
+    failures = []
+    for query in example_queries:
+        if query not in EXAMPLE_ROUTES:
+            failures.append(f"{query!r}: no expected route in EXAMPLE_ROUTES")
+            continue
+        agent = analyze(query).agent
+        if agent != EXAMPLE_ROUTES[query]:
+            failures.append(f"{query!r}: routed to {agent}, expected {EXAMPLE_ROUTES[query]}")
+    return failures
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["--check"]:
+        sys.exit("usage: python query_analysis.py --check")
+    problems = check_examples()
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
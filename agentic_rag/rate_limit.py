@@ -0,0 +1,48 @@
+"""
+Simple thread-safe token-bucket rate limiter used to pace calls
+to external APIs (Tavily, OpenAI) from background jobs.
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        """
+        Allow on average ``rate_per_sec`` acquisitions per second,
+        with up to ``burst`` acquisitions back-to-back.
+        A rate of 0 disables limiting.
+        """
+        self.rate = float(rate_per_sec)
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
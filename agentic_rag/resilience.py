@@ -0,0 +1,202 @@
+"""
+Request deadlines and circuit breakers for the external services.
+
+Every request gets an overall budget (REQUEST_TIMEOUT seconds, default
+30). ``process_message`` puts the absolute deadline in the workflow state
+and in a context variable; nodes check ``expired(state)`` before starting
+work, and external calls are given at most ``remaining()`` seconds.
+
+Each service (neo4j, tavily, openai) has a CircuitBreaker: after
+BREAKER_FAILURES consecutive failures it opens and calls fail
+immediately with CircuitOpen for BREAKER_RESET seconds, then a single
+trial call decides whether it closes again. Only the service's own
+errors and timeouts count as failures: a call cut short because the
+request's budget ran out says nothing about the service. Nodes treat CircuitOpen and
+DeadlineExceeded as "no answer from this service" and fall through to
+the templated fallbacks in ``process_message``.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Type
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request ran out of time before this call could finish."""
+
+
+class ServiceTimeout(DeadlineExceeded):
+    """The service didn't answer within the call's own timeout."""
+
+
+class CircuitOpen(RuntimeError):
+    """The service's breaker is open; the call was not attempted."""
+
+
+# — deadlines
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def start_deadline(timeout: float = REQUEST_TIMEOUT) -> float:
+    """Set this context's deadline ``timeout`` seconds from now; returns it (time.monotonic)."""
+    deadline = time.monotonic() + timeout
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before this context's deadline, or ``default`` without one."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return deadline - time.monotonic()
+
+
+def expired(state: Optional[Mapping[str, Any]] = None) -> bool:
+    """True once the deadline in ``state`` (or this context's) has passed."""
+    deadline = (state or {}).get("deadline") or _deadline.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def check_deadline() -> Optional[float]:
+    """Raise DeadlineExceeded if the deadline has passed, else return the time left."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left
+
+
+# — circuit breakers
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def _before(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_running:
+                # Let exactly one call through to probe the service
+                self._trial_running = True
+                return
+        REGISTRY.observe(f"breaker.{self.name}.rejected", 0.0)
+        raise CircuitOpen(f"{self.name} circuit is open")
+
+    def _success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def _failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                logger.warning("Opening %s circuit after %d failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+    def _release(self) -> None:
+        # The call told us nothing about the service; let the next one probe
+        with self._lock:
+            self._trial_running = False
+
+    def call(self, fn: Callable[[], Any], ignore: Tuple[Type[BaseException], ...] = (),
+             neutral: Tuple[Type[BaseException], ...] = ()) -> Any:
+        """
+        Call ``fn`` unless the breaker is open. Exceptions in ``ignore``
+        (e.g. a bad query) are the caller's fault, not the service's,
+        and don't count as failures. Neither do DeadlineExceeded (the
+        request's budget ran out) and exceptions in ``neutral`` (e.g. a
+        replay miss), which never reached the service at all.
+        """
+        self._before()
+        try:
+            result = fn()
+        except ServiceTimeout:
+            self._failure()
+            raise
+        except ignore:
+            self._success()
+            raise
+        except (DeadlineExceeded,) + tuple(neutral):
+            self._release()
+            raise
+        except Exception:
+            self._failure()
+            raise
+        self._success()
+        return result
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("neo4j", "tavily", "openai")}
+
+
+def breaker_states() -> Dict[str, str]:
+    return {name: b.state for name, b in BREAKERS.items()}
+
+
+# — guarded external calls
+
+# Calls that can't be given a native timeout run here, so the request can
+# stop waiting at its deadline. An abandoned call keeps its worker until it
+# returns; if many hang, later calls time out too and the breaker opens.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("EXTERNAL_CALL_WORKERS", "32")),
+                               thread_name_prefix="external-call")
+
+
+def guarded(service: str, fn: Callable[[], Any], timeout: Optional[float] = None,
+            neutral: Tuple[Type[BaseException], ...] = ()) -> Any:
+    """
+    Call ``fn`` through ``service``'s breaker, giving up after the
+    request's remaining time (capped by ``timeout``). ``fn`` runs in a
+    worker thread with this context's variables. Only running past
+    ``timeout`` counts against the service; running out of the request's
+    budget raises a plain DeadlineExceeded.
+    """
+    left = check_deadline()
+    service_bound = timeout is not None and (left is None or timeout < left)
+    if timeout is not None:
+        left = timeout if left is None else min(left, timeout)
+
+    def run():
+        if left is None:
+            return fn()
+        context = contextvars.copy_context()
+        future = _executor.submit(context.run, fn)
+        try:
+            return future.result(timeout=left)
+        except FutureTimeout:
+            if service_bound:
+                raise ServiceTimeout(f"{service} call did not finish within {left:.1f}s") from None
+            raise DeadlineExceeded(f"Request deadline exceeded waiting for {service}") from None
+
+    return BREAKERS[service].call(run, neutral=neutral)
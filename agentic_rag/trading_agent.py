@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Trading agent: trading topics with ranked book recommendations.
+
+Answers come from a precomputed topic index instead of live searches.
+The index maps each topic of TRADING_TOPICS to its best-matching books,
+with their descriptions. It is built offline from the graph: every BOOK
+is embedded once, scored against each topic by cosine similarity
+(weighted a little by rating), and the top TRADING_BOOKS_PER_TOPIC are
+kept. The result is written to TRADING_INDEX_PATH together with the
+topic embeddings.
+
+At request time the question's embedding (computed once per request
+and shared through ``analysis.embedding``) is compared with the handful
+of topic vectors in memory. The best TRADING_MAX_TOPICS topics are returned as
+[{name, description, books}] with a templated answer, so there is no
+graph traversal and no LLM call. The index file is re-read when it
+changes. Without one, questions go to the web agent.
+
+Build (or rebuild) the index with:
+   python trading_agent.py --build [--books-per-topic 5]
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+from embedding_codec import top_matches
+from graph_agent import GraphDatabaseService, book_text, embed_texts, iter_batches
+from metrics import timed
+from query_analysis import analysis_of
+import resilience
+
+logger = logging.getLogger(__name__)
+
+TRADING_INDEX_PATH = os.getenv("TRADING_INDEX_PATH", "trading_index.json")
+TRADING_MAX_TOPICS = int(os.getenv("TRADING_MAX_TOPICS", "3"))
+TRADING_MIN_SCORE = float(os.getenv("TRADING_MIN_SCORE", "0.35"))
+TRADING_BOOKS_PER_TOPIC = int(os.getenv("TRADING_BOOKS_PER_TOPIC", "5"))
+TRADING_BOOK_MIN_SCORE = float(os.getenv("TRADING_BOOK_MIN_SCORE", "0.3"))
+
+# The taxonomy the index is built for
+TRADING_TOPICS = [
+    {"name": "Technical Analysis",
+     "description": "Reading price charts, patterns, trends and indicators to time trades."},
+    {"name": "Day Trading",
+     "description": "Opening and closing positions within a single session, scalping and intraday setups."},
+    {"name": "Value Investing",
+     "description": "Buying undervalued companies using fundamental analysis, in the tradition of Graham and Buffett."},
+    {"name": "Options Trading",
+     "description": "Calls, puts, spreads, volatility and the greeks for hedging and speculation."},
+    {"name": "Forex Trading",
+     "description": "Trading currency pairs in the foreign exchange market, leverage and macro drivers."},
+    {"name": "Cryptocurrency",
+     "description": "Bitcoin, Ethereum and digital assets, blockchain markets and crypto trading."},
+    {"name": "Trading Psychology",
+     "description": "Discipline, emotions, biases and the mindset of consistently profitable traders."},
+    {"name": "Risk Management",
+     "description": "Position sizing, stop losses, drawdowns and protecting trading capital."},
+    {"name": "Algorithmic Trading",
+     "description": "Quantitative strategies, backtesting and automated systematic trading."},
+    {"name": "Stock Market Investing",
+     "description": "How the stock market works, index funds, portfolios and long-term investing."},
+]
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    m = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms > 0, norms, 1)
+
+
+def build_index(db: GraphDatabaseService, topics: List[Dict[str, str]] = TRADING_TOPICS,
+                books_per_topic: int = TRADING_BOOKS_PER_TOPIC, batch_size: int = 256) -> Dict[str, Any]:
+    """
+    Rank the graph's books for every topic. Books are streamed and embedded
+    a batch at a time, keeping a running top ``books_per_topic`` per topic.
+    """
+    topic_vectors = _unit_rows(embed_texts([f"{t['name']}: {t['description']}" for t in topics]))
+    best: List[List[tuple]] = [[] for _ in topics]
+    seen = 0
+    for batch in iter_batches((b for b in db.iter_books() if b.get("title")), batch_size):
+        sims = _unit_rows(embed_texts([book_text(b) for b in batch])) @ topic_vectors.T
+        for i, book in enumerate(batch):
+            # A good rating lifts a match, it never makes one
+            weight = 0.8 + 0.2 * min(float(book.get("rating") or 0), 5.0) / 5.0
+            for t in np.nonzero(sims[i] >= TRADING_BOOK_MIN_SCORE)[0]:
+                entry = (float(sims[i, t]) * weight, seen + i, book)
+                if len(best[t]) < books_per_topic:
+                    heapq.heappush(best[t], entry)
+                else:
+                    heapq.heappushpop(best[t], entry)
+        seen += len(batch)
+
+    logger.info("Ranked %d books for %d trading topics", seen, len(topics))
+    return {
+        "builtAt": datetime.now(timezone.utc).isoformat(),
+        "topics": [{
+            "name": topic["name"],
+            "description": topic["description"],
+            "embedding": vec.tolist(),
+            "books": [{
+                "title": book["title"],
+                "author": book.get("author"),
+                "rating": book.get("rating"),
+                "description": book.get("description") or "",
+                "matchScore": int(round(score * 100)),
+            } for score, _, book in sorted(ranked, key=lambda e: (-e[0], e[1]))],
+        } for topic, vec, ranked in zip(topics, topic_vectors, best)],
+    }
+
+
+class TopicIndex:
+    """The built index, held in memory and re-read from ``path`` when the file changes."""
+
+    def __init__(self, path: str = TRADING_INDEX_PATH):
+        self.path = path
+        self._topics: List[Dict[str, Any]] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def set(self, index: Dict[str, Any]) -> None:
+        """Serve ``index`` (as returned by build_index) from memory."""
+        topics = [{k: t[k] for k in ("name", "description", "books")} for t in index["topics"]]
+        matrix = _unit_rows([t["embedding"] for t in index["topics"]]) if topics else None
+        with self._lock:
+            self._topics, self._matrix = topics, matrix
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._reload_lock:
+            # Another request may have loaded this version while we waited
+            if mtime == self._mtime:
+                return
+            with open(self.path, encoding="utf-8") as f:
+                self.set(json.load(f))
+            self._mtime = mtime
+        logger.info("Loaded %d trading topics from %s", len(self._topics), self.path)
+
+    def match(self, vec, k: int = TRADING_MAX_TOPICS) -> List[Dict[str, Any]]:
+        """
+        The ``k`` topics closest to ``vec``; ones under TRADING_MIN_SCORE are
+        dropped unless none pass (general questions like "top trading topics").
+        """
+        self._refresh()
+        with self._lock:
+            topics, matrix = self._topics, self._matrix
+        if matrix is None:
+            return []
+        ranked = top_matches(vec, list(range(len(topics))), matrix, k)
+        passing = [i for i, score in ranked if score >= TRADING_MIN_SCORE] or [i for i, _ in ranked]
+        return [dict(topics[i]) for i in passing]
+
+
+TRADING_INDEX = TopicIndex()
+
+
+def trading_answer(topics: List[Dict[str, Any]]) -> str:
+    names = ", ".join(t["name"] for t in topics)
+    top = topics[0]
+    if not top["books"]:
+        return f"These trading topics match your question: {names}."
+    book = top["books"][0]
+    by = f" by {book['author']}" if book.get("author") else ""
+    return (f"These trading topics match your question: {names}. For {top['name']}, "
+            f"a good place to start is {book['title']}{by}. "
+            f"Each topic lists recommended books.")
+
+
+def trading_agent(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer trading questions from the precomputed topic index."""
+    if resilience.expired(state):
+        return {**state, "trading_data": None}
+
+    try:
+        vec = analysis_of(state).embedding
+        with timed("trading.match") as span:
+            topics = TRADING_INDEX.match(vec)
+            span.cache = "hit" if topics else "miss"
+    except Exception:
+        logger.exception("Trading topic lookup failed")
+        topics = []
+
+    if not topics:
+        # No index built yet
+        if state.get("found_in_graph"):
+            return {**state, "trading_data": None}
+        from web_agent import web_agent
+        return {**web_agent(state), "trading_data": None}
+
+    return {**state, "trading_data": topics, "response": trading_answer(topics)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the trading topic index from the book graph.")
+    parser.add_argument("--build", action="store_true", required=True)
+    parser.add_argument("--books-per-topic", type=int, default=TRADING_BOOKS_PER_TOPIC)
+    parser.add_argument("--output", default=TRADING_INDEX_PATH)
+    args = parser.parse_args()
+
+    db = GraphDatabaseService()
+    try:
+        index = build_index(db, books_per_topic=args.books_per_topic)
+    finally:
+        db.close()
+
+    tmp = f"{args.output}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, args.output)
+    print(f"Wrote {len(index['topics'])} topics to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""
+Per-user taste profiles, precomputed from the reading graph.
+
+A user's reading graph is (:USER)-[:RATES {rating}|FINISHED|READING|
+WANTS_TO_READ]->(:BOOK). Each edge gives the book a taste weight: the
+rating / 5 when the user rated it, else STATUS_WEIGHTS for its status. A
+profile holds what answers need, already aggregated:
+
+  read    - titles the user rated, finished or is reading
+  genres  - taste weight per genre of the user's books
+  taste   - weighted sum of the user's book embeddings
+
+The books themselves are embedded once into a catalog matrix. Requests
+only do in-memory work: personal recommendations are one matrix-vector
+product of the catalog with the user's taste, with the read books masked
+out; top genres are read from the profile. Nothing aggregates a user's
+history per request.
+
+Files in USER_PROFILES_DIR (re-read when profiles.json changes):
+  books.json / books.npy - the catalog (title, author, rating, genres) and
+                           its unit-length float32 embeddings, memory-mapped
+  profiles.json          - the profiles, and when they were built
+
+Build everything, then keep the profiles current by rebuilding only the
+users whose reading graph changed since the last run (books new to the
+graph are embedded and appended to the catalog first):
+   python user_profiles.py --build
+   python user_profiles.py --refresh
+Every worker picks up the refreshed profiles.json on its next request.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+USER_PROFILES_DIR = os.getenv("USER_PROFILES_DIR", "user_profiles")
+
+# Taste weight of an unrated book, by reading status
+STATUS_WEIGHTS = {"FINISHED": 0.6, "READING": 0.5, "WANTS_TO_READ": 0.3}
+READ_STATUSES = {"RATES", "FINISHED", "READING"}
+
+
+def taste_weight(statuses: Iterable[str], rating: Optional[float]) -> float:
+    """A rating sets the weight; otherwise the strongest status does."""
+    if rating:
+        return min(float(rating), 5.0) / 5.0
+    return max((STATUS_WEIGHTS.get(s, 0.0) for s in statuses), default=0.0)
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+@dataclass
+class UserProfile:
+    user_id: str
+    books: Dict[str, float]        # title -> taste weight
+    read: Set[str]
+    genres: Dict[str, float]
+    taste: np.ndarray              # weighted sum of book embeddings
+    read_rows: np.ndarray          # catalog rows of the read books
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "books": self.books,
+            "read": sorted(self.read),
+            "genres": self.genres,
+            "taste": [round(float(x), 5) for x in self.taste],
+        }
+
+
+class Catalog:
+    """The embedded books, as metadata rows and a unit-length matrix."""
+
+    def __init__(self, books: List[Dict[str, Any]], matrix: np.ndarray):
+        self.books = books
+        self.matrix = matrix
+        self.rows = {b["title"]: i for i, b in enumerate(books)}
+        # A good rating lifts a match, it never makes one
+        ratings = np.array([min(float(b.get("rating") or 0), 5.0) for b in books], dtype=np.float32)
+        self.rating_weight = 0.8 + 0.2 * ratings / 5.0
+
+    def profile(self, user_id: str, books: Dict[str, float], read: Set[str]) -> UserProfile:
+        """Aggregate a user's weighted books into a profile."""
+        taste = np.zeros(self.matrix.shape[1] if self.matrix.size else 0, dtype=np.float32)
+        genres: Dict[str, float] = {}
+        for title, weight in books.items():
+            row = self.rows.get(title)
+            if row is None:
+                continue
+            taste += weight * self.matrix[row]
+            for genre in self.books[row]["genres"]:
+                genres[genre] = genres.get(genre, 0.0) + weight
+        return UserProfile(user_id, books, read, genres, taste, self.read_rows(read))
+
+    def read_rows(self, read: Set[str]) -> np.ndarray:
+        return np.array(sorted(self.rows[t] for t in read if t in self.rows), dtype=np.int64)
+
+
+def _group_reading(rows: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """userId -> title -> {"statuses", "rating"}"""
+    users: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for r in rows:
+        if not r.get("userId") or not r.get("title"):
+            continue
+        entry = users.setdefault(r["userId"], {}).setdefault(r["title"], {"statuses": set(), "rating": None})
+        entry["statuses"].add(r["rel"])
+        if r["rel"] == "RATES" and r.get("rating") is not None:
+            entry["rating"] = r["rating"]
+    return users
+
+
+def _build_profiles(catalog: Catalog, rows: Iterable[Dict[str, Any]]) -> Dict[str, UserProfile]:
+    profiles = {}
+    for user_id, entries in _group_reading(rows).items():
+        books = {title: taste_weight(e["statuses"], e["rating"]) for title, e in entries.items()}
+        read = {title for title, e in entries.items() if e["statuses"] & READ_STATUSES}
+        profiles[user_id] = catalog.profile(user_id, books, read)
+    return profiles
+
+
+def _embed_books(books: Iterable[Dict[str, Any]], batch_size: int):
+    """(metadata rows, unit-length embedding blocks) of ``books``, a batch at a time."""
+    # Imported here: graph_agent imports this module
+    from graph_agent import book_text, embed_texts, iter_batches
+
+    rows, blocks = [], []
+    for batch in iter_batches(books, batch_size):
+        m = np.asarray(embed_texts([book_text(b) for b in batch]), dtype=np.float32)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        blocks.append(m / np.where(norms > 0, norms, 1))
+        rows.extend({"title": b["title"], "author": b.get("author"), "rating": b.get("rating"),
+                     "genres": list(dict.fromkeys(g for g in b.get("genres") or [] if g))} for b in batch)
+    return rows, blocks
+
+
+def build_catalog(db, batch_size: int = 256) -> Catalog:
+    """Embed every BOOK in the graph, a batch at a time."""
+    books, blocks = _embed_books((b for b in db.iter_books() if b.get("title")), batch_size)
+    matrix = np.vstack(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+    logger.info("Embedded %d books for user profiles", len(books))
+    return Catalog(books, matrix)
+
+
+def extend_catalog(db, catalog: Catalog, batch_size: int = 256) -> Catalog:
+    """``catalog`` plus the BOOKs added to the graph since it was built (existing rows keep their place)."""
+    books, blocks = _embed_books((b for b in db.iter_books()
+                                  if b.get("title") and b["title"] not in catalog.rows), batch_size)
+    if not books:
+        return catalog
+    matrix = np.vstack([catalog.matrix, *blocks]) if catalog.matrix.size else np.vstack(blocks)
+    logger.info("Added %d new books to the user profile catalog", len(books))
+    return Catalog(catalog.books + books, matrix)
+
+
+def build_profiles(db, catalog: Optional[Catalog] = None) -> Dict[str, Any]:
+    """The catalog and every user's profile, as served by ProfileStore."""
+    built_at = datetime.now(timezone.utc).isoformat()
+    catalog = catalog or build_catalog(db)
+    profiles = _build_profiles(catalog, db.iter_reading())
+    logger.info("Built %d user profiles", len(profiles))
+    return {"builtAt": built_at, "catalog": catalog, "profiles": profiles}
+
+
+def refresh_profiles(db, index: Dict[str, Any]) -> int:
+    """
+    Add books new to the graph to the catalog, then rebuild, in place,
+    the profiles of users whose reading graph changed since ``index`` was
+    built or who read one of the new books; returns how many were rebuilt.
+    """
+    # Taken before reading, so edits made meanwhile are picked up next time
+    built_at = datetime.now(timezone.utc).isoformat()
+    changed = set(db.users_changed_since(index["builtAt"]))
+    catalog = extend_catalog(db, index["catalog"])
+    if catalog is not index["catalog"]:
+        added = {b["title"] for b in catalog.books[len(index["catalog"].books):]}
+        # Their books were left out of taste and genres while not in the catalog
+        changed.update(user_id for user_id, p in index["profiles"].items() if added & p.books.keys())
+        index["catalog"] = catalog
+    if changed:
+        rebuilt = _build_profiles(index["catalog"], db.iter_reading(changed))
+        for user_id in changed:
+            # Users left with no reading edges drop out
+            if user_id in rebuilt:
+                index["profiles"][user_id] = rebuilt[user_id]
+            else:
+                index["profiles"].pop(user_id, None)
+    index["builtAt"] = built_at
+    return len(changed)
+
+
+def save(index: Dict[str, Any], directory: str = USER_PROFILES_DIR, catalog: bool = True) -> None:
+    """Write ``index``; profiles.json goes last since readers reload on its change."""
+    os.makedirs(directory, exist_ok=True)
+
+    def write(name: str, dump) -> None:
+        path = os.path.join(directory, name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            dump(f)
+        os.replace(tmp, path)
+
+    if catalog:
+        write("books.npy", lambda f: np.save(f, index["catalog"].matrix))
+        write("books.json", lambda f: f.write(json.dumps(index["catalog"].books).encode("utf-8")))
+    write("profiles.json", lambda f: f.write(json.dumps({
+        "builtAt": index["builtAt"],
+        "profiles": {user_id: p.to_json() for user_id, p in index["profiles"].items()},
+    }).encode("utf-8")))
+
+
+def load(directory: str = USER_PROFILES_DIR) -> Dict[str, Any]:
+    with open(os.path.join(directory, "books.json"), encoding="utf-8") as f:
+        books = json.load(f)
+    matrix = np.load(os.path.join(directory, "books.npy"), mmap_mode="r")
+    catalog = Catalog(books, matrix)
+    with open(os.path.join(directory, "profiles.json"), encoding="utf-8") as f:
+        stored = json.load(f)
+    profiles = {}
+    for user_id, p in stored["profiles"].items():
+        read = set(p["read"])
+        profiles[user_id] = UserProfile(user_id, p["books"], read, p["genres"],
+                                        np.asarray(p["taste"], dtype=np.float32), catalog.read_rows(read))
+    return {"builtAt": stored["builtAt"], "catalog": catalog, "profiles": profiles}
+
+
+class ProfileStore:
+    """The built profiles, held in memory and re-read from ``directory`` when they change."""
+
+    def __init__(self, directory: str = USER_PROFILES_DIR):
+        self.directory = directory
+        self._catalog: Optional[Catalog] = None
+        self._profiles: Dict[str, UserProfile] = {}
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def set(self, index: Dict[str, Any]) -> None:
+        """Serve ``index`` (as returned by build_profiles) from memory."""
+        with self._lock:
+            self._catalog, self._profiles = index["catalog"], dict(index["profiles"])
+
+    def _refresh(self) -> None:
+        if not self.directory:
+            return
+        try:
+            mtime = os.stat(os.path.join(self.directory, "profiles.json")).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._reload_lock:
+            # Another request may have loaded this version while we waited
+            if mtime == self._mtime:
+                return
+            self.set(load(self.directory))
+            self._mtime = mtime
+        logger.info("Loaded %d user profiles from %s", len(self._profiles), self.directory)
+
+    def get(self, user_id: Optional[str]) -> Optional[UserProfile]:
+        return self._snapshot(user_id)[1]
+
+    def _snapshot(self, user_id: Optional[str]) -> Tuple[Optional[Catalog], Optional[UserProfile]]:
+        # Catalog and profile from the same index, even if a reload swaps it meanwhile
+        if not user_id:
+            return None, None
+        self._refresh()
+        with self._lock:
+            return self._catalog, self._profiles.get(str(user_id))
+
+    def recommend(self, user_id: Optional[str], k: int = 3) -> List[Dict[str, Any]]:
+        """The ``k`` unread books closest to the user's taste; [] without a profile."""
+        catalog, profile = self._snapshot(user_id)
+        if profile is None or catalog is None or not np.any(profile.taste) or k <= 0:
+            return []
+        sims = np.asarray(catalog.matrix @ _unit(profile.taste))
+        scores = sims * catalog.rating_weight
+        scores[profile.read_rows] = -np.inf
+        k = min(k, len(scores) - len(profile.read_rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{
+            "title": catalog.books[i]["title"],
+            "author": catalog.books[i]["author"],
+            "rating": catalog.books[i]["rating"],
+            "matchScore": int(round(max(float(sims[i]), 0.0) * 100)),
+        } for i in top]
+
+    def top_genres(self, user_id: Optional[str], limit: int = 3) -> List[Dict[str, Any]]:
+        """The user's genres by taste weight, as a share of their books; [] without a profile."""
+        catalog, profile = self._snapshot(user_id)
+        if profile is None or not profile.genres:
+            return []
+        total = sum(w for t, w in profile.books.items() if catalog and t in catalog.rows) or 1.0
+        ranked = sorted(profile.genres.items(), key=lambda kv: -kv[1])[:limit]
+        return [{"name": genre, "percentage": int(round(weight / total * 100))} for genre, weight in ranked]
+
+    def unread(self, user_id: Optional[str], books: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """``books`` without the ones the user has already read."""
+        profile = self.get(user_id)
+        if profile is None:
+            return books
+        return [b for b in books if b.get("title") not in profile.read]
+
+
+USER_PROFILES = ProfileStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or refresh the per-user taste profiles.")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--build", action="store_true", help="embed the catalog and build every profile")
+    mode.add_argument("--refresh", action="store_true", help="rebuild users whose reading changed since the last run")
+    parser.add_argument("--dir", default=USER_PROFILES_DIR)
+    args = parser.parse_args()
+
+    from graph_agent import GraphDatabaseService
+
+    db = GraphDatabaseService()
+    try:
+        if args.build:
+            index = build_profiles(db)
+            save(index, args.dir)
+            print(f"Wrote {len(index['catalog'].books)} books and {len(index['profiles'])} profiles to {args.dir}")
+        else:
+            index = load(args.dir)
+            books = len(index["catalog"].books)
+            changed = refresh_profiles(db, index)
+            added = len(index["catalog"].books) - books
+            save(index, args.dir, catalog=added > 0)
+            print(f"Added {added} books and rebuilt {changed} profiles in {args.dir}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Cache warming job for the Query/WebResult graph.
+
+Pre-populates the web-result cache (via ``save_web_results``) and the
+in-process embedding cache for a list of common questions, so the first
+users after a deploy or a Neo4j restore don't pay the full
+Tavily + embedding path.
+
+Usage:
+   python warm_cache.py --examples
+   python warm_cache.py --file queries.txt
+   python warm_cache.py --log chat_log.jsonl --top 200
+
+Progress is appended to a state file after every query, so an
+interrupted run picks up where it left off (use --reset to start over).
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+from graph_agent import GraphDatabaseService, normalize_text, embed_texts
+import passages
+from rate_limit import RateLimiter
+from web_agent import web_search, enrich_with_embeddings
+from log_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_FILE = ".warm_cache_state.jsonl"
+
+
+def load_queries_from_file(path: str) -> List[str]:
+    """One query per line; blank lines and lines starting with # are skipped."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def load_queries_from_log(path: str, top: Optional[int] = None) -> List[str]:
+    """
+    Read a chat log export and return its queries, most frequent first.
+    Each line may be a JSON object with a ``query`` or ``message`` field
+    (the /api/chat and /api/frontend-chat payloads) or plain text.
+    """
+    counts: Counter = Counter()
+    originals: Dict[str, str] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            query = line
+            if line.startswith("{"):
+                try:
+                    entry = json.loads(line)
+                    query = entry.get("query") or entry.get("message") or ""
+                except json.JSONDecodeError:
+                    pass
+            norm = normalize_text(query)
+            if norm:
+                counts[norm] += 1
+                originals.setdefault(norm, query)
+    return [originals[norm] for norm, _ in counts.most_common(top)]
+
+
+def load_example_queries() -> List[str]:
+    from examples import example_queries
+    return list(example_queries)
+
+
+def _load_done(state_file: str) -> set:
+    done = set()
+    if os.path.exists(state_file):
+        with open(state_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["norm"])
+                except (json.JSONDecodeError, KeyError):
+                    continue
+    return done
+
+
+def warm_cache(queries: Iterable[str],
+               state_file: str = DEFAULT_STATE_FILE,
+               tavily_rate: float = 1.0,
+               reset: bool = False) -> Dict[str, int]:
+    """
+    Make sure every query has cached web results and a cached embedding.
+
+    Tavily calls are paced to ``tavily_rate`` per second. Returns counts
+    of queries that were already cached, newly fetched, skipped (done in
+    an earlier run) or failed.
+    """
+    if reset and os.path.exists(state_file):
+        os.remove(state_file)
+    done = _load_done(state_file)
+    limiter = RateLimiter(tavily_rate)
+    stats = {"cached": 0, "fetched": 0, "skipped": 0, "failed": 0}
+
+    # Dedupe on the same normalization the Query cache uses
+    unique: Dict[str, str] = {}
+    for q in queries:
+        unique.setdefault(normalize_text(q), q)
+
+    # Warm the embedding cache for everything in one batch
+    embed_texts(list(unique))
+
+    db = GraphDatabaseService()
+    try:
+        cached = db.get_cached_web_results_bulk(list(unique), track=False)
+        with open(state_file, "a", encoding="utf-8") as progress:
+            for norm, query in unique.items():
+                if norm in done:
+                    stats["skipped"] += 1
+                    continue
+                try:
+                    if cached.get(norm):
+                        stats["cached"] += 1
+                    else:
+                        limiter.acquire()
+                        results = [r for r in web_search.invoke(query)
+                                   if r.get("url") and r.get("title") != "Error"]
+                        if not results:
+                            logger.warning("No usable web results for: %s", query)
+                            stats["failed"] += 1
+                            continue
+                        db.save_web_results(query, enrich_with_embeddings(results), exact=True)
+                        passages.ingest(db, results)
+                        stats["fetched"] += 1
+                    progress.write(json.dumps({"norm": norm, "query": query}) + "\n")
+                    progress.flush()
+                except Exception:
+                    logger.exception("Error warming cache for '%s'", query)
+                    stats["failed"] += 1
+    finally:
+        db.close()
+
+    return stats
+
+
+def start_background_warmup(queries: List[str], **kwargs) -> threading.Thread:
+    """Run warm_cache in a daemon thread (e.g. at app startup)."""
+    def run():
+        stats = warm_cache(queries, **kwargs)
+        logger.info("Cache warmup finished", extra=stats)
+
+    thread = threading.Thread(target=run, name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Pre-populate the query and web result caches.")
+    parser.add_argument("--examples", action="store_true", help="warm the UI's example queries")
+    parser.add_argument("--file", help="text file with one query per line")
+    parser.add_argument("--log", help="chat log export (JSON lines or plain text)")
+    parser.add_argument("--top", type=int, default=None, help="only warm the N most frequent log queries")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE, help="progress file used to resume")
+    parser.add_argument("--tavily-rate", type=float, default=1.0, help="max Tavily searches per second")
+    parser.add_argument("--reset", action="store_true", help="ignore progress from earlier runs")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    queries: List[str] = []
+    if args.examples:
+        queries += load_example_queries()
+    if args.file:
+        queries += load_queries_from_file(args.file)
+    if args.log:
+        queries += load_queries_from_log(args.log, args.top)
+    if not queries:
+        parser.error("no queries given; use --examples, --file or --log")
+
+    logger.info("Warming cache for %d queries", len(queries))
+    stats = warm_cache(queries, state_file=args.state_file,
+                       tavily_rate=args.tavily_rate, reset=args.reset)
+    logger.info("Cache warmup finished", extra=stats)
+
+
+if __name__ == "__main__":
+    main()
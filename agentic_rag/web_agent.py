@@ -2,14 +2,25 @@ import os
 from typing import Dict, Any, List
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
 import json
+import logging
 import sys
-import traceback
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from graph_agent import GraphDatabaseService, embed_text
+from graph_agent import GraphDatabaseService, complete, embed_texts
+import content_store
+import passages
+import cassette
+import resilience
+from resilience import CircuitOpen, DeadlineExceeded
+from metrics import timed
+from query_analysis import analysis_of
+
+logger = logging.getLogger(__name__)
+
+# Characters of each source that go into web prompts; above CONTENT_PREVIEW_CHARS,
+# cached results have their full bodies loaded
+WEB_PROMPT_SOURCE_CHARS = int(os.getenv("WEB_PROMPT_SOURCE_CHARS", "500"))
 
 
 # Create a Tavily search tool
@@ -46,6 +57,9 @@ def clean_search_results(results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
             "content": result.get("content", "") if isinstance(result, dict) else str(result),
             "url": result.get("url", "") if isinstance(result, dict) else "",
         }
+        # Full page text (include_raw_content), kept only for passage ingestion
+        if result.get("raw_content"):
+            cleaned_result["raw_content"] = result["raw_content"]
         cleaned_results.append(cleaned_result)
     
     # If we got no valid results, add a message
@@ -54,6 +68,24 @@ def clean_search_results(results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         
     return cleaned_results
 
+def enrich_with_embeddings(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Return copies of the results with an ``embedding`` of title + content, embedded in one batch."""
+    enriched = [dict(r) for r in results]  # Copies, to avoid modifying the originals
+    try:
+        texts = [f"{r.get('title', '')}\n{r.get('content', '')}" for r in enriched]
+        for r, vec in zip(enriched, embed_texts(texts)):
+            r["embedding"] = vec
+    except Exception as embed_error:
+        logger.warning("Error creating embeddings: %s", embed_error)
+        # Add dummy embeddings if needed
+        for r in enriched:
+            r["embedding"] = []
+    return enriched
+
+def public_results(results: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Results as returned to clients: title, content and url (no raw page text or embeddings)."""
+    return [{"title": r.get("title"), "content": r.get("content"), "url": r.get("url")} for r in results]
+
 @tool
 def web_search(query: str) -> List[Dict[str, str]]:
     """Search the web for information related to the query."""
@@ -62,44 +94,71 @@ def web_search(query: str) -> List[Dict[str, str]]:
         enhanced_query = f"book information {query}"
         
         # Execute search via Tavily
-        search_results = tavily_search.invoke(enhanced_query)
+        with timed("tavily.search"):
+            search_results = resilience.guarded("tavily", lambda: cassette.through(
+                "tavily.search", {"query": enhanced_query}, lambda: tavily_search.invoke(enhanced_query)),
+                neutral=(cassette.CassetteMiss,))
         
         # Process and return the results
         return clean_search_results(search_results)
+    except (CircuitOpen, DeadlineExceeded):
+        # Let web_agent degrade instead of answering from an error "result"
+        raise
     except Exception as e:
-        print(f"Error in web search: {e}")
+        logger.warning("Error in web search: %s", e)
         # Return a structured error response instead of raising an exception
         return [{"title": "Error", "content": f"Failed to perform web search: {str(e)}", "url": ""}]
 
 def web_agent(state: Dict[str, Any]) -> Dict[str, Any]:
     """Process web search for the query and return enriched state"""
-    print(f"Web agent processing query: {state['query']}")
     user_q = state["query"]
+    logger.debug("Web agent processing query: %s", user_q)
+    if resilience.expired(state):
+        return {**state, "web_data": [], "found_in_graph": False}
     
     # Check if we have cached web results
     db = GraphDatabaseService()
     try:
-        cached_results = db.get_cached_web_results(user_q)
+        with timed("web.cache_lookup") as span:
+            # Stale results are served while a refresh runs; expired ones count as a miss
+            cached_results, freshness = db.lookup_web_results(user_q)
+            span.cache = "hit" if freshness == "fresh" else freshness
         if cached_results and len(cached_results) > 0:
-            print(f"Using cached web results for query: {user_q}")
-            response_text = generate_response_from_web_results(user_q, cached_results)
+            logger.debug("Using cached web results for query: %s", user_q)
+            # Only previews are read from the cache; full bodies are loaded if the prompt wants more
+            prompt_results = content_store.with_full_content(db, cached_results[:4], WEB_PROMPT_SOURCE_CHARS)
+            response_text = generate_response_from_web_results(user_q, prompt_results)
             
             return {
                 **state,
-                "web_data": cached_results,
+                "web_data": public_results(cached_results),
                 "response": response_text,
                 "found_in_graph": False  # This should be False to indicate it's from web
             }
-    except Exception as e:
-        print(f"Error checking for cached web results: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error checking for cached web results")
         # Continue with search if cache retrieval fails
+
+    # Answer from passages of pages fetched for earlier questions, if they cover this one
+    try:
+        local_passages = passages.retrieve(db, user_q, vec=analysis_of(state).embedding)
+        if passages.has_enough(local_passages):
+            logger.debug("Answering from %d cached passages: %s", len(local_passages), user_q)
+            local_results = public_results(local_passages)
+            return {
+                **state,
+                "web_data": local_results,
+                "response": generate_response_from_web_results(user_q, local_results),
+                "found_in_graph": False
+            }
+    except Exception as e:
+        logger.warning("Passage retrieval failed, searching the web: %s", e)
     
     # Perform web search
     try:
-        print(f"Performing web search for: {user_q}")
+        logger.debug("Performing web search for: %s", user_q)
         raw_results = web_search.invoke(user_q)
-        print(f"Received {len(raw_results)} web search results")
+        logger.debug("Received %d web search results", len(raw_results))
         
         if not raw_results or len(raw_results) == 0:
             return {
@@ -114,49 +173,36 @@ def web_agent(state: Dict[str, Any]) -> Dict[str, Any]:
             
         # Try to enrich the results with embeddings
         try:
-            enriched = []
-            for r in raw_results:
-                result_copy = dict(r)  # Make a copy to avoid modifying the original
-                try:
-                    text = f"{result_copy['title']}\n{result_copy['content']}"
-                    result_copy["embedding"] = embed_text(text)
-                except Exception as embed_error:
-                    print(f"Error creating embedding: {embed_error}")
-                    # Add a dummy embedding if needed
-                    result_copy["embedding"] = []
-                    
-                enriched.append(result_copy)
+            enriched = enrich_with_embeddings(raw_results)
                 
             # Try to save to Neo4j
             try:
                 db.save_web_results(user_q, enriched)
-                print(f"Saved {len(enriched)} web results to Neo4j")
-            except Exception as save_error:
-                print(f"Error saving web results to Neo4j: {save_error}")
-                traceback.print_exc()
+                logger.debug("Saved %d web results to Neo4j", len(enriched))
+                passages.ingest_in_background(raw_results)
+            except Exception:
+                logger.exception("Error saving web results to Neo4j")
                 
             # Return with the enriched data and response
             return {
                 **state,
-                "web_data": raw_results,  # Use raw results without embeddings for the response
+                "web_data": public_results(raw_results),  # Without embeddings or raw page text
                 "response": response_text,
                 "found_in_graph": False  # Set to False for web results
             }
             
-        except Exception as enrich_error:
-            print(f"Error enriching results: {enrich_error}")
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error enriching results")
             # Fall back to raw results without embeddings
             return {
                 **state,
-                "web_data": raw_results,
+                "web_data": public_results(raw_results),
                 "response": response_text,
                 "found_in_graph": False
             }
             
-    except Exception as e:
-        print(f"Web search failed: {e}")
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Web search failed")
         return {
             **state,
             "web_data": [],
@@ -179,18 +225,13 @@ def generate_response_from_web_results(query: str, results: List[Dict[str, Any]]
         prompt = format_web_results_prompt(query, results)
         
         # Use OpenAI to generate a response
-        model = ChatOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4",
-            temperature=0.7
-        )
-        
-        print(f"Sending web results to OpenAI for query: {query}")
-        response = model.invoke([HumanMessage(content=prompt)])
-        return response.content
+        logger.debug("Sending web results to OpenAI for query: %s", query)
+        return complete(prompt, "web", "synthesis", [r.get("title") for r in results[:4]])
     except Exception as e:
-        print(f"Error generating response from web results: {e}")
-        traceback.print_exc()
+        if isinstance(e, (CircuitOpen, DeadlineExceeded)):
+            logger.warning("Skipping web response generation: %s", e)
+        else:
+            logger.exception("Error generating response from web results")
         
         # Fallback to a simple response using the results
         if results and len(results) > 0:
@@ -215,7 +256,8 @@ def format_web_results_prompt(query: str, results: List[Dict[str, Any]]) -> str:
         
         formatted_results += f"Source {i+1}: {title}\n"
         formatted_results += f"URL: {url}\n"
-        formatted_results += f"Content: {content[:500]}{'...' if len(content) > 500 else ''}\n\n"
+        formatted_results += (f"Content: {content[:WEB_PROMPT_SOURCE_CHARS]}"
+                              f"{'...' if len(content) > WEB_PROMPT_SOURCE_CHARS else ''}\n\n")
     
     prompt = f"""
 You are a helpful assistant for a book social network called BookLovers. 
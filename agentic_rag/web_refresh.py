@@ -0,0 +1,118 @@
+"""
+Background revalidation of stale cached web results.
+
+``get_cached_web_results`` serves results older than WEB_CACHE_SOFT_TTL
+straight away and hands the question to REFRESH_SCHEDULER, which re-runs
+the Tavily search and re-embeds the results off the request path. Each
+question is refreshed at most once at a time and not again within
+WEB_REFRESH_COOLDOWN seconds (so a failing refresh isn't retried on
+every request). Refreshes are paced to WEB_REFRESH_RATE per second with
+the same RateLimiter the cache warmer uses, and dropped when
+WEB_REFRESH_MAX_PENDING are already waiting.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List
+
+from graph_agent import GraphDatabaseService, normalize_text
+import passages
+from metrics import timed
+from rate_limit import RateLimiter
+from web_agent import web_search, enrich_with_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    def __init__(self, rate: float = 0.5, workers: int = 1, max_pending: int = 256, cooldown: float = 300.0):
+        self.limiter = RateLimiter(rate)
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.cooldown = cooldown
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending: set = set()
+        self._recent: Dict[str, float] = {}
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.counts = {"scheduled": 0, "deduped": 0, "dropped": 0, "refreshed": 0, "failed": 0}
+
+    @classmethod
+    def from_env(cls) -> "RefreshScheduler":
+        return cls(
+            rate=float(os.getenv("WEB_REFRESH_RATE", "0.5")),
+            workers=int(os.getenv("WEB_REFRESH_WORKERS", "1")),
+            max_pending=int(os.getenv("WEB_REFRESH_MAX_PENDING", "256")),
+            cooldown=float(os.getenv("WEB_REFRESH_COOLDOWN", "300")),
+        )
+
+    def schedule(self, query: str) -> bool:
+        """Queue a refresh of ``query``'s cached results; False if deduped or dropped."""
+        norm = normalize_text(query)
+        now = time.monotonic()
+        with self._lock:
+            if norm in self._pending or now - self._recent.get(norm, float("-inf")) < self.cooldown:
+                self.counts["deduped"] += 1
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.counts["dropped"] += 1
+                return False
+            self._pending.add(norm)
+            self.counts["scheduled"] += 1
+            self._start_workers()
+        self._queue.put(query)
+        return True
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"web-refresh-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            query = self._queue.get()
+            norm = normalize_text(query)
+            try:
+                self.limiter.acquire()
+                refreshed = self.refresh(query)
+            except Exception:
+                logger.exception("Error refreshing cached web results for '%s'", query)
+                refreshed = False
+            with self._lock:
+                self._pending.discard(norm)
+                self._recent[norm] = time.monotonic()
+                self.counts["refreshed" if refreshed else "failed"] += 1
+                self._forget_old()
+
+    def _forget_old(self) -> None:
+        cutoff = time.monotonic() - self.cooldown
+        for norm in [n for n, t in self._recent.items() if t < cutoff]:
+            del self._recent[norm]
+
+    def refresh(self, query: str) -> bool:
+        """Search again and replace the cached results for ``query``; True if anything was saved."""
+        with timed("web.refresh") as span:
+            results = [r for r in web_search.invoke(query) if r.get("url") and r.get("title") != "Error"]
+            span.cache = "refreshed" if results else "failed"
+            if not results:
+                logger.warning("No usable web results refreshing: %s", query)
+                return False
+            db = GraphDatabaseService()
+            try:
+                # exact: update the entry that was served, not whichever Query is most similar
+                db.save_web_results(query, enrich_with_embeddings(results), exact=True)
+                passages.ingest(db, results)
+            finally:
+                db.close()
+        logger.info("Refreshed %d cached web results for: %s", len(results), query)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pending": len(self._pending), **self.counts}
+
+
+REFRESH_SCHEDULER = RefreshScheduler.from_env()